@@ -1,22 +1,21 @@
 from dataclasses import dataclass
 from datetime import datetime
 import os
-import json
-from typing import List
-import calendar
-
-import fnmatch
+import re
+from typing import List, Iterator
 
 import pandas as pd
 import numpy as np
 
+from utils.categories import subcategory_mapping
+from utils.months import MonthKey, month_keys, month_label, month_period, month_range
 from utils.log import get_logger
 logger = get_logger(__name__)
 
 
 @dataclass
 class SchemaMonzo:
-    ID: str = 'id'
+    ID: str = 'id'  # Monzo's transaction id, then the spending table's id (the transaction id and split index)
     DATE: str = 'Date'
     TIME: str = 'Time'
     TYPE: str = 'Type'
@@ -43,6 +42,12 @@ class SchemaMonzo:
     TOTAL: str = 'Total'
     DIFFERENCE: str = 'Diff.'
 
+    # DATABASE (ids of the lookup tables the spending table's repeated strings are stored in)
+    TYPE_ID: str = 'type_id'
+    MERCHANT_ID: str = 'merchant_id'
+    CATEGORY_ID: str = 'category_id'
+    ADDRESS_ID: str = 'address_id'
+
     @property
     def df_columns_initial(self) -> List[str]:
         '''provides all the columns in necessary order for correct extraction to dataframe'''
@@ -147,51 +152,190 @@ class SchemaInvestmentFixed:
         return [self.ID, self.NAME, self.COMPANY, self.AMOUNT, self.INTEREST, self.DURATION, self.PURCHASE_DATE, self.MATURITY_DATE, self.RETURN]
 
 
+@dataclass
+class SchemaIngestedFile:
+    ID: str = 'id'
+    PATH: str = 'path'
+    SOURCE: str = 'source'
+    MONTH_ID: str = 'month_id'
+    SIZE: str = 'size'
+    MTIME: str = 'mtime'
+    SHA256: str = 'sha256'
+    DATETIME: str = 'Date'
+
+    @property
+    def df_columns_final(self) -> List[str]:
+        '''provides all the columns in necessary order for correct exporting of dataframe'''
+        return [self.ID, self.PATH, self.SOURCE, self.MONTH_ID, self.SIZE, self.MTIME, self.SHA256, self.DATETIME]
+
+
+class DataFileIndex:
+    '''
+    index of the input files in data/statements and data/inputs. Each folder is listed once and every file name parsed
+    for its kind, DEMO prefix and month, so finding a month's file is a dict lookup rather than a scan of the folder.
+    A folder is only listed again if its mtime changes (i.e. a file is added, removed or renamed).
+    '''
+    # kind: (folder, file name pattern, month format of the "month" group)
+    PATTERNS: dict = {'monzo': ('statements', re.compile(r'(?P<demo>DEMO )?MonzoDataExport_(?P<month>[A-Za-z]+_\d{4}).*\.csv'),
+                                '%B_%Y'),
+                      'inputs': ('inputs', re.compile(r'(?P<demo>DEMO )?inputs_(?P<month>\d{2}_\d{2}).*\.csv'), '%m_%y'),
+                      'investments_variable': ('inputs', re.compile(r'(?P<demo>DEMO )?investments_variable_(?P<month>\d{2}_\d{2}).*\.csv'),
+                                               '%m_%y'),
+                      'investments_fixed': ('inputs', re.compile(r'(?P<demo>DEMO )?investments_fixed\.csv'), None)}
+    FILE_NAMES: dict = {'monzo': 'MonzoDataExport_{Month}_{YYYY}*.csv', 'inputs': 'inputs_{mm}_{yy}*.csv',
+                        'investments_variable': 'investments_variable_{mm}_{yy}*.csv',
+                        'investments_fixed': 'investments_fixed.csv'}
+
+    def __init__(self, data_folder: str = 'data'):
+        self.data_folder = data_folder
+        self._scans = {}  # {absolute folder path: (mtime, {(kind, demo, month_id): [paths]})}
+
+    def folder(self, kind: str) -> str:
+        '''the folder that files of kind are kept in'''
+        return os.path.join(self.data_folder, self.PATTERNS[kind][0])
+
+    def scan(self, folder: str) -> dict:
+        '''
+        the files in folder keyed by what their names are parsed as, listing the folder only if it has changed
+
+        :return: dict of {(kind, demo, month_id): [paths]}, with month_id None for files used by every month
+        '''
+        key = os.path.abspath(folder)
+        mtime = os.stat(folder).st_mtime_ns
+        if key in self._scans and self._scans[key][0] == mtime:
+            return self._scans[key][1]
+
+        patterns = [(kind, pattern, month_format) for kind, (_, pattern, month_format) in self.PATTERNS.items()
+                    if self.folder(kind) == folder]
+        files = {}
+        for file in sorted(os.listdir(folder)):
+            for kind, pattern, month_format in patterns:
+                match = pattern.fullmatch(file)
+                if match is None:
+                    continue
+                month_id = None
+                if month_format is not None:
+                    try:
+                        date = datetime.strptime(match['month'], month_format)
+                        month_id = date.year * 100 + date.month
+                    except ValueError:  # e.g. not a month name
+                        continue
+                files.setdefault((kind, match['demo'] is not None, month_id), []).append(os.path.join(folder, file))
+
+        self._scans[key] = (mtime, files)
+
+        return files
+
+    def candidates(self, kind: str, month_id: MonthKey = None, demo: bool = False) -> list[str]:
+        '''every file of kind for month_id (ignored for investments_fixed)'''
+        if self.PATTERNS[kind][2] is None:
+            month_id = None
+
+        return self.scan(self.folder(kind)).get((kind, bool(demo), month_id), [])
+
+    def find(self, kind: str, month_id: MonthKey = None, demo: bool = False) -> str:
+        '''path of the file of kind for month_id, raising a ValueError if there is not exactly one'''
+        problem = self.problem(kind, month_id, demo)
+        if problem is not None:
+            raise ValueError(problem)
+
+        return self.candidates(kind, month_id, demo)[0]
+
+    def problem(self, kind: str, month_id: MonthKey = None, demo: bool = False) -> str:
+        '''why the file of kind for month_id cannot be found, or None if there is exactly one'''
+        files = self.candidates(kind, month_id, demo)
+        file_name = ('DEMO ' if demo else '') + self.FILE_NAMES[kind]
+        month = None if month_id is None else month_label(month_id)
+        if len(files) == 0:
+            return f'No files found in {self.folder(kind)} matching {file_name} for {month}'
+        elif len(files) > 1:
+            return f'More than one file matches {file_name} for {month} - {[os.path.basename(f) for f in files]}'
+
+        return None
+
+    def check(self, tasks: list[tuple[str, MonthKey]], demo: bool = False) -> None:
+        '''
+        checks there is exactly one file for every (kind, month_id) task, raising a ValueError that lists the missing and
+        ambiguous files of all months at once, rather than stopping at the first
+        '''
+        problems = dict.fromkeys(problem for kind, month_id in tasks
+                                 if (problem := self.problem(kind, month_id, demo)) is not None)
+        if problems:
+            raise ValueError(f'{len(problems)} input file(s) cannot be used:\n' + '\n'.join(problems))
+
+
+DATA_FILES = DataFileIndex()
+
+
 class Finances:
-    MONTH_FORMAT: str = '%b %y'
 
-    def __init__(self, month_id: str) -> object:
-        ''' month_id in the format "MMM YY" '''
+    def __init__(self, month_id: MonthKey) -> object:
+        ''' month_id as an integer yyyymm (see utils/months.py) '''
         self.month_id = month_id
 
-    def add_datetime_column(self, df: pd.DataFrame, month_id: str) -> pd.Series:
+    @property
+    def month_period(self) -> pd.Period:
+        '''the calendar month of month_id as a pandas Period'''
+        return month_period(self.month_id)
+
+    @property
+    def month_start(self) -> pd.Timestamp:
+        '''first day of the month'''
+        return self.month_period.start_time
 
-        dt = datetime.strptime(self.month_id, self.MONTH_FORMAT)
-        _, month_length = calendar.monthrange(dt.year, dt.month)
+    @property
+    def month_end(self) -> pd.Timestamp:
+        '''last day of the month (at midnight)'''
+        return self.month_period.end_time.normalize()
 
-        return dt + pd.DateOffset(days=month_length-1)  # last day of the month
+    @classmethod
+    def month_range(cls, start_month_id: MonthKey, end_month_id: MonthKey) -> List[MonthKey]:
+        '''all month_ids from start_month_id to end_month_id inclusive, in chronological order'''
+        return month_range(start_month_id, end_month_id)
 
-    def add_month_id_column(self, df: pd.DataFrame) -> pd.Series:
-        '''adds month column (MMM YY) to existing dataframe based on datetime column'''
+    def add_datetime_column(self, df: pd.DataFrame, month_id: MonthKey) -> pd.Series:
 
-        extract_MMM_YY = lambda x: datetime.strftime(x, self.MONTH_FORMAT).upper()
+        return self.month_end  # last day of the month
 
-        return df[self.SCHEMA.DATETIME].apply(extract_MMM_YY)
+    def add_month_id_column(self, df: pd.DataFrame) -> pd.Series:
+        '''adds month column (yyyymm) to existing dataframe based on datetime column'''
+        return month_keys(df[self.SCHEMA.DATETIME])
 
     def add_category_column(self, df: pd.DataFrame) -> pd.Series:
-        '''adds category column to existing dataframe based on subcategory column and json mapping'''
+        '''
+        adds category column to existing dataframe based on subcategory column and json mapping, as a categorical in the
+        order of sub_category.json
+        '''
+        mapping = subcategory_mapping()
+        subcategory = df[self.SCHEMA.SUBCATEGORY].astype(mapping.subcategories)  # NaN if not in the mapping
+
+        diff = set(df.loc[subcategory.isna(), self.SCHEMA.SUBCATEGORY])
+        if diff != set():
+            raise ValueError(f'Monzo statement contains subcategories missing from sub_category.json ({diff})')
 
-        # read in configurations from json
-        with open("utils/sub_category.json") as jsn:
-            mapper = jsn.read()
+        # map each subcategory code to its category's code, rather than every row's string
+        category_codes = mapping.categories.categories.get_indexer(list(mapping.mapping.values()))
+        codes = category_codes[subcategory.cat.codes.to_numpy()]
 
-        # decoding the JSON to dictionary
-        sub_category = json.loads(mapper)
+        return pd.Series(pd.Categorical.from_codes(codes, dtype=mapping.categories), index=df.index)
 
-        df_subcategories = set(df[self.SCHEMA.SUBCATEGORY])
-        json_subcategories = set(sub_category.keys())
-        diff = df_subcategories.difference(json_subcategories)
-        if diff != set():
-            raise ValueError(f'Monzo statement contains subcategories missing from sub_category.json ({diff})')
-        return df[self.SCHEMA.SUBCATEGORY].map(sub_category)
+    def add_subcategory_column(self, df: pd.DataFrame) -> pd.Series:
+        '''
+        the subcategory column as a categorical in the order of sub_category.json, followed by any subcategories missing
+        from it (e.g. from a split payment)
+        '''
+        dtype = subcategory_mapping().subcategories
+        other = sorted(set(df[self.SCHEMA.SUBCATEGORY].dropna()).difference(dtype.categories))
+        if other:
+            dtype = pd.CategoricalDtype([*dtype.categories, *other], ordered=True)
+
+        return df[self.SCHEMA.SUBCATEGORY].astype(dtype)
 
     def add_id_column(self, df: pd.DataFrame) -> pd.Series:
         '''adds id column to existing dataframe based on month_id and index. To be used as primary key'''
+        idx = pd.Series(np.arange(len(df)), index=df.index).astype(str).str.zfill(4)
 
-        df = df.reset_index(drop=True).reset_index(names='idx')
-        df.idx = df.idx.astype(str).str.zfill(4)
-
-        return df[self.SCHEMA.MONTH_ID] + ' ' + df.idx
+        return df[self.SCHEMA.MONTH_ID].astype(str) + ' ' + idx
 
     def convert_to_pennies(self, col: pd.Series) -> pd.Series:
         '''converts all money to pennies so that it can be stored as an integer'''
@@ -210,74 +354,179 @@ class Monzo(Finances):
         if os.getenv('DEBUG'):
             df = DEBUG
         else:
-            log_folder = os.path.join('data', 'statements')
-            dt = datetime.strptime(self.month_id, self.MONTH_FORMAT)
-            month = datetime.strftime(dt, '%B')
-            year = datetime.strftime(dt, '%Y')
-            if demo:
-                file = fnmatch.filter(os.listdir(log_folder), f'DEMO MonzoDataExport_{month}_{year}*.csv')
-            else:
-                file = fnmatch.filter(os.listdir(log_folder), f'MonzoDataExport_{month}_{year}*.csv')
-            if len(file) == 0:
-                raise ValueError(f'No files found in {log_folder} matching MonzoDataExport_{month}_{year}*.csv')
-            elif len(file) > 1:
-                raise ValueError(f'More than one file matches MonzoDataExport_{month}_{year}*.csv - {file}')
-            log_file = os.path.join(log_folder, file[0])
-
-            df = pd.read_csv(log_file, skiprows=self.SKIPROWS, names=self.SCHEMA.df_columns_initial)
+            df = self.read_statement(self.find_file(demo))
+
+        return self.transform(df)
+
+    def preprocess_chunks(self, chunksize: int, demo=False, log_file: str = None) -> Iterator[tuple[pd.DataFrame, pd.DataFrame]]:
+        '''
+        streaming version of preprocess(), for statements too large to load at once. Reads and preprocesses the
+        statement chunksize rows at a time, so memory is bounded by the chunk rather than the file. The ids come from
+        each row's own transaction id, so they are the same as preprocess() gives.
+
+        :param chunksize: int number of statement rows per chunk
+        :param log_file: str path of the statement, if not the month's file in data/statements
+
+        :return: iterator of (spending, months) per chunk
+        '''
+        if log_file is None:
+            log_file = self.find_file(demo)
+
+        for chunk in self.read_statement(log_file, chunksize=chunksize):
+            yield self.transform(chunk)
+
+    @classmethod
+    def preprocess_history(cls, log_file: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+        '''
+        preprocesses a statement exported over several months (e.g. the full account history) in one pass, rather than
+        a file per month. Each row's month_id comes from its date, so the rows are the same as preprocess() gives from
+        that month's own statement.
+
+        :param log_file: str path of the statement
+
+        :return: (spending, months) with a months row for every month in the statement
+        '''
+        monzo = cls(month_id=None)
+
+        return monzo.transform(monzo.read_statement(log_file))
+
+    def read_statement(self, log_file: str, **kwargs) -> pd.DataFrame:
+        '''
+        reads a statement csv. Text columns are always read as text, so a chunk (kwargs e.g. chunksize) whose values
+        happen to all look like numbers is read the same as the whole file
+        '''
+        amounts = [self.SCHEMA.AMOUNT, self.SCHEMA.LOCAL_AMOUNT, self.SCHEMA.OUT, self.SCHEMA.IN]
+        dtype = {column: str for column in self.SCHEMA.df_columns_initial if column not in amounts}
+
+        return pd.read_csv(log_file, skiprows=self.SKIPROWS, names=self.SCHEMA.df_columns_initial, dtype=dtype, **kwargs)
+
+    def find_file(self, demo=False) -> str:
+        '''path of the month's statement in data/statements'''
+        return DATA_FILES.find('monzo', self.month_id, demo)
+
+    def transform(self, df: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+        '''preprocesses raw statement rows into the spending and months tables'''
 
         # add additional information
         df[self.SCHEMA.DATETIME] = self.add_datetime_column(df)
         df[self.SCHEMA.MONTH_ID] = self.add_month_id_column(df)
         df[self.SCHEMA.CATEGORY] = self.add_category_column(df)
-        df = self.split_subcategory_payments(df)
+        df, split_index = self.split_subcategory_payments(df)
+        df[self.SCHEMA.SUBCATEGORY] = self.add_subcategory_column(df)
         df[self.SCHEMA.IN] = self.convert_to_pennies(df[self.SCHEMA.IN])
         df[self.SCHEMA.OUT] = self.convert_to_pennies(df[self.SCHEMA.OUT])
-        df[self.SCHEMA.ID] = self.add_id_column(df)
+        df[self.SCHEMA.ID] = self.add_transaction_id_column(df, split_index)
 
         df = df[self.SCHEMA.df_columns_final]
 
-        months = df[self.SCHEMA.MONTH_ID].unique()
-        dt = [datetime.strptime(m, self.MONTH_FORMAT) for m in months]
+        months = np.sort(df[self.SCHEMA.MONTH_ID].unique())
         months = pd.DataFrame({self.SCHEMA.ID: months,
-                               self.SCHEMA.DATETIME: dt})
+                               self.SCHEMA.DATETIME: [month_period(month_id).start_time for month_id in months]})
 
         return df, months
 
+    def add_transaction_id_column(self, df: pd.DataFrame, split_index: np.ndarray) -> pd.Series:
+        '''
+        adds id column from Monzo's transaction id and the position of the row within its split payment (0 if the
+        payment is not split). Unlike a position in the statement, it does not change if the statement is re-exported
+        with other rows (or split payments) in a different order, so re-ingesting a month finds the rows already stored.
+        '''
+        return df[self.SCHEMA.ID] + ' ' + pd.Series(split_index, index=df.index).astype(str)
+
     def add_datetime_column(self, df: pd.DataFrame) -> pd.Series:
         '''adds datetime column to existing dataframe based on date and time columns'''
 
-        df['tmp'] = df[self.SCHEMA.DATE] + ' ' + df[self.SCHEMA.TIME]
-        extract_datetime = lambda x: datetime.strptime(x, self.DATETIME_FORMAT)
+        date_time = df[self.SCHEMA.DATE] + ' ' + df[self.SCHEMA.TIME]
 
-        return df['tmp'].apply(extract_datetime)
+        return pd.to_datetime(date_time, format=self.DATETIME_FORMAT)
 
-    def split_subcategory_payments(self, df: pd.DataFrame) -> pd.DataFrame:
-        '''any "subcategory split" payments will be separated into individual rows'''
-        df_keep = df[df[self.SCHEMA.SUBCATEGORY_SPLIT].isna()]
-        df_split = df[~df[self.SCHEMA.SUBCATEGORY_SPLIT].isna()]
+    def split_subcategory_payments(self, df: pd.DataFrame) -> tuple[pd.DataFrame, np.ndarray]:
+        '''
+        any "subcategory split" payments will be separated into individual rows
 
-        for _, row in df_split.iterrows():
+        :return: (df, split index) with the split index of each row numbering the parts of its split payment from 1, and
+                 0 for a payment that is not split
+        '''
+        is_split = df[self.SCHEMA.SUBCATEGORY_SPLIT].notna()
+        df_keep = df[~is_split]
+        df_split = df[is_split].reset_index(drop=True)
 
-            split = row[self.SCHEMA.SUBCATEGORY_SPLIT].split(',')
+        if df_split.empty:
+            return df_keep.reset_index(drop=True), np.zeros(len(df_keep), dtype=int)
 
-            for subcategory_value in split:
+        # one row per "subcategory:value" part, repeating the parent row for each part
+        parts = df_split[self.SCHEMA.SUBCATEGORY_SPLIT].str.split(',').explode()
+        subcategory_value = parts.str.split(':', n=1, expand=True)
+        subcategory = subcategory_value[0].to_numpy()
+        value = subcategory_value[1].to_numpy()
+        is_in = pd.to_numeric(subcategory_value[1]).to_numpy() > 0
+        split_index = parts.groupby(level=0).cumcount().to_numpy() + 1
 
-                subcategory, value = tuple(subcategory_value.split(':'))
-                new_row = row
-                new_row[self.SCHEMA.SUBCATEGORY] = subcategory
-                new_row[self.SCHEMA.SUBCATEGORY_SPLIT] = np.nan
-                new_row[self.SCHEMA.AMOUNT] = value
-                new_row[self.SCHEMA.LOCAL_AMOUNT] = value
+        df_split = df_split.loc[parts.index].reset_index(drop=True)
+        df_split[self.SCHEMA.SUBCATEGORY] = subcategory
+        df_split[self.SCHEMA.SUBCATEGORY_SPLIT] = np.nan
+        df_split[self.SCHEMA.AMOUNT] = value
+        df_split[self.SCHEMA.LOCAL_AMOUNT] = value
+        df_split[self.SCHEMA.IN] = np.where(is_in, value, df_split[self.SCHEMA.IN].to_numpy(dtype=object))
+        df_split[self.SCHEMA.OUT] = np.where(is_in, df_split[self.SCHEMA.OUT].to_numpy(dtype=object), value)
 
-                if float(value) > 0:
-                    new_row[self.SCHEMA.IN] = value
-                else:
-                    new_row[self.SCHEMA.OUT] = value
+        return (pd.concat([df_keep, df_split], ignore_index=True),
+                np.concatenate([np.zeros(len(df_keep), dtype=int), split_index]))
 
-                df_keep = pd.concat([df_keep, pd.DataFrame([new_row])], ignore_index=True)
 
-        return df_keep.reset_index(drop=True)
+@dataclass
+class InputsBundle:
+    '''the budget, accounts and income tables preprocessed from a single inputs_{mm_yy}.csv file'''
+    budget: pd.DataFrame
+    accounts: pd.DataFrame
+    income: pd.DataFrame
+
+
+class Inputs(Finances):
+    DATETIME_FORMAT: str = '%m_%y'
+    SKIPROWS: int = 1
+    SCHEMA: SchemaInputs = SchemaInputs()
+    CATEGORIES: tuple[str] = ('BUDGET', 'ACCOUNTS', 'INCOME')
+
+    def preprocess(self, DEBUG=pd.DataFrame(), demo=False) -> InputsBundle:
+        '''loads inputs file once and splits it into the budget, accounts and income tables'''
+        if os.getenv('DEBUG'):
+            df = DEBUG
+        else:
+            df = self.load(demo)
+
+        df = self.validate(df)
+        groups = {category: df_category for category, df_category in df.groupby(self.SCHEMA.CATEGORY, sort=False)}
+        empty = df.iloc[0:0]
+
+        return InputsBundle(budget=Budget(self.month_id).transform(groups.get('BUDGET', empty)),
+                            accounts=Accounts(self.month_id).transform(groups.get('ACCOUNTS', empty)),
+                            income=Income(self.month_id).transform(groups.get('INCOME', empty)))
+
+    def load(self, demo=False) -> pd.DataFrame:
+        '''reads the raw inputs_{mm_yy}.csv file for the month'''
+        return pd.read_csv(self.find_file(demo), skiprows=self.SKIPROWS, names=self.SCHEMA.df_columns_initial)
+
+    def find_file(self, demo=False) -> str:
+        '''path of the month's inputs file in data/inputs'''
+        return DATA_FILES.find('inputs', self.month_id, demo)
+
+    def validate(self, df: pd.DataFrame) -> pd.DataFrame:
+        '''drops rows of unknown or blank categories with a warning, and checks the amounts left are numeric'''
+        known = df[self.SCHEMA.CATEGORY].isin(self.CATEGORIES)
+        if not known.all():
+            diff = set(df.loc[~known, self.SCHEMA.CATEGORY].fillna('<blank>'))
+            logger.warning(f'Inputs file for {self.month_id} contains unknown categories ({diff}), '
+                           f'{(~known).sum()} row(s) left out')
+            df = df[known]
+
+        amounts = pd.to_numeric(df[self.SCHEMA.AMOUNT], errors='coerce')
+        invalid = df[self.SCHEMA.AMOUNT].notna() & amounts.isna()  # blank amounts are left to each preprocessor
+        if invalid.any():
+            rows = df.loc[invalid, self.SCHEMA.SUBCATEGORY].tolist()
+            raise ValueError(f'Inputs file for {self.month_id} contains non-numeric amounts ({rows})')
+
+        return df
 
 
 class Budget(Finances):
@@ -291,28 +540,19 @@ class Budget(Finances):
         if os.getenv('DEBUG'):
             df = DEBUG
         else:
-            dt = datetime.strptime(self.month_id, self.MONTH_FORMAT)
-            mm_yy = datetime.strftime(dt, self.DATETIME_FORMAT)
+            df = Inputs(self.month_id).load(demo)
 
-            log_folder = os.path.join('data', 'inputs')
-            if demo:
-                file = fnmatch.filter(os.listdir(log_folder),  f'DEMO inputs_{mm_yy}*.csv')
-            else:
-                file = fnmatch.filter(os.listdir(log_folder), f'inputs_{mm_yy}*.csv')
-            if len(file) == 0:
-                raise ValueError(f'No files found in {log_folder} matching inputs_{mm_yy}*.csv')
-            elif len(file) > 1:
-                raise ValueError(f'More than one file matches inputs_{mm_yy}*.csv - {file}')
-            log_file = os.path.join(log_folder, file[0])
+        return self.transform(df[df[self.SCHEMA.CATEGORY]=='BUDGET'])
 
-            df = pd.read_csv(log_file, skiprows=self.SKIPROWS, names=self.SCHEMA.df_columns_initial)
-
-        df = df[df[self.SCHEMA.CATEGORY]=='BUDGET'].reset_index(drop=True)
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        '''preprocesses the BUDGET rows of an inputs file'''
+        df = df.reset_index(drop=True)
 
         df[self.SCHEMA.DATETIME] = self.add_datetime_column(df, self.month_id)
         df[self.SCHEMA.MONTH_ID] = self.add_month_id_column(df)
         df[self.SCHEMA.ID] = self.add_id_column(df)
         df[self.SCHEMA.CATEGORY] = self.add_category_column(df)
+        df[self.SCHEMA.SUBCATEGORY] = self.add_subcategory_column(df)
         df[self.SCHEMA.BUDGET] = self.convert_to_pennies(df[self.SCHEMA.AMOUNT])
 
         df = df[self.SCHEMA.budget_columns_final]
@@ -330,22 +570,13 @@ class Accounts(Finances):
         if os.getenv('DEBUG'):
             df = DEBUG
         else:
-            dt = datetime.strptime(self.month_id, self.MONTH_FORMAT)
-            mm_yy = datetime.strftime(dt, self.DATETIME_FORMAT)
-
-            log_folder = os.path.join('data', 'inputs')
-            if demo:
-                file = fnmatch.filter(os.listdir(log_folder), f'DEMO inputs_{mm_yy}*.csv')
-            else:
-                file = fnmatch.filter(os.listdir(log_folder), f'inputs_{mm_yy}*.csv')
-            if len(file) == 0:
-                raise ValueError(f'No files found in {log_folder} matching inputs_{mm_yy}*.csv')
-            elif len(file) > 1:
-                raise ValueError(f'More than one file matches inputs_{mm_yy}*.csv - {file}')
-            log_file = os.path.join(log_folder, file[0])
-
-            df = pd.read_csv(log_file, skiprows=self.SKIPROWS, names=self.SCHEMA.df_columns_initial)
-        df = df[df[self.SCHEMA.CATEGORY]=='ACCOUNTS'].reset_index(drop=True)
+            df = Inputs(self.month_id).load(demo)
+
+        return self.transform(df[df[self.SCHEMA.CATEGORY]=='ACCOUNTS'])
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        '''preprocesses the ACCOUNTS rows of an inputs file'''
+        df = df.reset_index(drop=True)
 
         df[self.SCHEMA.DATETIME] = self.add_datetime_column(df, self.month_id)
         df[self.SCHEMA.MONTH_ID] = self.add_month_id_column(df)
@@ -368,22 +599,13 @@ class Income(Finances):
         if os.getenv('DEBUG'):
             df = DEBUG
         else:
-            dt = datetime.strptime(self.month_id, self.MONTH_FORMAT)
-            mm_yy = datetime.strftime(dt, self.DATETIME_FORMAT)
-
-            log_folder = os.path.join('data', 'inputs')
-            if demo:
-                file = fnmatch.filter(os.listdir(log_folder), f'DEMO inputs_{mm_yy}*.csv')
-            else:
-                file = fnmatch.filter(os.listdir(log_folder), f'inputs_{mm_yy}*.csv')
-            if len(file) == 0:
-                raise ValueError(f'No files found in {log_folder} matching inputs_{mm_yy}*.csv')
-            elif len(file) > 1:
-                raise ValueError(f'More than one file matches inputs_{mm_yy}*.csv - {file}')
-            log_file = os.path.join(log_folder, file[0])
-
-            df = pd.read_csv(log_file, skiprows=self.SKIPROWS, names=self.SCHEMA.df_columns_initial)
-        df = df[df[self.SCHEMA.CATEGORY]=='INCOME'].reset_index(drop=True)
+            df = Inputs(self.month_id).load(demo)
+
+        return self.transform(df[df[self.SCHEMA.CATEGORY]=='INCOME'])
+
+    def transform(self, df: pd.DataFrame) -> pd.DataFrame:
+        '''preprocesses the INCOME rows of an inputs file'''
+        df = df.reset_index(drop=True)
 
         df[self.SCHEMA.DATETIME] = self.add_datetime_column(df, self.month_id)
         df[self.SCHEMA.MONTH_ID] = self.add_month_id_column(df)
@@ -406,20 +628,8 @@ class InvestmentVariable(Finances):
         if os.getenv('DEBUG'):
             df = DEBUG
         else:
-            dt = datetime.strptime(self.month_id, self.MONTH_FORMAT)
-            mm_yy = datetime.strftime(dt, self.DATETIME_FORMAT)
-
-            log_folder = os.path.join('data', 'inputs')
-            if demo:
-                file = fnmatch.filter(os.listdir(log_folder), f'DEMO investments_variable_{mm_yy}*.csv')
-            else:
-                file = fnmatch.filter(os.listdir(log_folder), f'investments_variable_{mm_yy}*.csv')
-            if len(file) == 0:
-                raise ValueError(f'No files found in {log_folder} matching investments_variable_{mm_yy}*.csv')
-            elif len(file) > 1:
-                raise ValueError(f'More than one file matches investments_variable_{mm_yy}*.csv - {file}')
-            log_file = os.path.join(log_folder, file[0])
-            df = pd.read_csv(log_file, skiprows=self.SKIPROWS, names=self.SCHEMA.df_columns_initial, index_col=False)
+            df = pd.read_csv(self.find_file(demo), skiprows=self.SKIPROWS, names=self.SCHEMA.df_columns_initial,
+                             index_col=False)
 
         df[self.SCHEMA.DATETIME] = self.add_datetime_column(df, self.month_id)
         df[self.SCHEMA.MONTH_ID] = self.add_month_id_column(df)
@@ -430,6 +640,10 @@ class InvestmentVariable(Finances):
 
         return df
 
+    def find_file(self, demo=False) -> str:
+        '''path of the month's investments_variable file in data/inputs'''
+        return DATA_FILES.find('investments_variable', self.month_id, demo)
+
     def add_value_column(self, df: pd.DataFrame) -> pd.Series:
         '''adds value column to existing dataframe based on unit_price and units_owned columns'''
         val = df[self.SCHEMA.UNIT_PRICE] * df[self.SCHEMA.UNITS_OWNED]
@@ -446,11 +660,7 @@ class InvestmentFixed(Finances):
         if os.getenv('DEBUG'):
             df = DEBUG
         else:
-            if demo:
-                log_file = os.path.join('data', 'inputs', 'DEMO investments_fixed.csv')
-            else:
-                log_file = os.path.join('data', 'inputs', 'investments_fixed.csv')
-            df = pd.read_csv(log_file, skiprows=self.SKIPROWS, names=self.SCHEMA.df_columns_initial)
+            df = pd.read_csv(self.find_file(demo), skiprows=self.SKIPROWS, names=self.SCHEMA.df_columns_initial)
 
         df[self.SCHEMA.AMOUNT] = self.convert_to_pennies(df[self.SCHEMA.AMOUNT])
         df[self.SCHEMA.RETURN] = self.add_return_column(df)
@@ -462,6 +672,10 @@ class InvestmentFixed(Finances):
 
         return df
 
+    def find_file(self, demo=False) -> str:
+        '''path of the investments_fixed file in data/inputs (the same file every month)'''
+        return DATA_FILES.find('investments_fixed', demo=demo)
+
     def add_return_column(self, df: pd.DataFrame) -> pd.Series:
 
         df['duration_yrs'] = df[self.SCHEMA.DURATION]//12 + (df[self.SCHEMA.DURATION]%12)/12
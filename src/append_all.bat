@@ -1,13 +1,5 @@
 call ..\venv\Scripts\activate
 
-python pipe.py -m nov -y 22 -a
-python pipe.py -m dec -y 22 -a
-python pipe.py -m jan -y 23 -a
-python pipe.py -m feb -y 23 -a
-python pipe.py -m mar -y 23 -a
-python pipe.py -m apr -y 23 -a
-python pipe.py -m may -y 23 -a
-python pipe.py -m jun -y 23 -a
-python pipe.py -m jul -y 23 -a
+python pipe.py --from nov-22 --to jul-23 -a
 
 pause
\ No newline at end of file
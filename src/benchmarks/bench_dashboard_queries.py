@@ -0,0 +1,132 @@
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+'''
+benchmarks the latency of the dashboard's database queries on a large synthetic database, before and after the indexes
+declared in sql/db_manager.py are built.
+
+run from /Finances-API/src with: python -m benchmarks.bench_dashboard_queries [--years 10] [--transactions 2000]
+'''
+
+
+def build_database(db, years: int, transactions: int) -> list[int]:
+    ''' fills the database with years of synthetic months, each with a number of spending transactions '''
+    from api import SchemaMonzo, SchemaInputs, SchemaInvestmentVariable, SchemaInvestmentFixed
+
+    SCHEMA = SchemaMonzo()
+    SCHEMAInputs = SchemaInputs()
+    SCHEMAVar = SchemaInvestmentVariable()
+    SCHEMAFix = SchemaInvestmentFixed()
+    rng = np.random.default_rng(0)
+    subcategories = ['Transport', 'Groceries', 'Snacks', 'Lunch', 'Eating out', 'Shopping', 'Entertainment', 'Income']
+
+    starts = pd.date_range('2000-01-01', periods=12 * years, freq='MS')
+    month_ids = [start.year * 100 + start.month for start in starts]
+
+    for start, month_id in zip(starts, month_ids):
+        with db.unit_of_work() as uow:
+            uow.stage(pd.DataFrame({SCHEMA.ID: [month_id], SCHEMA.DATETIME: [start]}), 'months')
+            uow.stage(pd.DataFrame({SCHEMA.ID: [f'{month_id} {i:04d}' for i in range(transactions)],
+                                    SCHEMA.MONTH_ID: month_id,
+                                    SCHEMA.DATETIME: start + pd.to_timedelta(rng.integers(0, 28 * 86400, transactions), unit='s'),
+                                    SCHEMA.TYPE: 'Card payment',
+                                    SCHEMA.NAME: 'Merchant',
+                                    SCHEMA.CATEGORY: 'Category',
+                                    SCHEMA.SUBCATEGORY: rng.choice(subcategories, transactions),
+                                    SCHEMA.OUT: -rng.integers(0, 10000, transactions),
+                                    SCHEMA.IN: 0}), 'spending')
+            uow.stage(pd.DataFrame({SCHEMAInputs.ID: [f'{month_id} {i:04d}' for i in range(len(subcategories))],
+                                    SCHEMAInputs.MONTH_ID: month_id,
+                                    SCHEMAInputs.DATETIME: start,
+                                    SCHEMAInputs.CATEGORY: 'Category',
+                                    SCHEMAInputs.SUBCATEGORY: subcategories,
+                                    SCHEMAInputs.BUDGET: 10000}), 'budget')
+            uow.stage(pd.DataFrame({SCHEMAVar.ID: [f'{month_id} {i:04d}' for i in range(5)],
+                                    SCHEMAVar.NAME: [f'Fund {i}' for i in range(5)],
+                                    SCHEMAVar.DATETIME: start,
+                                    SCHEMAVar.MONTH_ID: month_id,
+                                    SCHEMAVar.UNIT_PRICE: rng.random(5) * 100,
+                                    SCHEMAVar.UNITS_OWNED: 10.0,
+                                    SCHEMAVar.VALUE: 0.0}), 'investments_variable')
+            uow.stage(pd.DataFrame({SCHEMAFix.ID: [f'{month_id} fixed'],
+                                    SCHEMAFix.NAME: 'Bond',
+                                    SCHEMAFix.COMPANY: 'Company',
+                                    SCHEMAFix.AMOUNT: 100000,
+                                    SCHEMAFix.INTEREST: 5.0,
+                                    SCHEMAFix.DURATION: 12,
+                                    SCHEMAFix.PURCHASE_DATE: start,
+                                    SCHEMAFix.MATURITY_DATE: start + pd.DateOffset(months=12),
+                                    SCHEMAFix.RETURN: 5000}), 'investments_fixed')
+
+    return month_ids
+
+
+def time_queries(month_ids: list[int], repeats: int) -> pd.Series:
+    ''' mean latency (ms) of each dashboard query over a sample of months '''
+    from dashboard.dash_inputs import query_db, query_inv_fix
+
+    sample = month_ids[::max(1, len(month_ids) // repeats)][:repeats]
+    queries = {"query_db('spending')": lambda m: query_db('spending', m),
+               "query_db('budget')": lambda m: query_db('budget', m),
+               "query_db('investments_variable')": lambda m: query_db('investments_variable', m),
+               'query_inv_fix': query_inv_fix}
+
+    timings = {}
+    for name, query in queries.items():
+        start = time.perf_counter()
+        for month_id in sample:
+            query(month_id)
+        timings[name] = 1000 * (time.perf_counter() - start) / len(sample)
+
+    return pd.Series(timings)
+
+
+def main(years: int, transactions: int, repeats: int) -> pd.DataFrame:
+
+    # the dashboard queries open data/debug.db relative to the working directory, so run them in a scratch directory
+    cwd = os.getcwd()
+    os.environ['DEBUG'] = 'True'
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, 'data'))
+        os.chdir(tmp)
+        try:
+            from sql.db_manager import SQL, Base
+
+            db = SQL()
+            db.create_all_tables()
+            for m in Base.registry.mappers:
+                for index in m.class_.__table__.indexes:
+                    index.drop(bind=db.engine, checkfirst=True)
+
+            logging.disable(logging.INFO)  # one log per table per month otherwise
+            month_ids = build_database(db, years, transactions)
+            logging.disable(logging.NOTSET)
+
+            before = time_queries(month_ids, repeats)
+            db.create_indexes()
+            after = time_queries(month_ids, repeats)
+        finally:
+            os.chdir(cwd)
+
+    results = pd.DataFrame({'no indexes (ms)': before, 'indexes (ms)': after})
+    results['speed up'] = (results['no indexes (ms)'] / results['indexes (ms)']).round(1)
+
+    return results.round(2)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=10)  # number of years of synthetic months
+    parser.add_argument("--transactions", type=int, default=2000)  # spending transactions per month
+    parser.add_argument("--repeats", type=int, default=20)  # months sampled per query
+
+    args = parser.parse_args()
+
+    print(main(args.years, args.transactions, args.repeats).to_string())
@@ -1,9 +1,17 @@
-from sqlalchemy import inspect, select, Table, and_
+from sqlalchemy import select, Table, and_, func
 from datetime import datetime
+from inspect import signature
+from dataclasses import dataclass, fields, is_dataclass, replace
+import functools
+import threading
 import pandas as pd
 
-from sql.db_manager import SQL, get_class_from_table_name, InvestmentsVariableTbl, InvestmentsFixedTbl
+from sql.db_manager import SQL, get_engine, get_catalogue, get_class_from_table_name, InvestmentsVariableTbl, \
+    InvestmentsFixedTbl, BudgetTbl, IncomeTbl, MonthsTbl, MonthlySummaryTbl, decoded_select, in_months, \
+    spending_by_subcategory_select, summary_select, MISCELLANEOUS_CATEGORIES, SUMMARY_COLUMNS
 from api import SchemaMonzo, SchemaInputs, SchemaInvestmentFixed, SchemaInvestmentVariable
+from utils.categories import subcategory_mapping
+from utils.months import MonthKey, add_months, month_period
 
 import logging
 
@@ -11,69 +19,170 @@ import logging
 this script will contain the functions to generate all tables and constants that are then displayed in the dashboard.
 '''
 
+CACHE_SIZE = 32  # (arguments, data version) entries kept per cached table function
+
+
+def _copy(result):
+    ''' copies the DataFrames in a cached result so callers can modify them without corrupting the cache '''
+    if isinstance(result, tuple):
+        return tuple(_copy(r) for r in result)
+    if isinstance(result, pd.DataFrame):
+        return result.copy()
+    if isinstance(result, dict):
+        return {key: _copy(value) for key, value in result.items()}
+    if is_dataclass(result):
+        return replace(result, **{f.name: _copy(getattr(result, f.name)) for f in fields(result)})
+    return result
+
+_callback = threading.local()  # the data version read by the outermost cached call of a dashboard callback
+
+
+def versioned_cache(maxsize: int = CACHE_SIZE):
+    '''
+    LRU caches a table function on its arguments and the data version of the database: the version bumped by every
+    write through SQL in this process, together with the version stored in the database, so that writes by another
+    process (e.g. the pipeline appending a month while the dashboard runs) are seen too. Either changing clears the
+    cache so stale months are never served. The database is asked once per callback, however many cached functions
+    the callback calls.
+    '''
+    def decorator(func):
+        sig = signature(func)
+
+        @functools.lru_cache(maxsize=maxsize)
+        def cached(data_version, arguments):
+            return func(**dict(arguments))
+
+        state = {'data_version': None}
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            outermost = getattr(_callback, 'data_version', None) is None
+            if outermost:
+                catalogue = get_catalogue(get_engine(SQL.address()))  # not SQL(), which would build a sessionmaker per call
+                _callback.data_version = (catalogue.data_version, catalogue.stored_version())
+            data_version = _callback.data_version
+            try:
+                if data_version != state['data_version']:
+                    cached.cache_clear()
+                    state['data_version'] = data_version
+
+                # bind so that summary_table(m, False) and summary_table(m, total_row=False) share an entry, and make
+                # lists (e.g. of month_ids) hashable
+                bound = sig.bind(*args, **kwargs)
+                bound.apply_defaults()
+                arguments = tuple((name, tuple(value) if isinstance(value, list) else value)
+                                  for name, value in bound.arguments.items())
+                return _copy(cached(data_version, arguments))
+            finally:
+                if outermost:
+                    _callback.data_version = None
+
+        wrapper.cache_info = cached.cache_info
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+
+    return decorator
+
 def query_db(table_name, month_id):
 
+    return query_months(table_name, [month_id])
+
+def query_months(table_name: str, month_ids: list[MonthKey]) -> pd.DataFrame:
+    ''' all rows of table_name from any of month_ids, in one query '''
     db = SQL()
 
-    assert table_name in inspect(db.engine).get_table_names(), f'{table_name} is not a valid table name.'
+    assert db.catalogue.has_table(table_name), f'{table_name} is not a valid table name.'
 
-    class_ = get_class_from_table_name(table_name)
-    table = Table(table_name, class_.metadata)
+    table = get_class_from_table_name(table_name).__table__
 
     with db.engine.connect() as conn:
-        query = select(table).where(table.c.month_id == month_id)
+        query = decoded_select(table_name).where(in_months(table.c.month_id, month_ids))
         df = pd.read_sql(sql=query, con=conn)
 
     return df
 
-def query_inv_var(month_id):
+def _investments_history_query(month_ids: list[MonthKey] | None = None):
+    '''
+    select of investments_variable with each holding's previous row alongside it (LAG over the holding's rows ordered by
+    Date), so the change since the previous month needs no second query or merge
+    '''
+    SCHEMA = SchemaInvestmentVariable()
+    table = InvestmentsVariableTbl.__table__
 
-    dt_month_id = datetime.strptime(month_id.lower(), '%b %y')
-    dt_previous_month = dt_month_id - pd.DateOffset(months=1)
-    previous_month_id = datetime.strftime(dt_previous_month, '%b %y').upper()
+    lagged = [SCHEMA.DATETIME, SCHEMA.MONTH_ID, SCHEMA.UNIT_PRICE, SCHEMA.UNITS_OWNED, SCHEMA.VALUE]
+    window = dict(partition_by=table.c[SCHEMA.NAME], order_by=table.c[SCHEMA.DATETIME])
+    history = select(table, *[func.lag(table.c[column]).over(**window).label(f'{column}_prev') for column in lagged])
+    history = history.subquery()
 
-    SCHEMA = SchemaInvestmentVariable()
-    db = SQL()
+    # filter after the window is applied, otherwise the first month requested would have no previous rows
+    query = select(history)
+    if month_ids is not None:
+        query = query.where(in_months(history.c.month_id, month_ids))
 
-    table = Table(InvestmentsVariableTbl.__tablename__, InvestmentsVariableTbl.metadata)
+    return query.order_by(history.c[SCHEMA.DATETIME], history.c[SCHEMA.ID])
 
-    with db.engine.connect() as conn:
-        query = select(table).where(table.c.month_id.like(month_id))
-        inv = pd.read_sql(sql=query, con=conn)
+def query_investments_history(month_ids: list[MonthKey] | None = None) -> pd.DataFrame:
+    '''
+    the variable investments of each month with the holding's values from the previous month (*_prev columns), which
+    are empty if the holding was not held the month before
 
-    with db.engine.connect() as conn:
-        query = select(table).where(table.c.month_id.like(previous_month_id))
-        inv_previous = pd.read_sql(sql=query, con=conn)
+    :param month_ids: list of month_ids to include, or None for every month
+    '''
+    SCHEMA = SchemaInvestmentVariable()
 
-    inv_var = inv.merge(inv_previous, on=SCHEMA.NAME, how='left', suffixes=('', '_prev'))
+    with SQL().engine.connect() as conn:
+        inv_var = pd.read_sql(sql=_investments_history_query(month_ids), con=conn)
+
+    # all NULL columns (e.g. the first month) are read as object, and LAG returns the holding's last row, which is only
+    # the previous month if the holding was held then
+    inv_var[f'{SCHEMA.DATETIME}_prev'] = pd.to_datetime(inv_var[f'{SCHEMA.DATETIME}_prev'])
+    for column in [SCHEMA.MONTH_ID, SCHEMA.UNIT_PRICE, SCHEMA.UNITS_OWNED, SCHEMA.VALUE]:
+        inv_var[f'{column}_prev'] = inv_var[f'{column}_prev'].astype(float)
+    consecutive = inv_var[f'{SCHEMA.MONTH_ID}_prev'] == add_months(inv_var[SCHEMA.MONTH_ID], -1)
+    prev_columns = [column for column in inv_var.columns if column.endswith('_prev')]
+    inv_var[prev_columns] = inv_var[prev_columns].where(consecutive)
 
     return inv_var
 
+def query_inv_var(month_id):
+
+    return query_investments_history([month_id])
+
 def query_inv_fix(month_id):
 
-    dt_month_id = datetime.strptime(month_id.lower(), '%b %y')
+    return query_inv_fix_months([month_id])[month_id]
+
+def query_inv_fix_months(month_ids: list[MonthKey]) -> dict[MonthKey, pd.DataFrame]:
+    '''
+    the fixed investments held at the end of each of month_ids, from one query of the investments held at any point in
+    the range of months
+
+    :return: dict of {month_id: pd.DataFrame}
+    '''
+    current_dates = {month_id: month_period(add_months(month_id, 1)).start_time for month_id in month_ids}
 
     db = SQL()
 
     table = Table(InvestmentsFixedTbl.__tablename__, InvestmentsFixedTbl.metadata)
     with db.engine.connect() as conn:
-        current_date = dt_month_id + pd.DateOffset(months=1)
-        query = select(table).filter(and_(table.c.Matures >= current_date, table.c.Purchased <= current_date))
+        query = select(table).filter(and_(table.c.Matures >= min(current_dates.values()),
+                                          table.c.Purchased <= max(current_dates.values())))
         inv_fix = pd.read_sql(sql=query, con=conn)
 
-    return inv_fix
+    return {month_id: inv_fix[(inv_fix.Matures >= current_date) & (inv_fix.Purchased <= current_date)].reset_index(drop=True)
+            for month_id, current_date in current_dates.items()}
 
 
-def spending_table(month_id: str, dd_mm: bool) -> pd.DataFrame:
+@versioned_cache()
+def spending_table(month_id: MonthKey, dd_mm: bool) -> pd.DataFrame:
 
     SCHEMA = SchemaMonzo()
     df = query_db('spending', month_id)
 
-    miscellaneous_categories = ["General", "Charity", "Expenses", "Savings", "Transfers", "Family", "Finances"]
-    for category in miscellaneous_categories:
+    for category in MISCELLANEOUS_CATEGORIES:
         if df[df[SCHEMA.SUBCATEGORY]==category].shape[0] != 0:
             logging.warning(f'Monzo data contains {df[df[SCHEMA.SUBCATEGORY] == category].shape[0]} transactions categorised as {category}. These will be removed.')
-    df = df[~df[SCHEMA.SUBCATEGORY].isin(miscellaneous_categories)]
+    df = df[~df[SCHEMA.SUBCATEGORY].isin(MISCELLANEOUS_CATEGORIES)]
 
     df = df.sort_values(SCHEMA.DATETIME)
     df[SCHEMA.BALANCE] = df[SCHEMA.IN].cumsum() + df[SCHEMA.OUT].cumsum()
@@ -86,42 +195,69 @@ def spending_table(month_id: str, dd_mm: bool) -> pd.DataFrame:
 
     return df.reset_index(drop=True)
 
-def summary_table(month_id: str, total_row: bool) -> tuple[pd.DataFrame, float, float]:
+def _read_aggregate(query) -> pd.DataFrame:
+    with SQL().engine.connect() as conn:
+        return pd.read_sql(sql=query, con=conn)
+
+def query_spending_by_subcategory(month_ids: list[MonthKey] | None = None) -> pd.DataFrame:
+    '''
+    the In and Out (int pennies) of each subcategory of each month, grouped in the database
+
+    :param month_ids: list of month_ids to include, or None for every month
+    '''
+    return _read_aggregate(spending_by_subcategory_select(month_ids))
+
+def query_summary(month_ids: list[MonthKey] | None = None) -> pd.DataFrame:
+    '''
+    the per-subcategory In/Out/Total/Budget/Diff. (int pennies) of each month, grouped and joined to the budget in the
+    database so only one row per budgeted subcategory is returned
+
+    :param month_ids: list of month_ids to include, or None for every month
+    '''
+    return _read_aggregate(summary_select(month_ids))
+
+def query_monthly_totals(month_ids: list[MonthKey] | None = None) -> pd.DataFrame:
+    '''
+    the total budget and total spending (int pennies) of each month, excluding Income and Bills, as used for
+    monthly_budget and monthly_spending in summary_table()
+
+    :param month_ids: list of month_ids to include, or None for every month
+    '''
+    summary = summary_select(month_ids).subquery()
+
+    query = select(summary.c.month_id,
+                   func.sum(summary.c.Budget).label('Budget'),
+                   func.sum(summary.c.Total).label('Total'))
+    query = query.where(summary.c.Subcategory.not_in(['Income', 'Bills']))
+
+    return _read_aggregate(query.group_by(summary.c.month_id).order_by(summary.c.month_id))
+
+def compute_summary(month_id: MonthKey) -> pd.DataFrame:
+    ''' the month's summary computed from its raw spending and budget rows (see SQL.compute_summary()) '''
+    return SQL().compute_summary(month_id)
+
+def stored_summary(month_id: MonthKey) -> pd.DataFrame | None:
+    ''' the month's rows of the monthly_summary table, or None if the database has no monthly_summary table '''
+    return SQL().stored_summary(month_id)
+
+@versioned_cache()
+def summary_table(month_id: MonthKey, total_row: bool) -> tuple[pd.DataFrame, float, float]:
 
     SCHEMA = SchemaMonzo()
     SCHEMABudget = SchemaInputs()
 
-    # import dfs from database
-    df = spending_table(month_id, False)
-    df_budget = query_db('budget', month_id)
-    # merge dfs on subcategory column
-    df = df.groupby(SCHEMA.SUBCATEGORY)[[SCHEMA.IN, SCHEMA.OUT]].sum().reset_index()
-    df = df_budget[[SCHEMABudget.SUBCATEGORY, SCHEMABudget.CATEGORY, SCHEMABudget.BUDGET]].merge(df, how='left', on=SCHEMA.SUBCATEGORY)
-    # add difference and total columns
-    df = df.fillna(0)
-    df[SCHEMA.OUT] = -df[SCHEMA.OUT]
-    df[SCHEMA.TOTAL] = df[SCHEMA.IN] + df[SCHEMA.OUT]
-    # convert from int pennies to £'s
-    df[SCHEMABudget.BUDGET] /= 100
-    df[SCHEMA.DIFFERENCE] = df[SCHEMABudget.BUDGET] + df[SCHEMA.TOTAL]
-
-
-    # remove 'miscellaneous' rows and order rows
-    df = df[df[SCHEMA.CATEGORY] != 'Miscellaneous']
-    df = df[df[SCHEMA.SUBCATEGORY] != 'Bills']
-    subcategory_order = pd.CategoricalDtype(['Income',
-                                             'Transport', 'Car',
-                                             'Groceries', 'Snacks', 'Lunch', 'Eating out', 'Alcohol',
-                                             'Shopping', 'Clothes', 'Electronics', 'Personal care', 'Gifts',
-                                             'Entertainment',
-                                             'Holidays',
-                                             'Bills'],
-                                            ordered=True)
-    df[SCHEMA.SUBCATEGORY] = df[SCHEMA.SUBCATEGORY].astype(subcategory_order)
-    df = df.sort_values(SCHEMA.SUBCATEGORY).reset_index(drop=True)
+    # read the summary maintained at ingest time, falling back to computing it for months/databases without one
+    df = stored_summary(month_id)
+    if df is None or df.empty:
+        df = compute_summary(month_id)
 
-    # filter to final columns
-    df = df[[SCHEMA.CATEGORY, SCHEMA.SUBCATEGORY, SCHEMA.IN, SCHEMA.OUT, SCHEMA.TOTAL, SCHEMABudget.BUDGET, SCHEMA.DIFFERENCE]]
+    # convert from int pennies to £'s and order rows
+    money_columns = [SCHEMA.IN, SCHEMA.OUT, SCHEMA.TOTAL, SCHEMABudget.BUDGET, SCHEMA.DIFFERENCE]
+    df[money_columns] = df[money_columns] / 100
+    df[SCHEMA.SUBCATEGORY] = df[SCHEMA.SUBCATEGORY].astype(subcategory_mapping().subcategories)  # sub_category.json order
+    df = df.sort_values(SCHEMA.SUBCATEGORY).reset_index(drop=True)
+    # only the month's subcategories, as charts map every category of the column (e.g. to a colour)
+    df[SCHEMA.SUBCATEGORY] = df[SCHEMA.SUBCATEGORY].cat.remove_unused_categories()
 
     # calculate constants
     monthly_budget = df[~df[SCHEMA.SUBCATEGORY].isin(['Income', 'Bills'])][SCHEMABudget.BUDGET].sum()
@@ -139,20 +275,32 @@ def summary_table(month_id: str, total_row: bool) -> tuple[pd.DataFrame, float,
 
     return df, monthly_budget, monthly_spending
 
-def accounts_table(month_id: str) -> tuple[pd.DataFrame, float]:
+def accounts_table(month_id: MonthKey) -> tuple[pd.DataFrame, float]:
+
+    return batch_accounts_tables([month_id])[month_id]
 
+@versioned_cache()
+def batch_accounts_tables(month_ids: list[MonthKey]) -> dict[MonthKey, tuple[pd.DataFrame, float]]:
+    '''
+    accounts_table() of several months from one query
+
+    :return: dict of {month_id: (accounts, liquidity)}
+    '''
     SCHEMA = SchemaInputs()
 
-    df = query_db('accounts', month_id)
+    df = query_months('accounts', month_ids)
 
     df[SCHEMA.BALANCE] /= 100  # convert from int pennies to £'s
-    df = df[[SCHEMA.ACCOUNT, SCHEMA.BALANCE]]
 
-    liquidity = df[SCHEMA.BALANCE].sum()
+    tables = {}
+    for month_id in month_ids:
+        df_month = df.loc[df[SCHEMA.MONTH_ID] == month_id, [SCHEMA.ACCOUNT, SCHEMA.BALANCE]].reset_index(drop=True)
+        tables[month_id] = (df_month, df_month[SCHEMA.BALANCE].sum())
 
-    return df, liquidity
+    return tables
 
-def income_table(month_id: str) -> pd.DataFrame:
+@versioned_cache()
+def income_table(month_id: MonthKey) -> pd.DataFrame:
 
     SCHEMA = SchemaInputs()
 
@@ -163,30 +311,179 @@ def income_table(month_id: str) -> pd.DataFrame:
 
     return df
 
+def add_investment_changes(inv_var: pd.DataFrame) -> pd.DataFrame:
+    ''' adds the change in unit price (%) and value (£) of each holding since the previous month '''
+    SCHEMAVar = SchemaInvestmentVariable()
+
+    inv_var[SCHEMAVar.D_UNIT_PRICE] = (100 * (inv_var[SCHEMAVar.UNIT_PRICE] - inv_var[SCHEMAVar.UNIT_PRICE_PREV]) / inv_var[SCHEMAVar.UNIT_PRICE_PREV]).round(2)
+    inv_var[SCHEMAVar.D_VALUE] = (inv_var[SCHEMAVar.VALUE] - inv_var[SCHEMAVar.VALUE_PREV]).round(2)
+
+    return inv_var
+
 def investment_tables(month_id, liquidity) -> tuple[pd.DataFrame, pd.DataFrame, float]:
 
+    return batch_investment_tables([month_id], [liquidity])[month_id]
+
+@versioned_cache()
+def batch_investment_tables(month_ids: list[MonthKey], liquidities: list[float]) -> dict[MonthKey, tuple[pd.DataFrame, pd.DataFrame, float]]:
+    '''
+    investment_tables() of several months from one query per table
+
+    :param month_ids: list of month_ids
+    :param liquidities: list of the liquidity of each month in month_ids
+
+    :return: dict of {month_id: (variable investments, fixed investments, net worth)}
+    '''
     SCHEMAVar = SchemaInvestmentVariable()
+    SCHEMAFix = SchemaInvestmentFixed()
 
-    inv_var = query_inv_var(month_id)
+    inv_var_months = add_investment_changes(query_investments_history(month_ids))
+    inv_fix_months = query_inv_fix_months(month_ids)
+
+    tables = {}
+    for month_id, liquidity in zip(month_ids, liquidities):
+        inv_var = inv_var_months[inv_var_months[SCHEMAVar.MONTH_ID] == month_id].reset_index(drop=True)
+        inv_var = inv_var[[SCHEMAVar.NAME, SCHEMAVar.UNIT_PRICE, SCHEMAVar.D_UNIT_PRICE, SCHEMAVar.UNITS_OWNED, SCHEMAVar.VALUE, SCHEMAVar.D_VALUE]]
+
+        inv_fix = inv_fix_months[month_id]
+        inv_fix[[SCHEMAFix.AMOUNT, SCHEMAFix.RETURN]] /= 100  # convert from int pennies to £'s
+        inv_fix = inv_fix.sort_values(SCHEMAFix.MATURITY_DATE)
+        inv_fix = inv_fix[[SCHEMAFix.NAME, SCHEMAFix.COMPANY, SCHEMAFix.AMOUNT, SCHEMAFix.INTEREST, SCHEMAFix.RETURN, SCHEMAFix.DURATION, SCHEMAFix.MATURITY_DATE]]
+
+        net_worth = liquidity + inv_var[SCHEMAVar.VALUE].sum() + inv_fix[SCHEMAFix.AMOUNT].sum()
+
+        tables[month_id] = (inv_var, inv_fix, round(net_worth, 2))
+
+    return tables
+
+@dataclass
+class MonthBundle:
+    ''' everything the monthly dashboard displays for one month, loaded together so a month change is one data load '''
+    month_id: MonthKey
+    spending: pd.DataFrame
+    summary: pd.DataFrame
+    monthly_budget: float
+    monthly_spending: float
+    budget: pd.DataFrame
+    income: pd.DataFrame
+    liquidity: float
+    liquidity_prev: float
+    inv_var: pd.DataFrame
+    inv_fix: pd.DataFrame
+    net_worth: float
+    inv_var_prev: pd.DataFrame
+    inv_fix_prev: pd.DataFrame
+    net_worth_prev: float
+
+@versioned_cache()
+def month_bundle(month_id: MonthKey) -> MonthBundle:
+
+    month_id_prev = add_months(month_id, -1)
+
+    summary, monthly_budget, monthly_spending = summary_table(month_id, total_row=False)
+    accounts = batch_accounts_tables([month_id, month_id_prev])
+    _, liquidity = accounts[month_id]
+    _, liquidity_prev = accounts[month_id_prev]
+    investments = batch_investment_tables([month_id, month_id_prev], [liquidity, liquidity_prev])
+    inv_var, inv_fix, net_worth = investments[month_id]
+    inv_var_prev, inv_fix_prev, net_worth_prev = investments[month_id_prev]
+
+    return MonthBundle(month_id=month_id,
+                       spending=spending_table(month_id, dd_mm=False),
+                       summary=summary,
+                       monthly_budget=monthly_budget,
+                       monthly_spending=monthly_spending,
+                       budget=query_db('budget', month_id),
+                       income=income_table(month_id),
+                       liquidity=liquidity,
+                       liquidity_prev=liquidity_prev,
+                       inv_var=inv_var,
+                       inv_fix=inv_fix,
+                       net_worth=net_worth,
+                       inv_var_prev=inv_var_prev,
+                       inv_fix_prev=inv_fix_prev,
+                       net_worth_prev=net_worth_prev)
+
+def _historicsummary_select():
+    ''' select of the summary rows of every month with its date, from the monthly_summary rollup where it exists '''
+    months = MonthsTbl.__table__
+    if SQL().catalogue.has_table('monthly_summary'):
+        summary = MonthlySummaryTbl.__table__
+    else:
+        summary = summary_select().subquery()
+
+    query = select(summary.c.month_id, months.c.Date, *[summary.c[column] for column in SUMMARY_COLUMNS])
+    query = query.join_from(summary, months, summary.c.month_id == months.c.id)
+
+    return query.order_by(summary.c.month_id)
+
+def _historic_income_query():
+    ''' select of the net income and the bills budget of every month, grouped in the database '''
+    months = MonthsTbl.__table__
+    income = IncomeTbl.__table__
+    budget = BudgetTbl.__table__
+
+    net_income = select(income.c.month_id, func.sum(income.c.Amount).label('Income')).group_by(income.c.month_id).subquery()
+    bills = select(budget.c.month_id, func.sum(budget.c.Budget).label('Bills'))
+    bills = bills.where(budget.c.Category == 'Bills').group_by(budget.c.month_id).subquery()
+
+    query = select(months.c.id.label('month_id'),
+                   func.coalesce(net_income.c.Income, 0).label('Income'),
+                   func.coalesce(bills.c.Bills, 0).label('Bills'))
+    query = query.join_from(months, net_income, months.c.id == net_income.c.month_id, isouter=True)
+    query = query.join_from(months, bills, months.c.id == bills.c.month_id, isouter=True)
+
+    return query
+
+@versioned_cache()
+def historic_tables() -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    the summary of every month, in date order, for the historic dashboard
+
+    :return: (per-subcategory summary of every month, totals of every month including the savings rate), in £'s
+    '''
+    SCHEMA = SchemaMonzo()
+    SCHEMABudget = SchemaInputs()
+    money_columns = [SCHEMA.IN, SCHEMA.OUT, SCHEMA.TOTAL, SCHEMABudget.BUDGET, SCHEMA.DIFFERENCE]
 
-    inv_var[SCHEMAVar.D_UNIT_PRICE] = (100 * (inv_var[SCHEMAVar.UNIT_PRICE] - inv_var[SCHEMAVar.UNIT_PRICE_PREV]) / inv_var[SCHEMAVar.UNIT_PRICE_PREV]).round(2)
-    inv_var[SCHEMAVar.D_VALUE] = (inv_var[SCHEMAVar.VALUE] - inv_var[SCHEMAVar.VALUE_PREV]).round(2)
-    inv_var = inv_var[[SCHEMAVar.NAME, SCHEMAVar.UNIT_PRICE, SCHEMAVar.D_UNIT_PRICE, SCHEMAVar.UNITS_OWNED, SCHEMAVar.VALUE, SCHEMAVar.D_VALUE]]
+    summary = _read_aggregate(_historicsummary_select())
+    summary[money_columns] = summary[money_columns] / 100  # convert from int pennies to £'s
+
+    # the months' spending and budget, excluding Income and Bills as in summary_table()
+    spending = summary[~summary[SCHEMA.SUBCATEGORY].isin(['Income', 'Bills'])]
+    monthly = spending.groupby([SCHEMA.MONTH_ID, SCHEMA.DATETIME], sort=False)[[SCHEMABudget.BUDGET, SCHEMA.TOTAL]].sum()
+    monthly = monthly.reset_index().rename(columns={SCHEMA.TOTAL: 'Spending'})
 
+    income = _read_aggregate(_historic_income_query())
+    income[['Income', 'Bills']] /= 100  # convert from int pennies to £'s
+    monthly = monthly.merge(income, how='left', on=SCHEMA.MONTH_ID)
+
+    # spending is negative, as is income after tax
+    monthly['Savings'] = monthly['Income'] - monthly['Bills'] + monthly['Spending']
+    monthly['Savings rate'] = (100 * monthly['Savings'] / monthly['Income'].where(monthly['Income'] != 0)).round(1)
+
+    return summary, monthly
+
+@versioned_cache()
+def investments_history_tables() -> tuple[pd.DataFrame, pd.DataFrame]:
+    '''
+    the full history of the investments for the investments dashboard
+
+    :return: (every month of every variable holding with its changes, every fixed investment ordered by maturity)
+    '''
     SCHEMAFix = SchemaInvestmentFixed()
 
-    inv_fix = query_inv_fix(month_id)
+    inv_var = add_investment_changes(query_investments_history())
 
+    with SQL().engine.connect() as conn:
+        query = select(InvestmentsFixedTbl.__table__).order_by(InvestmentsFixedTbl.__table__.c[SCHEMAFix.MATURITY_DATE])
+        inv_fix = pd.read_sql(sql=query, con=conn)
     inv_fix[[SCHEMAFix.AMOUNT, SCHEMAFix.RETURN]] /= 100  # convert from int pennies to £'s
-    inv_fix = inv_fix.sort_values(SCHEMAFix.MATURITY_DATE)
-    inv_fix = inv_fix[[SCHEMAFix.NAME, SCHEMAFix.COMPANY, SCHEMAFix.AMOUNT, SCHEMAFix.INTEREST, SCHEMAFix.RETURN, SCHEMAFix.DURATION, SCHEMAFix.MATURITY_DATE]]
-
-    net_worth = liquidity + inv_var[SCHEMAVar.VALUE].sum() + inv_fix[SCHEMAFix.AMOUNT].sum()
 
-    return inv_var, inv_fix, round(net_worth, 2)
+    return inv_var, inv_fix
 
 if __name__ == '__main__':
 
-    month_id = 'JAN 23'
+    month_id = 202301
     df = spending_table(month_id, False)
     inv_f, inv_v, _ = investment_tables(month_id, 1000)
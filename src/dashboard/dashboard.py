@@ -3,13 +3,14 @@ from utils.palettes import vibrant, create_palette
 import plotly.io as pio
 import plotly.graph_objects as go
 
-from dash import dcc, html, dash_table, Dash, Input, Output
+from dash import dcc, html, dash_table, Dash, Input, Output, ctx, no_update
 import dash_bootstrap_components as dbc
 from dash.dash_table.Format import Format, Group, Scheme, Symbol
 
 from sqlalchemy import Table, select
 
 from sql.db_manager import SQL, MonthsTbl
+from utils.months import month_label
 from dashboard.dash_inputs import *
 
 import pandas as pd
@@ -52,14 +53,13 @@ def monthly_title():
 
     table = Table(MonthsTbl.__tablename__, MonthsTbl.metadata)
     with db.engine.connect() as conn:
-        df = pd.read_sql(sql=select(table), con=conn)
-    months = df.sort_values('Date', ascending=False).id.unique()
+        months = conn.execute(select(table.c.id).order_by(table.c.id.desc())).scalars().all()
 
     return html.Div([
         html.H1(id='month_title',
                 children='Monthly Spending'),
         dcc.Dropdown(id='month_selection',
-                     options=months,
+                     options=[{'label': month_label(month_id), 'value': month_id} for month_id in months],
                      # placeholder="Select a month",
                      value=months[0]
                      )
@@ -69,9 +69,9 @@ def monthly_title():
 def income_summary():
     return dcc.Graph(id='income', figure={})
 
-def _update_income_summary(month_id):
+def _update_income_summary(bundle: MonthBundle):
 
-    income = income_table(month_id)
+    income = bundle.income
     paycheck = income.set_index('Type').loc['Paycheck', 'Amount']
 
     taxes = income.Amount.sum() - paycheck
@@ -79,9 +79,9 @@ def _update_income_summary(month_id):
     for idx, row in income.iterrows():
         taxes_str += f'{row.Type}: £{abs(row.Amount):.2f},<br>'
 
-    summary, _, monthly_spending = summary_table(month_id, total_row=False)
+    monthly_spending = bundle.monthly_spending
 
-    df_budget = query_db('budget', month_id)
+    df_budget = bundle.budget
     bills = -df_budget.loc[df_budget.Category=='Bills', 'Budget'].sum()/100
 
     fig = go.Figure()
@@ -139,16 +139,11 @@ def _update_income_summary(month_id):
 def investments_summary():
     return dcc.Graph(id='investments', figure={})
 
-def _update_investments_summary(month_id):
+def _update_investments_summary(bundle: MonthBundle):
 
-    dt_month_id_prev = datetime.strptime(month_id.lower(), '%b %y') - pd.DateOffset(months=1)
-    month_id_prev = datetime.strftime(dt_month_id_prev, '%b %y').upper()
-
-    _, liquidity = accounts_table(month_id)
-    _, liquidity_prev = accounts_table(month_id_prev)
-
-    inv_var, inv_fix, net_worth = investment_tables(month_id, liquidity)
-    inv_var_prev, inv_fix_prev, net_worth_prev = investment_tables(month_id_prev, liquidity)
+    liquidity, liquidity_prev = bundle.liquidity, bundle.liquidity_prev
+    inv_var, inv_fix, net_worth = bundle.inv_var, bundle.inv_fix, bundle.net_worth
+    inv_var_prev, inv_fix_prev, net_worth_prev = bundle.inv_var_prev, bundle.inv_fix_prev, bundle.net_worth_prev
 
     fig = go.Figure()
 
@@ -216,9 +211,9 @@ def bar_chart():
             # TODO: html.H6('This plot excludes the categories income and bills')
     ])
 
-def _update_bar_chart(sub_category, hide_zeros, month_id):
+def _update_bar_chart(sub_category, hide_zeros, bundle: MonthBundle):
 
-    df, _, _ = summary_table(month_id, total_row=False)
+    df = bundle.summary
     df = df[~df.Subcategory.isin(['Income', 'Bills'])]
     df.Total = -df.Total
 
@@ -307,8 +302,8 @@ def all_spending_table():
                                         {'if': {'filter_query': '{Subcategory} contains Personal', 'column_id':'Subcategory'}, 'color':'#FAC4AF'}],
             )
 
-def _update_all_spending_table(month_id):
-    spending = spending_table(month_id, dd_mm=True)
+def _update_all_spending_table(bundle: MonthBundle):
+    spending = bundle.spending.assign(Date=bundle.spending.Date.dt.strftime("%d/%m"))
     return spending.to_dict('records')
 
 # 6. SPENDING TIMELINE CHART
@@ -319,11 +314,11 @@ def timeline_chart():
         # TODO: html.H6('This plot excludes subcategories transfers and bills')
     ])
 
-def _update_timeline_chart(month_id):
+def _update_timeline_chart(bundle: MonthBundle):
 
-    df = spending_table(month_id, dd_mm=False)
+    df = bundle.spending
 
-    _, monthly_budget, _ = summary_table(month_id, total_row=True)
+    monthly_budget = bundle.monthly_budget
 
     start_d = df.Date[0]
     weekday, month_length = calendar.monthrange(start_d.year, start_d.month)
@@ -394,9 +389,9 @@ def sunburst_chart():
         # TODO: html.H6('This plot excludes the categories income and bills')
     ])
 
-def _update_sunburst_chart(spend_budget, month_id):
+def _update_sunburst_chart(spend_budget, bundle: MonthBundle):
 
-    df, monthly_budget, monthly_spending = summary_table(month_id, total_row=False)
+    df, monthly_budget, monthly_spending = bundle.summary, bundle.monthly_budget, bundle.monthly_spending
     df = df[~df.Subcategory.isin(['Income', 'Bills'])]
     df.Total = -df.Total
 
@@ -478,10 +473,227 @@ def spending_by_subcategory():
                                 ],
         page_size=20)
 
-def _update_spending_by_subcategory(month_id):
-    df, _, _ = summary_table(month_id, total_row=False)
+def _update_spending_by_subcategory(bundle: MonthBundle):
+    df = bundle.summary
     return df.drop('Category', axis=1).to_dict('records')
 
+# ALL MONTHLY COMPONENTS
+MONTHLY_OUTPUTS = [('income', 'figure'),
+                   ('investments', 'figure'),
+                   ('bar_plot', 'figure'),
+                   ('all_spending_table', 'data'),
+                   ('timeline_chart', 'figure'),
+                   ('sunburst', 'figure'),
+                   ('spending_by_subcategory_table', 'data')]
+
+def _update_monthly_dashboard(month_id, sub_category, hide_zeros, spend_budget, triggered_id=None):
+    '''
+    loads the month's data bundle once and returns the outputs of every monthly component, in MONTHLY_OUTPUTS order.
+    When only a chart's own control changed (triggered_id), the other components are left as they are (no_update).
+    '''
+    bundle = month_bundle(month_id)
+
+    if triggered_id in ('bar_plot_radio_item', 'bar_plot_checklist'):
+        return [no_update, no_update, _update_bar_chart(sub_category, hide_zeros, bundle),
+                no_update, no_update, no_update, no_update]
+    if triggered_id == 'sunburst_radio_item':
+        return [no_update, no_update, no_update, no_update, no_update,
+                _update_sunburst_chart(spend_budget, bundle), no_update]
+
+    return [_update_income_summary(bundle),
+            _update_investments_summary(bundle),
+            _update_bar_chart(sub_category, hide_zeros, bundle),
+            _update_all_spending_table(bundle),
+            _update_timeline_chart(bundle),
+            _update_sunburst_chart(spend_budget, bundle),
+            _update_spending_by_subcategory(bundle)]
+
+'''
+HISTORIC COMPONENTS LAYOUT
+
+------------------------
+|       1       |  2   |
+------------------------
+|          3           |
+------------------------
+
+1 - spending vs budget by category
+2 - savings rate
+3 - spending trend of each subcategory
+'''
+
+# 1. SPENDING VS BUDGET BY CATEGORY
+def historic_spending_chart(summary, monthly):
+
+    df = summary[~summary.Subcategory.isin(['Income', 'Bills'])]
+    df = df.groupby(['Date', 'Category'], as_index=False)[['Total', 'Budget']].sum()
+
+    fig = go.Figure()
+
+    for cat in df.Category.unique():
+        df_cat = df[df.Category == cat]
+        fig.add_trace(
+            go.Bar(name=cat,
+                   x=df_cat.Date,
+                   y=-df_cat.Total,
+                   customdata=df_cat.Budget,
+                   marker=dict(color=subcategory_palette.get(cat + ' ', '#D3D3D3')),
+                   hovertemplate='%{x|%b %y}<br>Spent: £%{y:.2f}<br>Budget: £%{customdata:.2f}'))
+
+    fig.add_trace(
+        go.Scatter(name='Budget',
+                   x=monthly.Date,
+                   y=monthly.Budget,
+                   line={'color': 'green', 'dash': 'dash'},
+                   hovertemplate='%{x|%b %y}<br>Budget: £%{y:.2f}'))
+
+    fig.update_layout(barmode='stack',
+                      legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1),
+                      margin=dict(t=5, l=5, r=5, b=5),
+                      height=350)
+
+    fig.update_yaxes(tickprefix='£')
+
+    return dcc.Graph(id='historic_spending', figure=fig)
+
+# 2. SAVINGS RATE
+def savings_rate_chart(monthly):
+
+    fig = go.Figure()
+
+    fig.add_trace(
+        go.Bar(name='Savings rate',
+               x=monthly.Date,
+               y=monthly['Savings rate'],
+               customdata=monthly.Savings,
+               marker=dict(color=np.where(monthly['Savings rate'] >= 0, 'green', 'red')),
+               hovertemplate='%{x|%b %y}<br>Saved: %{y:.1f}%<br>£%{customdata:.2f}'))
+
+    fig.update_layout(showlegend=False,
+                      margin=dict(t=5, l=5, r=5, b=5),
+                      height=350)
+
+    fig.update_yaxes(ticksuffix='%')
+
+    return dcc.Graph(id='savings_rate', figure=fig)
+
+# 3. SPENDING TREND OF EACH SUBCATEGORY
+def subcategory_trend_chart(subcategories):
+    return html.Div([
+        dcc.Dropdown(id='historic_subcategory_selection',
+                     options=subcategories,
+                     value=subcategories,
+                     multi=True),
+        dcc.Graph(id='subcategory_trend',
+                  figure={}),
+    ])
+
+def _update_subcategory_trend(subcategories):
+
+    summary, _ = historic_tables()
+
+    fig = go.Figure()
+
+    for subcat in subcategories:
+        df = summary[summary.Subcategory == subcat]
+        fig.add_trace(
+            go.Scatter(name=subcat,
+                       x=df.Date,
+                       y=-df.Total,
+                       mode='lines+markers',
+                       line={'color': subcategory_palette.get(subcat, '#D3D3D3')},
+                       hovertemplate='%{x|%b %y}<br>' + subcat + ': £%{y:.2f}'))
+
+    fig.update_layout(hovermode='x',
+                      margin=dict(t=5, l=5, r=5, b=5),
+                      height=350)
+
+    fig.update_yaxes(tickprefix='£')
+
+    return fig
+
+'''
+INVESTMENTS COMPONENTS LAYOUT
+
+------------------------
+|       1       |      |
+----------------|  3   |
+|       2       |      |
+------------------------
+
+1 - value of each variable holding over time
+2 - monthly unit price change of each variable holding
+3 - maturity ladder of the fixed investments
+'''
+
+# 1. HOLDINGS VALUE OVER TIME
+def holdings_value_chart(inv_var):
+
+    fig = go.Figure()
+
+    for name in inv_var.Name.unique():
+        df = inv_var[inv_var.Name == name]
+        fig.add_trace(
+            go.Scatter(name=name,
+                       x=df.Date,
+                       y=df.Value,
+                       stackgroup='holdings',
+                       hovertemplate='%{x|%b %y}<br>£%{y:,.2f}'))
+
+    fig.update_layout(hovermode='x',
+                      legend=dict(orientation='h', yanchor='bottom', y=1.02, xanchor='right', x=1),
+                      margin=dict(t=5, l=5, r=5, b=5),
+                      height=340)
+
+    fig.update_yaxes(tickprefix='£')
+
+    return dcc.Graph(id='holdings_value', figure=fig)
+
+# 2. UNIT PRICE CHANGE OF EACH HOLDING
+def unit_price_change_chart(inv_var):
+
+    fig = go.Figure()
+
+    for name in inv_var.Name.unique():
+        df = inv_var[inv_var.Name == name]
+        fig.add_trace(
+            go.Bar(name=name,
+                   x=df.Date,
+                   y=df['d. Unit Price (%)'],
+                   customdata=df['Unit Price'],
+                   hovertemplate='%{x|%b %y}<br>%{y:.2f}%<br>unit price: %{customdata:.2f}'))
+
+    fig.update_layout(barmode='group',
+                      showlegend=False,
+                      margin=dict(t=5, l=5, r=5, b=5),
+                      height=300)
+
+    fig.update_yaxes(ticksuffix='%')
+
+    return dcc.Graph(id='unit_price_change', figure=fig)
+
+# 3. FIXED INVESTMENT MATURITY LADDER
+def maturity_ladder_chart(inv_fix):
+
+    labels = inv_fix.apply(lambda row: f'{row.Name} £{row.Amount:,.0f} ({row.Matures:%d/%m/%y})', axis=1)
+
+    fig = go.Figure(
+        go.Bar(x=(inv_fix.Matures - inv_fix.Purchased).dt.total_seconds() * 1000,  # date axes are in ms
+               base=inv_fix.Purchased,
+               y=labels,
+               orientation='h',
+               customdata=inv_fix[['Interest (%)', 'Return']],
+               marker=dict(color=subcategory_palette['Holidays ']),
+               hovertemplate='%{y}<br>%{customdata[0]}%, returns £%{customdata[1]:,.2f}<extra></extra>'))
+
+    fig.update_layout(margin=dict(t=5, l=5, r=5, b=5),
+                      height=655)
+
+    fig.update_xaxes(type='date')
+    fig.update_yaxes(autorange='reversed')  # soonest maturity at the top
+
+    return dcc.Graph(id='maturity_ladder', figure=fig)
+
 '''
 THE THREE DIFFERENT DASHBOARDS
 - MONTHLY
@@ -523,14 +735,48 @@ def monthly_dashboard():
 
 # THE HISTORIC DASHBOARD
 def historic_dashboard():
+
+    summary, monthly = historic_tables()
+    subcategories = [subcat for subcat in subcategory_mapping().subcategories.categories
+                     if subcat in summary.Subcategory.unique() and subcat not in ['Income', 'Bills']]
+
     return html.Div([
-        html.H1('Historic Dashboard: Work in Progress')
+        dbc.Row([
+            dbc.Col([
+                # 1. SPENDING VS BUDGET BY CATEGORY
+                dbc.Card(dbc.CardBody(html.Div([historic_spending_chart(summary, monthly)])), style={"margin-bottom": "1rem", "margin-top": "1rem", "margin-left": "1rem"}),
+            ], width=8),
+            dbc.Col([
+                # 2. SAVINGS RATE
+                dbc.Card(dbc.CardBody(html.Div([savings_rate_chart(monthly)])), style={"margin-bottom": "1rem", "margin-top": "1rem", "margin-right": "1rem"}),
+            ], width=4),
+        ]),
+        dbc.Row([
+            dbc.Col([
+                # 3. SUBCATEGORY TRENDS
+                dbc.Card(dbc.CardBody(html.Div([subcategory_trend_chart(subcategories)])), style={"margin-bottom": "1rem", "margin-left": "1rem", "margin-right": "1rem"}),
+            ], width=12),
+        ]),
     ])
 
 # THE INVESTMENTS DASHBOARD
 def investments_dashboard():
+
+    inv_var, inv_fix = investments_history_tables()
+
     return html.Div([
-        html.H1('Investments Dashboard: Work in Progress')
+        dbc.Row([
+            dbc.Col([
+                # 1. HOLDINGS VALUE OVER TIME
+                dbc.Card(dbc.CardBody(html.Div([holdings_value_chart(inv_var)])), style={"margin-bottom": "1rem", "margin-top": "1rem", "margin-left": "1rem"}),
+                # 2. UNIT PRICE CHANGE OF EACH HOLDING
+                dbc.Card(dbc.CardBody(html.Div([unit_price_change_chart(inv_var)])), style={"margin-bottom": "1rem", "margin-left": "1rem"}),
+            ], width=7),
+            dbc.Col([
+                # 3. FIXED INVESTMENT MATURITY LADDER
+                dbc.Card(dbc.CardBody(html.Div([maturity_ladder_chart(inv_fix)])), style={"margin-bottom": "1rem", "margin-top": "1rem", "margin-right": "1rem"}),
+            ], width=5),
+        ]),
     ])
 
 '''
@@ -556,7 +802,11 @@ def _tab_selection(tab):
     elif tab == 'investments_tab':
         return investments_dashboard()
 
-def my_dashboard(demo=False):
+def my_dashboard(demo=False, single_callback=True):
+    '''
+    :param single_callback: bool, update every monthly component from one callback that loads the month once (default),
+                            rather than one callback per component
+    '''
     pio.templates.default = "plotly"
 
     # suppressed callback exceptions because ids of plots aren't give inn app.layout due to being called from add_tabs() function.
@@ -576,65 +826,84 @@ def my_dashboard(demo=False):
     def tab_selection(tab):
         return _tab_selection(tab)
 
-    # 2. INCOME SUMMARY
-    @app.callback(
-        Output(component_id='income', component_property='figure'),
-        Input(component_id='month_selection', component_property='value')
-    )
-    def update_income_summary(month_id):
-        return _update_income_summary(month_id)
-
-    # 3. INVESTMENTS SUMMARY
+    # HISTORIC SUBCATEGORY TRENDS
     @app.callback(
-        Output(component_id='investments', component_property='figure'),
-        Input(component_id='month_selection', component_property='value')
+        Output(component_id='subcategory_trend', component_property='figure'),
+        Input(component_id='historic_subcategory_selection', component_property='value')
     )
-    def update_investments_summary(month_id):
-        return _update_investments_summary(month_id)
+    def update_subcategory_trend(subcategories):
+        return _update_subcategory_trend(subcategories)
+
+    if single_callback:
+        @app.callback(
+            [Output(component_id=component, component_property=prop) for component, prop in MONTHLY_OUTPUTS],
+            Input(component_id='month_selection', component_property='value'),
+            Input(component_id='bar_plot_radio_item', component_property='value'),
+            Input(component_id='bar_plot_checklist', component_property='value'),
+            Input(component_id='sunburst_radio_item', component_property='value')
+        )
+        def update_monthly_dashboard(month_id, sub_category, hide_zeros, spend_budget):
+            return _update_monthly_dashboard(month_id, sub_category, hide_zeros, spend_budget, ctx.triggered_id)
+    else:
+        # 2. INCOME SUMMARY
+        @app.callback(
+            Output(component_id='income', component_property='figure'),
+            Input(component_id='month_selection', component_property='value')
+        )
+        def update_income_summary(month_id):
+            return _update_income_summary(month_bundle(month_id))
 
-    # 4. BAR CHART OF SPENDING
-    @app.callback(
-        Output(component_id='bar_plot', component_property='figure'),
-        Input(component_id='bar_plot_radio_item', component_property='value'),
-        Input(component_id='bar_plot_checklist', component_property='value'),
-        Input(component_id='month_selection', component_property='value')
-    )
-    def update_bar_plot(sub_category, hide_zeros, month_id):
-        return _update_bar_chart(sub_category, hide_zeros, month_id)
+        # 3. INVESTMENTS SUMMARY
+        @app.callback(
+            Output(component_id='investments', component_property='figure'),
+            Input(component_id='month_selection', component_property='value')
+        )
+        def update_investments_summary(month_id):
+            return _update_investments_summary(month_bundle(month_id))
+
+        # 4. BAR CHART OF SPENDING
+        @app.callback(
+            Output(component_id='bar_plot', component_property='figure'),
+            Input(component_id='bar_plot_radio_item', component_property='value'),
+            Input(component_id='bar_plot_checklist', component_property='value'),
+            Input(component_id='month_selection', component_property='value')
+        )
+        def update_bar_plot(sub_category, hide_zeros, month_id):
+            return _update_bar_chart(sub_category, hide_zeros, month_bundle(month_id))
 
-    # 5. ALL SPENDING DATA TABLE
-    @app.callback(
-        Output(component_id='all_spending_table', component_property='data'),
-        Input(component_id='month_selection', component_property='value')
-    )
-    def update_all_spending_table(month_id):
-        return _update_all_spending_table(month_id)
+        # 5. ALL SPENDING DATA TABLE
+        @app.callback(
+            Output(component_id='all_spending_table', component_property='data'),
+            Input(component_id='month_selection', component_property='value')
+        )
+        def update_all_spending_table(month_id):
+            return _update_all_spending_table(month_bundle(month_id))
 
-    # 6. SPENDING TIMELINE CHART
-    @app.callback(
-        Output(component_id='timeline_chart', component_property='figure'),
-        Input(component_id='month_selection', component_property='value')
-    )
-    def update_timeline_chart(month_id):
-        return _update_timeline_chart(month_id)
+        # 6. SPENDING TIMELINE CHART
+        @app.callback(
+            Output(component_id='timeline_chart', component_property='figure'),
+            Input(component_id='month_selection', component_property='value')
+        )
+        def update_timeline_chart(month_id):
+            return _update_timeline_chart(month_bundle(month_id))
 
-    # 7. SUNBURST CHART
+        # 7. SUNBURST CHART
 
-    @app.callback(
-        Output(component_id='sunburst', component_property='figure'),
-        Input(component_id='sunburst_radio_item', component_property='value'),
-        Input(component_id='month_selection', component_property='value')
-    )
-    def update_sunburst_plot(spend_budget, month_id):
-        return _update_sunburst_chart(spend_budget, month_id)
+        @app.callback(
+            Output(component_id='sunburst', component_property='figure'),
+            Input(component_id='sunburst_radio_item', component_property='value'),
+            Input(component_id='month_selection', component_property='value')
+        )
+        def update_sunburst_plot(spend_budget, month_id):
+            return _update_sunburst_chart(spend_budget, month_bundle(month_id))
 
-    # 8. SPENDING BY SUBCATEGORY TABLE
-    @app.callback(
-        Output(component_id='spending_by_subcategory_table', component_property='data'),
-        Input(component_id='month_selection', component_property='value')
-    )
-    def update_spending_by_subcategory(month_id):
-        return _update_spending_by_subcategory(month_id)
+        # 8. SPENDING BY SUBCATEGORY TABLE
+        @app.callback(
+            Output(component_id='spending_by_subcategory_table', component_property='data'),
+            Input(component_id='month_selection', component_property='value')
+        )
+        def update_spending_by_subcategory(month_id):
+            return _update_spending_by_subcategory(month_bundle(month_id))
 
     app.run_server()
 
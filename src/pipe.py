@@ -1,13 +1,102 @@
 import argparse
-from sql.db_manager import SQL
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from sqlalchemy import select, inspect, Integer
+from sql.db_manager import SQL, MonthsTbl, IngestedFilesTbl
 from api import *
 from dashboard.dashboard import my_dashboard
+from utils.frame_cache import FrameCache, file_sha256
+from utils.months import MonthKey, month_key, month_label
 
 import logging
 from utils.log import get_logger
 logger = get_logger(__name__)
 
 
+# tables in the order they must be written (months first, as the other tables reference it)
+TABLES = ['months', 'spending', 'budget', 'accounts', 'income', 'investments_variable', 'investments_fixed',
+          'ingested_files']
+# input sources that have a file per month
+MONTHLY_SOURCES = ['monzo', 'inputs', 'investments_variable']
+SOURCE_CLASSES = {'monzo': Monzo, 'inputs': Inputs, 'investments_variable': InvestmentVariable,
+                  'investments_fixed': InvestmentFixed}
+
+
+def ingest_tasks(month_ids: list[MonthKey], sources: list[str] = MONTHLY_SOURCES) -> list[tuple[str, MonthKey]]:
+    ''' the (source, month_id) pairs to preprocess to append month_ids '''
+    tasks = [(source, month_id) for month_id in month_ids for source in sources]
+    tasks.append(('investments_fixed', month_ids[0]))  # the same file every month, so only preprocess it once
+
+    return tasks
+
+
+def file_fingerprint(path: str, source: str, month_id: MonthKey = None) -> dict:
+    '''
+    the ingested_files manifest row of an input file: its size, mtime and sha256 of its contents. The id is the hash
+    (and month_id), so the same contents are recognised whatever the file is called.
+
+    :param month_id: int the month the file is ingested for, None for a file used by every month (investments_fixed)
+
+    :return: dict of {column: value}
+    '''
+    SCHEMA = SchemaIngestedFile()
+    sha256 = file_sha256(path)
+    stat = os.stat(path)
+
+    return {SCHEMA.ID: sha256 if month_id is None else f'{month_id} {sha256}',
+            SCHEMA.PATH: os.path.normpath(path),
+            SCHEMA.SOURCE: source,
+            SCHEMA.MONTH_ID: month_id,
+            SCHEMA.SIZE: stat.st_size,
+            SCHEMA.MTIME: stat.st_mtime,
+            SCHEMA.SHA256: sha256,
+            SCHEMA.DATETIME: pd.Timestamp.now()}
+
+
+def preprocess_source(source: str, month_id: MonthKey, demo: bool, cache: bool = True) -> dict:
+    '''
+    preprocesses a single input source for a month. Defined at module level so it can be run in a worker process.
+
+    :param cache: bool read the frames from the preprocessing cache (see utils/frame_cache.py) if the input file has
+                  been preprocessed before, and cache them if not
+
+    :return: dict of {table_name: pd.DataFrame}
+    '''
+    if not cache:
+        return read_source(source, month_id, demo)
+
+    frame_cache = FrameCache()
+    path = SOURCE_CLASSES[source](month_id).find_file(demo)
+    key = frame_cache.key(source, None if source == 'investments_fixed' else month_id, path)
+    frames = frame_cache.get(key)
+    if frames is None:
+        frames = read_source(source, month_id, demo)
+        frame_cache.put(key, frames)
+
+    return frames
+
+
+def read_source(source: str, month_id: MonthKey, demo: bool) -> dict:
+    '''
+    reads and preprocesses a single input source for a month
+
+    :return: dict of {table_name: pd.DataFrame}
+    '''
+    if source == 'monzo':
+        df_mz, months = Monzo(month_id).preprocess(demo=demo)
+        return {'months': months, 'spending': df_mz}
+    elif source == 'inputs':
+        bundle = Inputs(month_id).preprocess(demo=demo)
+        return {'budget': bundle.budget, 'accounts': bundle.accounts, 'income': bundle.income}
+    elif source == 'investments_variable':
+        return {'investments_variable': InvestmentVariable(month_id).preprocess(demo=demo)}
+    elif source == 'investments_fixed':
+        return {'investments_fixed': InvestmentFixed(month_id).preprocess(demo=demo)}
+
+    raise KeyError(f'{source} is not a valid source.')
+
+
 class pipeline:
 
     def __init__(self):
@@ -18,41 +107,308 @@ class pipeline:
         ''' creates all tables in the schema '''
         self.db.create_all_tables()
 
+    def create_indexes_in_db(self) -> None:
+        ''' creates any missing indexes on the existing tables '''
+        self.db.create_indexes()
+
     def delete_all_db_tables(self) -> None:
         ''' deletes all tables from the schema '''
         self.db.delete_all_tables()
 
-    def append_to_db(self, month_id: str, demo: bool) -> None:
-        ''' iterate through all tables in schema, appending all non-duplicate rows'''
-        mz = Monzo(month_id)
-        df_mz, months = mz.preprocess(demo=demo)
-        self.db.append_to_db(months, 'months')
-        self.db.append_to_db(df_mz, 'spending')
+    def check_schema(self) -> None:
+        '''
+        raises if the database was created before month ids were stored as integers (yyyymm) and the strings of
+        spending were moved to lookup tables, as appending to it would mix the two. Such a database has to be rebuilt
+        from data/ (--delete --create --append).
+        '''
+        if not self.db.catalogue.has_table('months'):
+            return
+
+        month_id_type = {column['name']: column['type'] for column in inspect(self.db.engine).get_columns('months')}['id']
+        lookups = not self.db.catalogue.has_table('spending') or self.db.catalogue.has_table('types')
+        if not isinstance(month_id_type, Integer) or not lookups:
+            raise ValueError(f'{self.db.engine.url.database} has the schema of an earlier version (string month ids '
+                             f'or no lookup tables). Rebuild it from data/ with --delete --create --append.')
+
+    def preprocess(self, month_ids: list[MonthKey], demo: bool, workers: int = 1, sources: list[str] = MONTHLY_SOURCES,
+                   tasks: list[tuple[str, MonthKey]] = None, cache: bool = True) -> dict:
+        '''
+        preprocesses every source (of sources) of every month. With workers > 1 each (month, source) pair is run in a separate
+        process. Results are keyed by month and table, so they do not depend on the order the processes finish in.
+
+        :param tasks: list of (source, month_id) to preprocess instead, e.g. without the files already ingested
+        :param cache: bool use the preprocessing cache, evicting its least recently used entries afterwards
+
+        :return: dict of {month_id: {table_name: pd.DataFrame}}
+        '''
+        if tasks is None:
+            tasks = ingest_tasks(month_ids, sources)
+
+        frames = {month_id: {} for month_id in month_ids}
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(preprocess_source, source, month_id, demo, cache): month_id
+                           for source, month_id in tasks}
+                for future in as_completed(futures):
+                    frames[futures[future]].update(future.result())
+        else:
+            for source, month_id in tasks:
+                frames[month_id].update(preprocess_source(source, month_id, demo, cache))
+        if cache:
+            FrameCache().evict()
+
+        return frames
+
+    def write_to_db(self, frames: dict, summaries: list[MonthKey] = ()) -> dict:
+        '''
+        appends all non-duplicate rows of one month's preprocessed frames in a single transaction, in foreign key
+        order. If any table fails nothing from the month is written.
+
+        :param frames: dict of {table_name: pd.DataFrame} for one month (see preprocess())
+        :param summaries: list of month_ids whose monthly_summary is recomputed in the same transaction, after the frames
+
+        :return: dict of {table_name: number of rows appended}
+        '''
+        if summaries and not self.db.catalogue.has_table('monthly_summary'):
+            self.db.create_table('monthly_summary')  # databases created before the table existed
+
+        uow = self.db.unit_of_work()
+        for table_name in TABLES:
+            if table_name in frames:
+                uow.stage(frames[table_name], table_name)
+        for month_id in summaries:
+            uow.stage_summary(month_id)
+
+        return uow.commit()
+
+    def stream_monzo_to_db(self, month_id: MonthKey, demo: bool, chunksize: int) -> dict:
+        '''
+        appends the month's Monzo statement chunksize rows at a time (see Monzo.preprocess_chunks), with a transaction
+        per chunk, so memory is bounded by the chunk rather than the statement
+
+        :return: dict of {table_name: number of rows appended}
+        '''
+        appended = {'months': 0, 'spending': 0}
+        for spending, months in Monzo(month_id).preprocess_chunks(chunksize, demo=demo):
+            for table_name, inserted in self.write_to_db({'months': months, 'spending': spending}).items():
+                appended[table_name] += inserted
+
+        return appended
+
+    def append_to_db(self, month_id: MonthKey, demo: bool, workers: int = 1, chunksize: int = None,
+                     force: bool = False, cache: bool = True) -> dict:
+        '''
+        iterate through all tables in schema, appending all non-duplicate rows
+
+        :param month_id: int yyyymm (see utils/months.py)
+        :param demo: bool use demo input files
+        :param workers: int number of processes to preprocess with
+        :param chunksize: int if given, stream the Monzo statement into the database this many rows at a time
+        :param force: bool preprocess every input file, even those already in the ingested_files manifest
+        :param cache: bool use the preprocessing cache (see utils/frame_cache.py)
 
-        bud = Budget(month_id)
-        df_bud = bud.preprocess(demo=demo)
-        self.db.append_to_db(df_bud, 'budget')
+        :return: dict of {table_name: number of rows appended}
+        '''
+        return self.append_range(month_id, month_id, demo, workers, chunksize, force, cache).loc[month_id].to_dict()
 
-        acc = Accounts(month_id)
-        df_acc = acc.preprocess(demo=demo)
-        self.db.append_to_db(df_acc, 'accounts')
+    def append_range(self, start_month_id: MonthKey, end_month_id: MonthKey, demo: bool, workers: int = 1,
+                     chunksize: int = None, force: bool = False, cache: bool = True) -> pd.DataFrame:
+        '''
+        appends every month from start_month_id to end_month_id (inclusive) in this process, using one engine. Input
+        files already in the ingested_files manifest are skipped before they are read (see skip_ingested()), as is the
+        Monzo statement of a month already appended from a history statement (see skip_history()).
 
-        inc = Income(month_id)
-        df_inc = inc.preprocess(demo=demo)
-        self.db.append_to_db(df_inc, 'income')
+        :param chunksize: int if given, stream each Monzo statement into the database this many rows at a time, rather
+                          than in the same transaction as the rest of the month
+        :param force: bool preprocess every input file, even those already in the ingested_files manifest
+        :param cache: bool use the preprocessing cache (see utils/frame_cache.py)
 
-        inv = InvestmentVariable(month_id)
-        df_inv = inv.preprocess(demo=demo)
-        self.db.append_to_db(df_inv, 'investments_variable')
+        :return: pd.DataFrame of rows appended with a row per month and a column per table
+        '''
+        self.check_schema()
+        month_ids = Finances.month_range(start_month_id, end_month_id)
+        tasks = self.skip_history(ingest_tasks(month_ids), demo)
+        DATA_FILES.check(tasks, demo)  # every missing or ambiguous file, before anything is written
+        tasks, manifest = self.skip_ingested(tasks, demo, force)
+        stream = [month_id for source, month_id in tasks if source == 'monzo' and chunksize is not None]
+        frames = self.preprocess(month_ids, demo, workers,
+                                 tasks=[task for task in tasks if task[0] != 'monzo' or chunksize is None], cache=cache)
 
-        inf = InvestmentFixed(month_id)
-        df_inf = inf.preprocess(demo=demo)
-        self.db.append_to_db(df_inf, 'investments_fixed')
+        appended = {}
+        for month_id in month_ids:
+            appended[month_id] = {}
+            if month_id not in manifest:
+                logging.info(f'every input file of {month_label(month_id)} has already been ingested')
+                continue
+
+            logging.info(f'appending {month_label(month_id)}')
+            if month_id in stream:
+                appended[month_id].update(self.stream_monzo_to_db(month_id, demo, chunksize))
+            frames[month_id]['ingested_files'] = manifest[month_id]
+            appended[month_id].update(self.write_to_db(frames[month_id], summaries=[month_id]))
+
+        report = pd.DataFrame.from_dict(appended, orient='index').reindex(month_ids).fillna(0).astype(int)
+        logging.info(f'rows appended per month:\n{report.to_string()}')
+
+        return report
+
+    def append_history(self, log_file: str, force: bool = False, chunksize: int = None) -> dict:
+        '''
+        appends a Monzo statement covering several months (e.g. the full account history) in one pass: the months and
+        spending of every month in the statement, then each month's monthly_summary. The statement is recorded in the
+        ingested_files manifest once for every month it covers, so --append leaves out the Monzo statement of those
+        months (see skip_history()). The manifest and summaries are written in the same transaction as the statement's
+        rows (with chunksize, in one after the last chunk).
+
+        :param log_file: str path of the statement
+        :param force: bool append the statement even if it is already in the ingested_files manifest
+        :param chunksize: int if given, read the statement this many rows at a time with a transaction per chunk (see
+                          Monzo.preprocess_chunks), so memory is bounded by the chunk rather than the statement
+
+        :return: dict of {table_name: number of rows appended}
+        '''
+        self.check_schema()
+        SCHEMA = SchemaIngestedFile()
+        sha256 = file_sha256(log_file)
+        ingested = self.ingested_files()
+        if not force and sha256 in set(ingested.loc[ingested[SCHEMA.SOURCE] == 'monzo_history', SCHEMA.SHA256]):
+            logging.info(f'{log_file} has already been ingested')
+            return {}
+
+        appended = {'months': 0, 'spending': 0}
+        month_ids = set()
+        if chunksize is None:
+            spending, months = Monzo.preprocess_history(log_file)
+            frames = {'months': months, 'spending': spending}  # written with the manifest and summaries below
+            month_ids.update(months[SchemaMonzo.ID])
+        else:
+            frames = {}
+            for spending, months in Monzo(month_id=None).preprocess_chunks(chunksize, log_file=log_file):
+                for table_name, inserted in self.write_to_db({'months': months, 'spending': spending}).items():
+                    appended[table_name] += inserted
+                month_ids.update(months[SchemaMonzo.ID])
+
+        frames['ingested_files'] = pd.DataFrame([file_fingerprint(log_file, 'monzo_history', month_id)
+                                                 for month_id in sorted(month_ids)])
+        for table_name, inserted in self.write_to_db(frames, summaries=sorted(month_ids)).items():
+            appended[table_name] = appended.get(table_name, 0) + inserted
+        logging.info(f'{len(month_ids)} months appended from {log_file}')
+
+        logging.info(f'rows appended: {appended}')
+
+        return appended
+
+    def skip_history(self, tasks: list[tuple[str, MonthKey]], demo: bool) -> list[tuple[str, MonthKey]]:
+        '''
+        drops the monzo task of every month whose spending has been appended from a history statement (see
+        append_history()) and that has no statement of its own in data/statements, so the month's other input files can
+        still be appended
+
+        :return: list of the tasks left
+        '''
+        SCHEMA = SchemaIngestedFile()
+        ingested = self.ingested_files()
+        history = set(ingested.loc[ingested[SCHEMA.SOURCE] == 'monzo_history', SCHEMA.MONTH_ID])
+
+        return [(source, month_id) for source, month_id in tasks
+                if not (source == 'monzo' and month_id in history and not DATA_FILES.candidates('monzo', month_id, demo))]
+
+    def ingested_files(self) -> pd.DataFrame:
+        ''' the ingested_files manifest, created if the database predates it '''
+        if not self.db.catalogue.has_table('ingested_files'):
+            self.db.create_table('ingested_files')
+
+        with self.db.engine.connect() as conn:
+            return pd.read_sql(sql=select(IngestedFilesTbl.__table__), con=conn)
+
+    @staticmethod
+    def is_ingested(ingested: pd.DataFrame, fingerprint: dict) -> bool:
+        ''' whether the file of fingerprint (see file_fingerprint()) is in the ingested manifest '''
+        return fingerprint[SchemaIngestedFile.ID] in set(ingested[SchemaIngestedFile.ID])
+
+    def skip_ingested(self, tasks: list[tuple[str, MonthKey]], demo: bool, force: bool = False) -> tuple[list, dict]:
+        '''
+        checks the input file of every (source, month_id) task against the ingested_files manifest before anything is
+        parsed, and drops the tasks whose file has already been ingested for the month (unless force). A file whose
+        path, size and mtime match a manifest row is taken to be unchanged without being hashed again.
+
+        :return: tuple of (tasks still to preprocess, dict of {month_id: pd.DataFrame of manifest rows for its files})
+        '''
+        SCHEMA = SchemaIngestedFile()
+        ingested = self.ingested_files()
+        unchanged = set(zip(ingested[SCHEMA.PATH], ingested[SCHEMA.MONTH_ID].fillna(0),
+                            ingested[SCHEMA.SIZE], ingested[SCHEMA.MTIME]))
+
+        remaining, manifest = [], {}
+        for source, month_id in tasks:
+            path = SOURCE_CLASSES[source](month_id).find_file(demo)
+            file_month_id = None if source == 'investments_fixed' else month_id
+            stat = os.stat(path)
+            if not force and (os.path.normpath(path), file_month_id or 0, stat.st_size, stat.st_mtime) in unchanged:
+                continue
+
+            fingerprint = file_fingerprint(path, source, file_month_id)
+            if not force and self.is_ingested(ingested, fingerprint):
+                continue
+
+            remaining.append((source, month_id))
+            manifest.setdefault(month_id, []).append(fingerprint)
+
+        skipped = len(tasks) - len(remaining)
+        if skipped:
+            logging.info(f'{skipped} input file(s) skipped, as they are already in the ingested_files manifest')
+
+        return remaining, {month_id: pd.DataFrame(rows) for month_id, rows in manifest.items()}
+
+    def month_ids_in_db(self) -> list[MonthKey]:
+        ''' the month_id of every month in the database, in date order '''
+        table = MonthsTbl.__table__
+        with self.db.engine.connect() as conn:
+            return conn.execute(select(table.c.id).order_by(table.c.id)).scalars().all()
+
+    def refresh_monthly_summary(self, month_id: MonthKey) -> int:
+        '''
+        recomputes a month's rows of the monthly_summary table from its spending and budget. Called whenever a month is
+        ingested, so the dashboard reads the summary rather than recomputing it.
+
+        :return: int number of summary rows written
+        '''
+        return self.write_to_db({}, summaries=[month_id])['monthly_summary']
+
+    def check_monthly_summary(self) -> list[MonthKey]:
+        '''
+        compares the stored monthly_summary of every month with a recompute from its spending and budget
+
+        :return: list of month_ids whose stored summary is stale or missing
+        '''
+        def in_order(df: pd.DataFrame) -> pd.DataFrame:
+            return df.sort_values(['Subcategory', 'Category']).reset_index(drop=True)
+
+        stale = []
+        for month_id in self.month_ids_in_db():
+            stored = self.db.stored_summary(month_id)
+            if stored is None or not in_order(stored).equals(in_order(self.db.compute_summary(month_id))):
+                logging.warning(f'monthly_summary for {month_label(month_id)} does not match its spending and budget.')
+                stale.append(month_id)
+
+        logging.info(f'monthly_summary checked: {len(stale)} stale month(s) {[month_label(month_id) for month_id in stale]}')
+
+        return stale
 
     @staticmethod
     def generate_dashboard():
         my_dashboard()
 
+
+def to_month_id(month: str, year: str) -> MonthKey:
+    ''' converts a month (e.g. July/july/jul/JUL) and year (YY or YYYY) to a month_id (yyyymm, see utils/months.py) '''
+    months = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+    if month[:3].upper() not in months:
+        raise KeyError(f'"{month[:3].upper()}" is not a valid month.')
+
+    return month_key(f'{month[:3].upper()} {year[-2:]}')
+
+
 if __name__ == '__main__':
 
     # N.B. when using demo you must instantiate pipeline(), not just use e.g. pipeline.append_to_db()
@@ -61,25 +417,39 @@ if __name__ == '__main__':
 
     parser.add_argument("-c", "--create", action=argparse.BooleanOptionalAction)  # create db tables
     parser.add_argument("--delete", action=argparse.BooleanOptionalAction)  # delete all db tables
+    parser.add_argument("--index", action=argparse.BooleanOptionalAction)  # create missing indexes on db tables
+    parser.add_argument("--check-summary", action=argparse.BooleanOptionalAction)  # check monthly_summary is up to date
+    parser.add_argument("--refresh-summary", action=argparse.BooleanOptionalAction)  # rebuild monthly_summary
     parser.add_argument("-a", "--append", action=argparse.BooleanOptionalAction)  # append to db
     parser.add_argument("-d", "--dashboard", action=argparse.BooleanOptionalAction)  # generate dashboard
     parser.add_argument("--demo", action=argparse.BooleanOptionalAction)  # use demo database
 
     parser.add_argument("-m", "--month")  # month
     parser.add_argument("-y", "--year")  # year
+    parser.add_argument("--from", dest="from_month")  # first month of a range e.g. nov-22
+    parser.add_argument("--to", dest="to_month")  # last month of a range e.g. jul-23
+    parser.add_argument("--workers", type=int, default=1)  # number of processes to preprocess with
+    parser.add_argument("--chunksize", type=int)  # stream monzo statements into the db this many rows at a time
+    parser.add_argument("--history")  # path of a monzo statement covering several months, to append in one pass
+    parser.add_argument("--force", action=argparse.BooleanOptionalAction)  # append files already ingested
+    parser.add_argument("--cache", action=argparse.BooleanOptionalAction, default=True)  # --no-cache to always re-parse
 
     args = parser.parse_args()
 
-    if args.append and (args.month is None or args.year is None):
-        parser.error("For 'append', both --month and --year must be specified.")
+    append_range = not (args.from_month is None and args.to_month is None)
+    if append_range and (args.from_month is None or args.to_month is None):
+        parser.error("For a range, both --from and --to must be specified.")
+    if args.append and not append_range and (args.month is None or args.year is None):
+        parser.error("For 'append', both --month and --year (or --from and --to) must be specified.")
 
     if not (args.month is None or args.year is None):
-        months = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
-        if args.month[:3].upper() not in months:
-            raise KeyError(f'"{args.month[:3].upper()}" is not a valid month.')
+        month_id = to_month_id(args.month, args.year)
+        logging.info(f'month_id is {month_id} ({month_label(month_id)})')
 
-        month_id = f'{args.month[:3].upper()} {args.year[-2:]}'
-        logging.info(f'month_id is "{month_id}"')
+    if append_range:
+        start_month_id = to_month_id(*re.split(r'[-\s]', args.from_month))
+        end_month_id = to_month_id(*re.split(r'[-\s]', args.to_month))
+        logging.info(f'month range is {month_label(start_month_id)} to {month_label(end_month_id)}')
 
     if args.demo:
         os.environ['demo'] = 'True'
@@ -89,8 +459,21 @@ if __name__ == '__main__':
         pipe.delete_all_db_tables()
     if args.create:
         pipe.create_tables_in_db()
-    if args.append:
-        pipe.append_to_db(month_id, args.demo)
+    if args.index:
+        pipe.create_indexes_in_db()
+    if args.append and append_range:
+        pipe.append_range(start_month_id, end_month_id, args.demo, args.workers, args.chunksize, args.force, args.cache)
+    elif args.append:
+        pipe.append_to_db(month_id, args.demo, args.workers, args.chunksize, args.force, args.cache)
+    if args.history:
+        pipe.append_history(args.history, args.force, args.chunksize)
+    if args.refresh_summary:
+        pipe.check_schema()
+        for month_id in pipe.month_ids_in_db():
+            pipe.refresh_monthly_summary(month_id)
+    if args.check_summary:
+        pipe.check_schema()
+        pipe.check_monthly_summary()
     if args.dashboard:
         pipe.generate_dashboard()
 
@@ -1,10 +1,17 @@
-from sqlalchemy import delete, create_engine, Column, String, DateTime, Integer, Float, ForeignKey, select, inspect, Table
+from sqlalchemy import delete, create_engine, event, Column, String, DateTime, Integer, Float, ForeignKey, select, inspect, Table, Index, \
+    UniqueConstraint, func, tuple_, and_
+from sqlalchemy.sql import Select
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql.dml import Insert
+from sqlalchemy.dialects import sqlite, postgresql
 import pandas as pd
-import logging
 import psycopg2
 import os
-from api import SchemaMonzo, SchemaInputs, SchemaInvestmentFixed, SchemaInvestmentVariable
+import threading
+import functools
+from api import SchemaMonzo, SchemaInputs, SchemaInvestmentFixed, SchemaInvestmentVariable, SchemaIngestedFile
+from utils.months import month_range
 
 import logging
 from utils.log import get_logger
@@ -18,7 +25,7 @@ class MonthsTbl(Base):
     __tablename__ = 'months'
     SCHEMA = SchemaMonzo()
 
-    id = Column(String, primary_key=True)
+    id = Column(Integer, primary_key=True)  # yyyymm (see utils/months.py)
     locals()[SCHEMA.DATETIME] = Column(DateTime)
 
     def __repr__(self):
@@ -26,19 +33,78 @@ class MonthsTbl(Base):
                f'{self.SCHEMA.DATETIME}={getattr(self, self.SCHEMA.DATETIME)})>'
 
 
+class TypesTbl(Base):
+    ''' sqlalchemy table class for types, the distinct transaction types of spending '''
+    __tablename__ = 'types'
+    SCHEMA = SchemaMonzo()
+
+    id = Column(Integer, primary_key=True)
+    locals()[SCHEMA.TYPE] = Column(String, unique=True, nullable=False)
+
+    def __repr__(self):
+        return f'<TypesTbl({self.SCHEMA.ID}={getattr(self, self.SCHEMA.ID)},' \
+               f'{self.SCHEMA.TYPE}={getattr(self, self.SCHEMA.TYPE)})>'
+
+
+class MerchantsTbl(Base):
+    ''' sqlalchemy table class for merchants, the distinct names of spending '''
+    __tablename__ = 'merchants'
+    SCHEMA = SchemaMonzo()
+
+    id = Column(Integer, primary_key=True)
+    locals()[SCHEMA.NAME] = Column(String, unique=True, nullable=False)
+
+    def __repr__(self):
+        return f'<MerchantsTbl({self.SCHEMA.ID}={getattr(self, self.SCHEMA.ID)},' \
+               f'{self.SCHEMA.NAME}={getattr(self, self.SCHEMA.NAME)})>'
+
+
+class CategoriesTbl(Base):
+    ''' sqlalchemy table class for categories, the distinct (category, subcategory) pairs of spending '''
+    __tablename__ = 'categories'
+    SCHEMA = SchemaMonzo()
+    __table_args__ = (UniqueConstraint(SCHEMA.CATEGORY, SCHEMA.SUBCATEGORY),)
+
+    id = Column(Integer, primary_key=True)
+    locals()[SCHEMA.CATEGORY] = Column(String, nullable=False)
+    locals()[SCHEMA.SUBCATEGORY] = Column(String, nullable=False)
+
+    def __repr__(self):
+        return f'<CategoriesTbl({self.SCHEMA.ID}={getattr(self, self.SCHEMA.ID)},' \
+               f'{self.SCHEMA.CATEGORY}={getattr(self, self.SCHEMA.CATEGORY)},' \
+               f'{self.SCHEMA.SUBCATEGORY}={getattr(self, self.SCHEMA.SUBCATEGORY)})>'
+
+
+class AddressesTbl(Base):
+    ''' sqlalchemy table class for addresses, the distinct addresses of spending '''
+    __tablename__ = 'addresses'
+    SCHEMA = SchemaMonzo()
+
+    id = Column(Integer, primary_key=True)
+    locals()[SCHEMA.ADDRESS] = Column(String, unique=True, nullable=False)
+
+    def __repr__(self):
+        return f'<AddressesTbl({self.SCHEMA.ID}={getattr(self, self.SCHEMA.ID)},' \
+               f'{self.SCHEMA.ADDRESS}={getattr(self, self.SCHEMA.ADDRESS)})>'
+
+
 class SpendingTbl(Base):
-    ''' sqlalchemy table class for spending '''
+    '''
+    sqlalchemy table class for spending. Its repeated strings are stored once in the types, merchants, categories and
+    addresses tables (see LOOKUPS), so frames are inserted with the strings and read back with decoded_select()
+    '''
     __tablename__ = 'spending'
+    __table_args__ = (Index('ix_spending_month_id_category_id', 'month_id', 'category_id'),
+                      Index('ix_spending_date', 'Date'),)
     SCHEMA = SchemaMonzo()
 
     id = Column(String, primary_key=True)
-    locals()[SCHEMA.MONTH_ID] = Column(String, ForeignKey('months.id', ondelete='CASCADE'))
+    locals()[SCHEMA.MONTH_ID] = Column(Integer, ForeignKey('months.id', ondelete='CASCADE'))
     locals()[SCHEMA.DATETIME] = Column(DateTime)
-    locals()[SCHEMA.TYPE] = Column(String)
-    locals()[SCHEMA.NAME] = Column(String)
-    locals()[SCHEMA.CATEGORY] = Column(String)  # category
-    locals()[SCHEMA.SUBCATEGORY] = Column(String)  # category
-    locals()[SCHEMA.ADDRESS] = Column(String)
+    locals()[SCHEMA.TYPE_ID] = Column(Integer, ForeignKey('types.id'))
+    locals()[SCHEMA.MERCHANT_ID] = Column(Integer, ForeignKey('merchants.id'))
+    locals()[SCHEMA.CATEGORY_ID] = Column(Integer, ForeignKey('categories.id'))
+    locals()[SCHEMA.ADDRESS_ID] = Column(Integer, ForeignKey('addresses.id'))
     locals()[SCHEMA.DESCRIPTION] = Column(String)
     locals()[SCHEMA.OUT] = Column(Integer)
     locals()[SCHEMA.IN] = Column(Integer)
@@ -47,23 +113,34 @@ class SpendingTbl(Base):
         return f'<SpendingTbl({self.SCHEMA.ID}={getattr(self, self.SCHEMA.ID)},' \
                f'{self.SCHEMA.MONTH_ID}={getattr(self, self.SCHEMA.MONTH_ID)},' \
                f'{self.SCHEMA.DATETIME}={getattr(self, self.SCHEMA.DATETIME)},' \
-               f'{self.SCHEMA.TYPE}={getattr(self, self.SCHEMA.TYPE)},' \
-               f'{self.SCHEMA.NAME}={getattr(self, self.SCHEMA.NAME)},' \
-               f'{self.SCHEMA.CATEGORY}={getattr(self, self.SCHEMA.CATEGORY)},' \
-               f'{self.SCHEMA.SUBCATEGORY}={getattr(self, self.SCHEMA.SUBCATEGORY)},' \
-               f'{self.SCHEMA.ADDRESS}={getattr(self, self.SCHEMA.ADDRESS)},' \
+               f'{self.SCHEMA.TYPE_ID}={getattr(self, self.SCHEMA.TYPE_ID)},' \
+               f'{self.SCHEMA.MERCHANT_ID}={getattr(self, self.SCHEMA.MERCHANT_ID)},' \
+               f'{self.SCHEMA.CATEGORY_ID}={getattr(self, self.SCHEMA.CATEGORY_ID)},' \
+               f'{self.SCHEMA.ADDRESS_ID}={getattr(self, self.SCHEMA.ADDRESS_ID)},' \
                f'{self.SCHEMA.DESCRIPTION}={getattr(self, self.SCHEMA.DESCRIPTION)},' \
                f'{self.SCHEMA.OUT}={getattr(self, self.SCHEMA.OUT)},' \
                f'{self.SCHEMA.IN}={getattr(self, self.SCHEMA.IN)})>'
 
 
+# columns of a table stored as the id of a row of a lookup table, so each distinct value is stored once
+# {table_name: [(lookup table_name, foreign key column, [columns of the lookup table])]}
+LOOKUPS = {'spending': [('types', SchemaMonzo.TYPE_ID, [SchemaMonzo.TYPE]),
+                        ('merchants', SchemaMonzo.MERCHANT_ID, [SchemaMonzo.NAME]),
+                        ('categories', SchemaMonzo.CATEGORY_ID, [SchemaMonzo.CATEGORY, SchemaMonzo.SUBCATEGORY]),
+                        ('addresses', SchemaMonzo.ADDRESS_ID, [SchemaMonzo.ADDRESS])]}
+# a missing value of a lookup row with other values, e.g. the category of ('', 'Groceries'). Lookup columns are NOT NULL,
+# as NULLs are never equal to each other, so a unique constraint would not stop the same pair being stored twice
+LOOKUP_MISSING = ''
+
+
 class BudgetTbl(Base):
     ''' sqlalchemy table class for budget '''
     __tablename__ = 'budget'
+    __table_args__ = (Index('ix_budget_month_id_subcategory', 'month_id', 'Subcategory'),)
     SCHEMA = SchemaInputs()
 
     id = Column(String, primary_key=True)
-    locals()[SCHEMA.MONTH_ID] = Column(String, ForeignKey('months.id', ondelete='CASCADE'))
+    locals()[SCHEMA.MONTH_ID] = Column(Integer, ForeignKey('months.id', ondelete='CASCADE'))
     locals()[SCHEMA.DATETIME] = Column(DateTime)
     locals()[SCHEMA.CATEGORY] = Column(String)
     locals()[SCHEMA.SUBCATEGORY] = Column(String)
@@ -81,12 +158,13 @@ class BudgetTbl(Base):
 class AccountsTbl(Base):
     ''' sqlalchemy table class for accounts '''
     __tablename__ = 'accounts'
+    __table_args__ = (Index('ix_accounts_month_id', 'month_id'),)
     SCHEMA = SchemaInputs()
 
     id = Column(String, primary_key=True)
     locals()[SCHEMA.ACCOUNT] = Column(String)
     locals()[SCHEMA.DATETIME] = Column(DateTime)
-    locals()[SCHEMA.MONTH_ID] = Column(String, ForeignKey('months.id', ondelete='CASCADE'))
+    locals()[SCHEMA.MONTH_ID] = Column(Integer, ForeignKey('months.id', ondelete='CASCADE'))
     locals()[SCHEMA.BALANCE] = Column(Integer)
 
     def __repr__(self):
@@ -100,12 +178,13 @@ class AccountsTbl(Base):
 class IncomeTbl(Base):
     ''' sqlalchemy table class for income '''
     __tablename__ = 'income'
+    __table_args__ = (Index('ix_income_month_id', 'month_id'),)
     SCHEMA = SchemaInputs
 
     id = Column(String, primary_key=True)
     locals()[SCHEMA.TYPE] = Column(String)
     locals()[SCHEMA.DATETIME] = Column(DateTime)
-    locals()[SCHEMA.MONTH_ID] = Column(String, ForeignKey('months.id', ondelete='CASCADE'))
+    locals()[SCHEMA.MONTH_ID] = Column(Integer, ForeignKey('months.id', ondelete='CASCADE'))
     locals()[SCHEMA.AMOUNT] = Column(Integer)
 
     def __repr__(self):
@@ -119,12 +198,14 @@ class IncomeTbl(Base):
 class InvestmentsVariableTbl(Base):
     ''' sqlalchemy table class for investments_variable '''
     __tablename__ = 'investments_variable'
+    __table_args__ = (Index('ix_investments_variable_month_id', 'month_id'),
+                      Index('ix_investments_variable_date', 'Date'),)
     SCHEMA = SchemaInvestmentVariable()
 
     id = Column(String, primary_key=True)
     locals()[SCHEMA.NAME] = Column(String)
     locals()[SCHEMA.DATETIME] = Column(DateTime)
-    locals()[SCHEMA.MONTH_ID] = Column(String, ForeignKey('months.id', ondelete='CASCADE'))
+    locals()[SCHEMA.MONTH_ID] = Column(Integer, ForeignKey('months.id', ondelete='CASCADE'))
     locals()[SCHEMA.COMPANY] = Column(String)
     locals()[SCHEMA.UNIT_PRICE] = Column(Float)
     locals()[SCHEMA.UNITS_OWNED] = Column(Float)
@@ -144,6 +225,7 @@ class InvestmentsVariableTbl(Base):
 class InvestmentsFixedTbl(Base):
     ''' sqlalchemy table class for investments_fixed '''
     __tablename__ = 'investments_fixed'
+    __table_args__ = (Index('ix_investments_fixed_purchased_matures', 'Purchased', 'Matures'),)
     SCHEMA = SchemaInvestmentFixed()
 
     id = Column(String, primary_key=True)
@@ -168,20 +250,226 @@ class InvestmentsFixedTbl(Base):
                f'{self.SCHEMA.RETURN}={getattr(self, self.SCHEMA.RETURN)})>'
 
 
+class MonthlySummaryTbl(Base):
+    ''' sqlalchemy table class for monthly_summary, the per-subcategory spending vs budget of each month (in pennies) '''
+    __tablename__ = 'monthly_summary'
+    __table_args__ = (Index('ix_monthly_summary_month_id', 'month_id'),)
+    SCHEMA = SchemaMonzo()
+    SCHEMAInputs = SchemaInputs()
+
+    id = Column(String, primary_key=True)
+    locals()[SCHEMA.MONTH_ID] = Column(Integer, ForeignKey('months.id', ondelete='CASCADE'))
+    locals()[SCHEMA.CATEGORY] = Column(String)
+    locals()[SCHEMA.SUBCATEGORY] = Column(String)
+    locals()[SCHEMA.IN] = Column(Integer)
+    locals()[SCHEMA.OUT] = Column(Integer)
+    locals()[SCHEMA.TOTAL] = Column(Integer)
+    locals()[SCHEMAInputs.BUDGET] = Column(Integer)
+    locals()[SCHEMA.DIFFERENCE] = Column(Integer)
+
+    def __repr__(self):
+        return f'<MonthlySummaryTbl({self.SCHEMA.ID}={getattr(self, self.SCHEMA.ID)},' \
+               f'{self.SCHEMA.MONTH_ID}={getattr(self, self.SCHEMA.MONTH_ID)},' \
+               f'{self.SCHEMA.CATEGORY}={getattr(self, self.SCHEMA.CATEGORY)},' \
+               f'{self.SCHEMA.SUBCATEGORY}={getattr(self, self.SCHEMA.SUBCATEGORY)},' \
+               f'{self.SCHEMA.IN}={getattr(self, self.SCHEMA.IN)},' \
+               f'{self.SCHEMA.OUT}={getattr(self, self.SCHEMA.OUT)},' \
+               f'{self.SCHEMA.TOTAL}={getattr(self, self.SCHEMA.TOTAL)},' \
+               f'{self.SCHEMAInputs.BUDGET}={getattr(self, self.SCHEMAInputs.BUDGET)},' \
+               f'{self.SCHEMA.DIFFERENCE}={getattr(self, self.SCHEMA.DIFFERENCE)})>'
+
+
+# subcategories left out of the spending and summary tables
+MISCELLANEOUS_CATEGORIES = ["General", "Charity", "Expenses", "Savings", "Transfers", "Family", "Finances"]
+SUMMARY_COLUMNS = ['Category', 'Subcategory', 'In', 'Out', 'Total', 'Budget', 'Diff.']
+
+
+class IngestedFilesTbl(Base):
+    '''
+    sqlalchemy table class for ingested_files, the manifest of input files already appended to the database. A month's
+    rows are removed with the month, so its files are ingested again if it is re-appended.
+    '''
+    __tablename__ = 'ingested_files'
+    __table_args__ = (Index('ix_ingested_files_path', 'path'),)
+    SCHEMA = SchemaIngestedFile()
+
+    id = Column(String, primary_key=True)
+    locals()[SCHEMA.PATH] = Column(String)
+    locals()[SCHEMA.SOURCE] = Column(String)
+    locals()[SCHEMA.MONTH_ID] = Column(Integer, ForeignKey('months.id', ondelete='CASCADE'))  # null for every month
+    locals()[SCHEMA.SIZE] = Column(Integer)
+    locals()[SCHEMA.MTIME] = Column(Float)
+    locals()[SCHEMA.SHA256] = Column(String)
+    locals()[SCHEMA.DATETIME] = Column(DateTime)  # when the file was ingested
+
+    def __repr__(self):
+        return f'<IngestedFilesTbl({self.SCHEMA.ID}={getattr(self, self.SCHEMA.ID)},' \
+               f'{self.SCHEMA.PATH}={getattr(self, self.SCHEMA.PATH)},' \
+               f'{self.SCHEMA.SOURCE}={getattr(self, self.SCHEMA.SOURCE)},' \
+               f'{self.SCHEMA.MONTH_ID}={getattr(self, self.SCHEMA.MONTH_ID)},' \
+               f'{self.SCHEMA.SIZE}={getattr(self, self.SCHEMA.SIZE)},' \
+               f'{self.SCHEMA.MTIME}={getattr(self, self.SCHEMA.MTIME)},' \
+               f'{self.SCHEMA.SHA256}={getattr(self, self.SCHEMA.SHA256)},' \
+               f'{self.SCHEMA.DATETIME}={getattr(self, self.SCHEMA.DATETIME)})>'
+
+
+# applied to every new SQLite connection
+SQLITE_PRAGMAS = {'journal_mode': 'WAL',  # readers (the dashboard) don't block the writer (the pipeline)
+                  'synchronous': 'NORMAL',  # safe with WAL and fsyncs far less often than FULL
+                  'cache_size': -64000,  # 64MB page cache (negative values are in KiB)
+                  'mmap_size': 268435456,  # memory map up to 256MB of the database file
+                  'foreign_keys': 'ON'}  # needed for the ON DELETE CASCADE used by SQL.delete_month()
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(address: str) -> Engine:
+    '''
+    Returns the engine for address, creating it the first time it is requested. Engines (and their connection pools)
+    are shared by every SQL instance in the process.
+
+    :param address: str database URL e.g. "sqlite:///data/spending.db"
+
+    :return: sqlalchemy Engine
+    '''
+    with _engines_lock:
+        if address not in _engines:
+            engine = create_engine(address)
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', set_sqlite_pragmas)
+            _engines[address] = engine
+            logging.info(f'SQL connection established to {address}')
+
+        return _engines[address]
+
+
+class SchemaCatalogue:
+    '''
+    The tables present in a database, reflected once per engine and then kept up to date by the create/drop methods
+    of SQL, together with the ORM class and column metadata of each table and a version number for the data.
+    '''
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self._table_names = None
+        self._lock = threading.Lock()
+        self.data_version = 0  # bumped by every write through SQL, so caches of query results know to refresh
+        self._version_connection = None  # see stored_version()
+        event.listen(engine, 'engine_disposed', lambda engine: self.close())
+
+    def bump_data_version(self) -> None:
+        ''' marks the data in the database as changed '''
+        with self._lock:
+            self.data_version += 1
+
+    def stored_version(self):
+        '''
+        a version of the data read from the database itself, which unlike data_version also changes when another
+        process (e.g. the pipeline) writes to it. For SQLite this is PRAGMA data_version of a connection kept for the
+        purpose, which changes whenever any other connection commits. None for other and in-memory databases.
+        '''
+        if self.engine.dialect.name != 'sqlite' or self.engine.url.database in (None, '', ':memory:'):
+            return None
+
+        with self._lock:
+            if self._version_connection is None:
+                # outside the engine's pool, as data_version only changes between reads on the same connection
+                cargs, cparams = self.engine.dialect.create_connect_args(self.engine.url)
+                self._version_connection = self.engine.dialect.connect(*cargs, **cparams)
+            cursor = self._version_connection.cursor()
+            cursor.execute('PRAGMA data_version')
+            version = cursor.fetchone()[0]
+            cursor.close()
+
+        return version
+
+    def close(self) -> None:
+        ''' closes the connection of stored_version(), called when the engine is disposed '''
+        with self._lock:
+            if self._version_connection is not None:
+                self._version_connection.close()
+                self._version_connection = None
+
+    @property
+    def table_names(self) -> set:
+        ''' names of the tables in the database '''
+        with self._lock:
+            if self._table_names is None:
+                self._table_names = set(inspect(self.engine).get_table_names())
+            return self._table_names
+
+    def has_table(self, table_name: str) -> bool:
+        '''
+        whether table_name exists in the database. A miss is re-reflected once, in case the table was created by
+        another process since the catalogue was loaded.
+        '''
+        if table_name in self.table_names:
+            return True
+        self.invalidate()
+        return table_name in self.table_names
+
+    def get_class(self, table_name: str) -> object:
+        ''' the sqlalchemy table class of table_name '''
+        return get_class_from_table_name(table_name)
+
+    def columns(self, table_name: str) -> list[str]:
+        ''' the column names of table_name, in schema order '''
+        return get_class_from_table_name(table_name).__table__.columns.keys()
+
+    def table_created(self, table_name: str) -> None:
+        with self._lock:
+            if self._table_names is not None:
+                self._table_names.add(table_name)
+
+    def table_dropped(self, table_name: str) -> None:
+        with self._lock:
+            if self._table_names is not None:
+                self._table_names.discard(table_name)
+
+    def invalidate(self) -> None:
+        ''' forces the table names to be reflected from the database on next use '''
+        with self._lock:
+            self._table_names = None
+
+
+_catalogues = {}
+
+
+def get_catalogue(engine: Engine) -> SchemaCatalogue:
+    ''' Returns the SchemaCatalogue for engine, creating it the first time it is requested '''
+    with _engines_lock:
+        if engine not in _catalogues:
+            _catalogues[engine] = SchemaCatalogue(engine)
+
+        return _catalogues[engine]
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    ''' sqlalchemy "connect" event listener that applies SQLITE_PRAGMAS to a new connection '''
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {pragma}={value}')
+    cursor.close()
+
+
 class SQL:
 
     def __init__(self, demo=False):
 
+        self.engine = get_engine(self.address())
+        self.catalogue = get_catalogue(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+
+    @staticmethod
+    def address() -> str:
+        ''' the URL of the database, chosen by the DEBUG and demo environment variables '''
         if os.getenv("DEBUG") == 'True':
-            address = r'sqlite:///data/debug.db'
+            return r'sqlite:///data/debug.db'
         elif os.getenv("demo") == 'True':
-            address = r'sqlite:///data/demo.db'
-        else:
-            address = r'sqlite:///data/spending.db'
+            return r'sqlite:///data/demo.db'
 
-        self.engine = create_engine(address)
-        self.Session = sessionmaker(bind=self.engine)
-        logging.info(f'SQL connection established to {address}')
+        return r'sqlite:///data/spending.db'
 
     def create_table(self, table_name: str) -> None:
         '''
@@ -193,16 +481,32 @@ class SQL:
         '''
         class_ = get_class_from_table_name(table_name)
         class_.__table__.create(bind=self.engine)
+        self.catalogue.table_created(table_name)
         logging.info(f'table created: {table_name}')
 
     def create_all_tables(self) -> None:
         ''' creates all tables in the schema '''
-        tbls = ['months', 'spending', 'budget', 'accounts', 'income', 'investments_variable', 'investments_fixed']
+        tbls = ['months', 'types', 'merchants', 'categories', 'addresses', 'spending', 'budget', 'accounts', 'income', 'investments_variable', 'investments_fixed',
+                'monthly_summary', 'ingested_files']
 
         for tbl in tbls:
             self.create_table(tbl)
 
 
+    def create_indexes(self) -> None:
+        ''' creates any missing indexes on existing tables, e.g. for a database created before they were added '''
+        inspector = inspect(self.engine)
+        for m in Base.registry.mappers:
+            table = m.class_.__table__
+            if not self.catalogue.has_table(table.name):
+                continue
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                index.create(bind=self.engine)
+                logging.info(f'index created: {index.name}')
+
     def delete_table(self, table_name: str) -> None:
         '''
         deletes a table from the database
@@ -211,16 +515,19 @@ class SQL:
 
         :return: None
         '''
-        if table_name not in inspect(self.engine).get_table_names():
+        if not self.catalogue.has_table(table_name):
             raise KeyError(f'{table_name} is not a valid table name.')
 
         class_ = get_class_from_table_name(table_name)
         class_.__table__.drop(self.engine)
+        self.catalogue.table_dropped(table_name)
+        self.catalogue.bump_data_version()
         logging.info(f'table deleted: {table_name}')
 
     def delete_all_tables(self) -> None:
         ''' deletes all tables from the schema '''
-        tbls = ['spending', 'budget', 'accounts', 'income', 'investments_variable', 'investments_fixed', 'months']
+        tbls = ['spending', 'types', 'merchants', 'categories', 'addresses', 'budget', 'accounts', 'income',
+                'investments_variable', 'investments_fixed', 'monthly_summary', 'ingested_files', 'months']
 
         for tbl in tbls:
             try:
@@ -228,47 +535,378 @@ class SQL:
             except:
                 logging.warning(f'table not found, cannot be deleted: {tbl}')
 
-    def delete_month(self, month_id: str) -> None:
+    def delete_month(self, month_id: int) -> None:
         ''' deletes a specific month from all tables '''
         table = Table(MonthsTbl.__tablename__, MonthsTbl.metadata)
-        with db.engine.connect() as conn:
+        with self.engine.begin() as conn:
             stmt = delete(table).where(table.c.id==month_id)
-            conn.execute(stmt)
+            conn.execute(stmt)  # other tables are cleared by ON DELETE CASCADE (see SQLITE_PRAGMAS)
+        self.catalogue.bump_data_version()
         logging.info(f'{month_id} has been deleted from all tables.')
 
-    def append_to_db(self, df: pd.DataFrame, table_name: str) -> None:
+    def bulk_insert(self, df: pd.DataFrame, table_name: str, chunksize: int = 1000) -> tuple[int, int]:
+        '''
+        Inserts df into specified table_name, leaving the database to skip any rows whose primary key is already present
+        (INSERT ... ON CONFLICT DO NOTHING). Rows are sent in chunks of chunksize with executemany, so the cost is
+        proportional to the size of df rather than the size of the table.
+
+        :param df: pd.DataFrame of values to be added to table
+        :param table_name: str __tablename__ of a sqlalchemy table class
+        :param chunksize: int number of rows sent per executemany
+
+        :return: tuple of (rows inserted, rows skipped)
+        '''
+        if not self.catalogue.has_table(table_name):
+            raise KeyError(f'{table_name} is not a valid table name.')
+
+        with self.engine.begin() as conn:
+            inserted, skipped = self._bulk_insert(conn, df, table_name, chunksize)
+        if inserted:
+            self.catalogue.bump_data_version()
+
+        return inserted, skipped
+
+    def _bulk_insert(self, conn: Connection, df: pd.DataFrame, table_name: str, chunksize: int = 1000) -> tuple[int, int]:
+        ''' bulk_insert() on an open connection, leaving the transaction to the caller '''
+        table = get_class_from_table_name(table_name).__table__
+        stmt = insert_ignore(table, self.engine.dialect.name)
+        df = self._encode_lookups(conn, df, table_name)
+
+        unknown = set(df.columns).difference(self.catalogue.columns(table_name))
+        if unknown != set():
+            raise KeyError(f'{unknown} are not columns of {table_name}.')
+
+        df = df.dropna(how='all')
+        records = df.astype(object).where(df.notna(), None).to_dict('records')
+
+        inserted = 0
+        for i in range(0, len(records), chunksize):
+            inserted += conn.execute(stmt, records[i:i + chunksize]).rowcount
+
+        return inserted, len(records) - inserted
+
+    def _encode_lookups(self, conn: Connection, df: pd.DataFrame, table_name: str) -> pd.DataFrame:
+        '''
+        replaces the columns of df stored in lookup tables (see LOOKUPS) with the ids of their values, first inserting
+        any values not already in the lookup tables (get-or-create, in bulk rather than per row). Only the lookup rows of
+        the distinct values of df are read, so the cost does not grow with the size of the lookup tables.
+        '''
+        for lookup_name, id_column, columns in LOOKUPS.get(table_name, []):
+            if set(columns).isdisjoint(df.columns):
+                continue
+
+            lookup = get_class_from_table_name(lookup_name).__table__
+            values = df.reindex(columns=columns).astype(object)
+            present = values.notna().any(axis=1).to_numpy()  # rows without any of the values are left without an id
+            values = values.where(values.notna(), LOOKUP_MISSING)
+            distinct = values[present].drop_duplicates()
+
+            known = self._select_lookup(conn, lookup, distinct, columns)
+            new = distinct.merge(known, on=columns, how='left')
+            new = new.loc[new['id'].isna(), columns]
+            if not new.empty:
+                conn.execute(insert_ignore(lookup, self.engine.dialect.name), new.to_dict('records'))
+                known = pd.concat([known, self._select_lookup(conn, lookup, new, columns)], ignore_index=True)
+
+            ids = values.merge(known, on=columns, how='left')['id']  # a left merge keeps the order of the rows
+            df = df.drop(columns=[column for column in columns if column in df.columns])
+            df[id_column] = ids.where(present).astype('Int64').to_numpy()
+
+        return df
+
+    @staticmethod
+    def _select_lookup(conn: Connection, lookup: Table, values: pd.DataFrame, columns: list[str],
+                       chunksize: int = 500) -> pd.DataFrame:
+        ''' the rows of lookup whose columns are one of the rows of values, selected chunksize values at a time '''
+        if len(columns) == 1:
+            key, keys = lookup.c[columns[0]], values[columns[0]].tolist()
+        else:
+            key, keys = tuple_(*[lookup.c[column] for column in columns]), list(values[columns].itertuples(index=False, name=None))
+
+        frames = [pd.read_sql(sql=select(lookup).where(key.in_(keys[i:i + chunksize])), con=conn)
+                  for i in range(0, len(keys), chunksize)]
+
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['id', *columns])
+
+    def append_to_db(self, df: pd.DataFrame, table_name: str) -> int:
         '''
         Appends df to specified table_name. Only rows not already present in the database will be appended.
 
         :param df: pd.DataFrame of values to be added to table
         :param table_name: str __tablename__ of a sqlalchemy table class
 
-        :return: None
+        :return: int number of rows appended
         '''
+        inserted, skipped = self.bulk_insert(df, table_name)
+        log_append(table_name, inserted, skipped)
 
-        if table_name not in inspect(self.engine).get_table_names():
-            raise KeyError(f'{table_name} is not a valid table name.')
+        return inserted
 
-        class_ = get_class_from_table_name(table_name)
-        table = Table(class_.__tablename__, class_.metadata)
-        p_key = inspect(class_).primary_key[0].name
+    def replace_month(self, df: pd.DataFrame, table_name: str, month_id: int) -> int:
+        '''
+        Replaces all rows of month_id in table_name with df, in a single transaction
+
+        :param df: pd.DataFrame of values to be added to table
+        :param table_name: str __tablename__ of a sqlalchemy table class
+        :param month_id: int yyyymm (see utils/months.py)
+
+        :return: int number of rows written
+        '''
+        with self.engine.begin() as conn:
+            inserted = self._replace_month(conn, df, table_name, month_id)
+        self.catalogue.bump_data_version()
+
+        return inserted
+
+    def _replace_month(self, conn: Connection, df: pd.DataFrame, table_name: str, month_id: int) -> int:
+        ''' replace_month() within an open transaction on conn '''
+        table = get_class_from_table_name(table_name).__table__
+        conn.execute(delete(table).where(table.c.month_id == month_id))
+        inserted, _ = self._bulk_insert(conn, df, table_name)
+
+        return inserted
+
+    def compute_summary(self, month_id: int) -> pd.DataFrame:
+        '''
+        the per-subcategory In/Out/Total/Budget/Diff. of a month computed from its raw spending and budget rows, in int
+        pennies (see summary_select()). This is what the monthly_summary table stores for each month.
+
+        :param month_id: int yyyymm (see utils/months.py)
+
+        :return: pd.DataFrame of SUMMARY_COLUMNS
+        '''
+        with self.engine.connect() as conn:
+            return self._compute_summary(conn, month_id)
+
+    @staticmethod
+    def _compute_summary(conn: Connection, month_id: int) -> pd.DataFrame:
+        ''' compute_summary() on conn, which sees the rows of its open transaction '''
+        df = pd.read_sql(sql=summary_select([month_id]), con=conn)
+
+        return df[SUMMARY_COLUMNS].reset_index(drop=True)
+
+    def stored_summary(self, month_id: int) -> pd.DataFrame | None:
+        '''
+        the month's rows of the monthly_summary table
+
+        :param month_id: int yyyymm (see utils/months.py)
+
+        :return: pd.DataFrame of SUMMARY_COLUMNS, or None if the database has no monthly_summary table
+        '''
+        if not self.catalogue.has_table('monthly_summary'):
+            return None
+
+        table = MonthlySummaryTbl.__table__
         with self.engine.connect() as conn:
-            db = pd.read_sql(sql=select(table.c.id), con=conn)  # FROM is implicit
+            df = pd.read_sql(sql=select(table).where(table.c.month_id == month_id).order_by(table.c.id), con=conn)
 
-        # append non-duplicate rows
-        non_duplicates = df[df[p_key].isin(db[p_key]) == False].dropna(how='all')
-        # error if no rows are would be appended
-        if non_duplicates.shape[0] == 0:
-            logging.error(f'NO ROWS FROM DF APPENDED TO {table_name.upper()} (sqlalchemy.exc.IntegrityError)')
-            return
+        return df[SUMMARY_COLUMNS].reset_index(drop=True)
 
-        non_duplicates.to_sql(name=table_name,
-                              con=self.engine,
-                              if_exists='append',
-                              index=False
-                              )
+    def _refresh_summary(self, conn: Connection, month_id: int) -> int:
+        ''' replaces the month's rows of monthly_summary with a recompute from its spending and budget, on conn '''
+        df = self._compute_summary(conn, month_id)
+        df.insert(0, 'id', [f'{month_id} {i:04d}' for i in df.index])
+        df.insert(1, 'month_id', month_id)
 
-        logging.info(f'({non_duplicates.shape[0]}/{df.shape[0]}) rows from df appended to {table_name}')
+        return self._replace_month(conn, df, 'monthly_summary', month_id)
+
+    def unit_of_work(self) -> 'UnitOfWork':
+        '''
+        Returns a UnitOfWork for staging frames for several tables and committing them in a single transaction, e.g.
+
+            with db.unit_of_work() as uow:
+                uow.stage(months, 'months')
+                uow.stage(spending, 'spending')
+
+        :return: UnitOfWork
+        '''
+        return UnitOfWork(self)
+
+
+class UnitOfWork:
+    ''' stages frames for one or more tables and appends them all to the database in a single transaction '''
+
+    def __init__(self, db: SQL):
+        self.db = db
+        self.staged = []
+        self.summaries = []
+
+    def __enter__(self) -> 'UnitOfWork':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # commit if the block completed, otherwise nothing staged is written
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def stage(self, df: pd.DataFrame, table_name: str) -> None:
+        '''
+        Stages df to be appended to table_name on commit(). Tables are written in the order they are staged.
+
+        :param df: pd.DataFrame of values to be added to table
+        :param table_name: str __tablename__ of a sqlalchemy table class
+
+        :return: None
+        '''
+        if not self.db.catalogue.has_table(table_name):
+            raise KeyError(f'{table_name} is not a valid table name.')
+
+        self.staged.append((table_name, df))
+
+    def stage_summary(self, month_id: int) -> None:
+        '''
+        Stages a recompute of the month's rows of monthly_summary on commit(), after the staged frames so the summary
+        includes them
+
+        :param month_id: int yyyymm (see utils/months.py)
+
+        :return: None
+        '''
+        if not self.db.catalogue.has_table('monthly_summary'):
+            raise KeyError('monthly_summary is not a valid table name.')
+
+        self.summaries.append(month_id)
+
+    def commit(self) -> dict:
+        '''
+        Appends all staged frames, then recomputes any staged summaries, in one transaction. If any insert fails the
+        whole transaction is rolled back and nothing is written.
+
+        :return: dict of {table_name: number of rows appended}
+        '''
+        counts = {}
+        summarised = 0
+        with self.db.engine.begin() as conn:
+            for table_name, df in self.staged:
+                inserted, skipped = self.db._bulk_insert(conn, df, table_name)
+                inserted_so_far, skipped_so_far = counts.get(table_name, (0, 0))
+                counts[table_name] = (inserted_so_far + inserted, skipped_so_far + skipped)
+            for month_id in self.summaries:
+                summarised += self.db._refresh_summary(conn, month_id)
+        if any(inserted for inserted, _ in counts.values()) or self.summaries:
+            self.db.catalogue.bump_data_version()
+
+        for table_name, (inserted, skipped) in counts.items():
+            log_append(table_name, inserted, skipped)
+        appended = {table_name: inserted for table_name, (inserted, _) in counts.items()}
+        if self.summaries:
+            logging.info(f'({summarised}) monthly_summary rows written for {len(self.summaries)} month(s)')
+            appended['monthly_summary'] = summarised
+        self.staged, self.summaries = [], []
+
+        return appended
+
+    def rollback(self) -> None:
+        ''' discards all staged frames and summaries '''
+        self.staged, self.summaries = [], []
+
+
+def log_append(table_name: str, inserted: int, skipped: int) -> None:
+    ''' logs the outcome of appending to table_name '''
+    # error if no rows are would be appended
+    if inserted == 0:
+        logging.error(f'NO ROWS FROM DF APPENDED TO {table_name.upper()} (sqlalchemy.exc.IntegrityError)')
+        return
+
+    logging.info(f'({inserted}/{inserted + skipped}) rows from df appended to {table_name}')
+
+
+def insert_ignore(table: Table, dialect: str) -> Insert:
+    '''
+    Returns an insert statement for table that skips rows which conflict with an existing primary key
+
+    :param table: sqlalchemy Table
+    :param dialect: str name of the engine dialect e.g. "sqlite" or "postgresql"
+
+    :return: sqlalchemy Insert
+    '''
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    elif dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+
+    raise NotImplementedError(f'bulk insert is not supported for {dialect} databases.')
+
+
+def decoded_select(table_name: str) -> Select:
+    '''
+    select of every row of table_name with the ids of its lookup tables (see LOOKUPS) joined back to their values, so the
+    columns are the same as the frames appended to it
+
+    :param table_name: str __tablename__ of a sqlalchemy table class
+
+    :return: sqlalchemy Select
+    '''
+    table = get_class_from_table_name(table_name).__table__
+    lookups = {id_column: (lookup_name, columns) for lookup_name, id_column, columns in LOOKUPS.get(table_name, [])}
+
+    selected, joined = [], table
+    for column in table.columns:
+        if column.name not in lookups:
+            selected.append(column)
+            continue
+        lookup_name, columns = lookups[column.name]
+        lookup = get_class_from_table_name(lookup_name).__table__
+        selected += [func.nullif(lookup.c[name], LOOKUP_MISSING).label(name) for name in columns]
+        joined = joined.outerjoin(lookup, column == lookup.c.id)
+
+    return select(*selected).select_from(joined)
+
+
+def in_months(month_id_column, month_ids: list[int]):
+    '''
+    filter of month_id_column to month_ids, as a range (BETWEEN) if they are every month from the first to the last,
+    e.g. a month and the month before it
+    '''
+    first, last = min(month_ids), max(month_ids)
+    if sorted(set(month_ids)) == month_range(first, last):
+        return month_id_column.between(first, last)
+
+    return month_id_column.in_(month_ids)
+
+
+def spending_by_subcategory_select(month_ids: list[int] | None = None) -> Select:
+    ''' select of the In and Out totals of each subcategory of each month, excluding the miscellaneous categories '''
+    spending = decoded_select('spending').subquery()
+
+    query = select(spending.c.month_id,
+                   spending.c.Subcategory,
+                   func.coalesce(func.sum(spending.c.In), 0).label('In'),
+                   func.coalesce(func.sum(spending.c.Out), 0).label('Out'))
+    query = query.where(spending.c.Subcategory.not_in(MISCELLANEOUS_CATEGORIES))
+    if month_ids is not None:
+        query = query.where(in_months(spending.c.month_id, month_ids))
+
+    return query.group_by(spending.c.month_id, spending.c.Subcategory)
+
+
+def summary_select(month_ids: list[int] | None = None) -> Select:
+    ''' select of each month's budget left joined to its spending by subcategory, i.e. the rows of SQL.compute_summary() '''
+    budget = BudgetTbl.__table__
+    spending = spending_by_subcategory_select(month_ids).subquery()
+
+    money_in = func.coalesce(spending.c.In, 0)
+    money_out = func.coalesce(spending.c.Out, 0)
+
+    query = select(budget.c.month_id,
+                   budget.c.Category,
+                   budget.c.Subcategory,
+                   money_in.label('In'),
+                   money_out.label('Out'),
+                   (money_in + money_out).label('Total'),
+                   budget.c.Budget,
+                   (budget.c.Budget + money_in + money_out).label('Diff.'))
+    query = query.join_from(budget, spending, and_(budget.c.month_id == spending.c.month_id,
+                                                   budget.c.Subcategory == spending.c.Subcategory), isouter=True)
+    # remove 'miscellaneous' rows (coalesce as NULL != x is never true in SQL)
+    query = query.where(func.coalesce(budget.c.Category, '') != 'Miscellaneous',
+                        func.coalesce(budget.c.Subcategory, '') != 'Bills')
+    if month_ids is not None:
+        query = query.where(in_months(budget.c.month_id, month_ids))
+
+    return query.order_by(budget.c.month_id, budget.c.id)
 
 
 def get_class_from_table_name(table_name: str) -> object:
@@ -279,13 +917,18 @@ def get_class_from_table_name(table_name: str) -> object:
 
     :return: class object
     '''
-    table_name_to_class = {m.tables[0].name: m.class_ for m in Base.registry.mappers}
-    return table_name_to_class[table_name]
+    return _table_name_to_class()[table_name]
+
+
+@functools.cache
+def _table_name_to_class() -> dict:
+    ''' {__tablename__: class} of every sqlalchemy table class, built on first use '''
+    return {m.tables[0].name: m.class_ for m in Base.registry.mappers}
 
 
 if __name__ == '__main__':
     db = SQL()
-    db.delete_month('JUL 23')
+    db.delete_month(202307)
     db.delete_all_tables()
     db.create_all_tables()
 
@@ -0,0 +1,43 @@
+from dataclasses import dataclass
+import json
+import os
+import threading
+
+import pandas as pd
+
+'''
+the subcategory -> category mapping of utils/sub_category.json. The file is read once and re-read only when its mtime
+changes, so an edit is picked up by a running process (e.g. the dashboard) without a restart.
+'''
+
+SUB_CATEGORY_JSON = os.path.join('utils', 'sub_category.json')
+
+
+@dataclass(frozen=True)
+class SubcategoryMapping:
+    '''the mapping of sub_category.json, with categorical dtypes in the order the file lists them'''
+    mapping: dict
+    subcategories: pd.CategoricalDtype
+    categories: pd.CategoricalDtype
+
+    @classmethod
+    def from_dict(cls, mapping: dict) -> 'SubcategoryMapping':
+        return cls(mapping=mapping,
+                   subcategories=pd.CategoricalDtype(list(mapping), ordered=True),
+                   categories=pd.CategoricalDtype(list(dict.fromkeys(mapping.values())), ordered=True))
+
+
+_loaded = {}  # {absolute path: (mtime, SubcategoryMapping)}
+_lock = threading.Lock()
+
+
+def subcategory_mapping(path: str = SUB_CATEGORY_JSON) -> SubcategoryMapping:
+    '''the SubcategoryMapping of the json file at path, read again only if the file has changed since it was last read'''
+    key = os.path.abspath(path)
+    mtime = os.stat(path).st_mtime_ns
+    with _lock:
+        if key not in _loaded or _loaded[key][0] != mtime:
+            with open(path) as jsn:
+                _loaded[key] = (mtime, SubcategoryMapping.from_dict(json.load(jsn)))
+
+        return _loaded[key][1]
@@ -0,0 +1,138 @@
+import functools
+import hashlib
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+import logging
+from utils.log import get_logger
+logger = get_logger(__name__)
+
+'''
+on-disk cache of the frames each input file is preprocessed into, so rebuilding the database from data/ reads the
+cache rather than re-parsing every csv. Frames are stored as parquet when pyarrow is installed (pip install pyarrow),
+otherwise as pickles.
+'''
+
+try:
+    import pyarrow  # noqa: F401
+    FORMAT = 'parquet'
+except ImportError:
+    FORMAT = 'pickle'
+
+CACHE_DIR = os.path.join('data', 'cache')
+MAX_BYTES = 1 << 30  # evict the least recently used entries beyond 1GB
+VERSIONED_FILES = ['api.py', os.path.join('utils', 'months.py'), os.path.join('utils', 'categories.py'),
+                   os.path.join('utils', 'sub_category.json')]  # preprocessing code and its config
+
+
+def file_sha256(path: str) -> str:
+    ''' sha256 of the contents of the file at path, read in 1MB blocks '''
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+
+    return sha256.hexdigest()
+
+
+class FrameCache:
+    '''
+    preprocessed frames on disk, with a directory per entry holding a file per table. An entry is keyed by the hash of
+    its input file and a version of the preprocessing code and sub_category.json, so changing any of them misses the
+    cache rather than returning stale frames.
+    '''
+
+    def __init__(self, folder: str = CACHE_DIR, max_bytes: int = MAX_BYTES, versioned_files: list[str] = VERSIONED_FILES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.versioned_files = versioned_files
+
+    @functools.cached_property
+    def version(self) -> str:
+        ''' hash of the files that decide the output of preprocessing '''
+        return hashlib.sha256(''.join(file_sha256(path) for path in self.versioned_files).encode()).hexdigest()[:16]
+
+    def key(self, source: str, month_id: int, path: str) -> str:
+        '''
+        the cache key of preprocessing source for month_id from the input file at path
+
+        :param month_id: int the month preprocessed (yyyymm), None if the output does not depend on it (investments_fixed)
+        '''
+        return '_'.join(filter(None, [source, None if month_id is None else str(month_id),
+                                      file_sha256(path)[:32], self.version]))
+
+    def get(self, key: str) -> dict:
+        '''
+        the frames cached under key, marking the entry as recently used
+
+        :return: dict of {table_name: pd.DataFrame}, or None if key is not cached
+        '''
+        entry = os.path.join(self.folder, key)
+        if not os.path.isdir(entry):
+            return None
+
+        read = pd.read_parquet if FORMAT == 'parquet' else pd.read_pickle
+        frames = {os.path.splitext(file)[0]: read(os.path.join(entry, file)) for file in sorted(os.listdir(entry))}
+        os.utime(entry)
+
+        return frames
+
+    def put(self, key: str, frames: dict) -> None:
+        '''
+        caches frames under key. The entry is written to a temporary directory and renamed into place, so a reader
+        (or a process killed part way through) never sees half an entry.
+
+        :param frames: dict of {table_name: pd.DataFrame}
+        '''
+        os.makedirs(self.folder, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=self.folder, prefix='.tmp_')
+        for table_name, df in frames.items():
+            if FORMAT == 'parquet':
+                df.to_parquet(os.path.join(tmp, f'{table_name}.parquet'))
+            else:
+                df.to_pickle(os.path.join(tmp, f'{table_name}.pkl'))
+
+        try:
+            os.rename(tmp, os.path.join(self.folder, key))
+        except OSError:  # already cached by another process
+            shutil.rmtree(tmp)
+
+    def evict(self) -> int:
+        '''
+        deletes the least recently used entries until the cache is no larger than max_bytes
+
+        :return: int number of entries deleted
+        '''
+        if not os.path.isdir(self.folder):
+            return 0
+
+        entries = []
+        for key in os.listdir(self.folder):
+            entry = os.path.join(self.folder, key)
+            if key.startswith('.tmp_') or not os.path.isdir(entry):  # entries being written by put(), or stray files
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, file)) for file in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+            except FileNotFoundError:  # evicted by another process
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                shutil.rmtree(entry)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        if evicted:
+            logging.info(f'{evicted} entries evicted from the preprocessing cache')
+
+        return evicted
@@ -0,0 +1,61 @@
+import functools
+from datetime import datetime
+
+import pandas as pd
+
+'''
+months are keyed by an integer yyyymm (e.g. 202307 for July 2023) in every table and dataframe, so they sort, join and
+range filter as integers rather than being parsed from strings. The "MMM YY" label (e.g. "JUL 23") is only used to
+read a month from the command line and to display one. Conversions are cached, as the same few months are converted
+over and over.
+'''
+
+MonthKey = int  # yyyymm
+MONTH_FORMAT = '%b %y'
+
+
+@functools.lru_cache(maxsize=None)
+def month_key(label: str) -> MonthKey:
+    '''the key of a month labelled "MMM YY" (any case), e.g. "JUL 23" -> 202307'''
+    date = datetime.strptime(label, MONTH_FORMAT)
+
+    return date.year * 100 + date.month
+
+
+@functools.lru_cache(maxsize=None)
+def month_label(key: MonthKey) -> str:
+    '''the "MMM YY" label of a month key, e.g. 202307 -> "JUL 23"'''
+    return month_period(key).strftime(MONTH_FORMAT).upper()
+
+
+@functools.lru_cache(maxsize=None)
+def month_period(key: MonthKey) -> pd.Period:
+    '''the calendar month of a month key as a pandas Period'''
+    if not 1 <= key % 100 <= 12:
+        raise ValueError(f'{key} is not a month key (yyyymm)')
+
+    return pd.Period(year=key // 100, month=key % 100, freq='M')
+
+
+def add_months(key: MonthKey, n: int) -> MonthKey:
+    '''the key of the month n months after (or before, if negative) key. key can also be a pd.Series of keys'''
+    months = (key // 100) * 12 + key % 100 - 1 + n
+
+    return (months // 12) * 100 + months % 12 + 1
+
+
+def month_range(start: MonthKey, end: MonthKey) -> list[MonthKey]:
+    '''every month key from start to end inclusive, in chronological order'''
+    if start > end:
+        raise ValueError(f'{month_label(start)} is after {month_label(end)}')
+
+    keys = [start]
+    while keys[-1] < end:
+        keys.append(add_months(keys[-1], 1))
+
+    return keys
+
+
+def month_keys(dates: pd.Series) -> pd.Series:
+    '''the month key of every datetime in dates, without formatting them as strings'''
+    return (dates.dt.year * 100 + dates.dt.month).astype('int64')
@@ -0,0 +1,30 @@
+import pytest
+import os
+import shutil
+
+from pipe import pipeline
+from sql import db_manager
+
+SRC = os.path.join(os.path.dirname(__file__), '..', 'src')
+
+# GLOBAL FIXTURES
+
+@pytest.fixture
+def demo(tmp_path, monkeypatch):
+    # setup: a copy of the demo input files, with the pipeline writing to a demo database of its own
+    for folder in [os.path.join('data', 'statements'), os.path.join('data', 'inputs')]:
+        shutil.copytree(os.path.join(SRC, folder), tmp_path / folder)
+    os.makedirs(tmp_path / 'utils')
+    shutil.copy(os.path.join(SRC, 'utils', 'sub_category.json'), tmp_path / 'utils')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('demo', 'True')
+    monkeypatch.delenv('DEBUG', raising=False)
+    # engines are created once per address and resolve a relative sqlite path when created, so start afresh
+    monkeypatch.setattr(db_manager, '_engines', {})
+    monkeypatch.setattr(db_manager, '_catalogues', {})
+
+    pipe = pipeline()
+    pipe.create_tables_in_db()
+    yield pipe
+    # teardown
+    pipe.db.engine.dispose()
@@ -0,0 +1,70 @@
+import pytest
+import pandas as pd
+from dashboard import dashboard
+from dashboard.dashboard import _update_monthly_dashboard, MONTHLY_OUTPUTS, no_update
+from dashboard.dash_inputs import month_bundle
+
+
+class TestMonthlyCallback:
+
+    @pytest.fixture
+    def loads(self, monkeypatch):
+        # record the month bundles loaded and which components are rebuilt from them
+        loads = []
+        monkeypatch.setattr(dashboard, 'month_bundle', lambda month_id: loads.append(month_id) or month_id)
+        monkeypatch.setattr(dashboard, '_update_income_summary', lambda bundle: 'income')
+        monkeypatch.setattr(dashboard, '_update_investments_summary', lambda bundle: 'investments')
+        monkeypatch.setattr(dashboard, '_update_bar_chart', lambda sub_category, hide_zeros, bundle: 'bar_plot')
+        monkeypatch.setattr(dashboard, '_update_all_spending_table', lambda bundle: 'all_spending_table')
+        monkeypatch.setattr(dashboard, '_update_timeline_chart', lambda bundle: 'timeline_chart')
+        monkeypatch.setattr(dashboard, '_update_sunburst_chart', lambda spend_budget, bundle: 'sunburst')
+        monkeypatch.setattr(dashboard, '_update_spending_by_subcategory', lambda bundle: 'spending_by_subcategory_table')
+        return loads
+
+    def test_month_change_updates_all_from_one_load(self, loads):
+        outputs = _update_monthly_dashboard(202307, 'Subcategory', [True], 'Total', 'month_selection')
+
+        assert loads == [202307]
+        assert outputs == [component for component, _ in MONTHLY_OUTPUTS]
+
+    @pytest.mark.parametrize('triggered_id, updated', [('bar_plot_radio_item', 'bar_plot'),
+                                                       ('bar_plot_checklist', 'bar_plot'),
+                                                       ('sunburst_radio_item', 'sunburst')])
+    def test_control_change_updates_its_chart_only(self, loads, triggered_id, updated):
+        outputs = _update_monthly_dashboard(202307, 'Subcategory', [True], 'Total', triggered_id)
+
+        assert outputs == [component if component == updated else no_update for component, _ in MONTHLY_OUTPUTS]
+
+
+class TestHistoricDashboard:
+
+    def test_subcategory_trend_has_a_line_per_subcategory(self, monkeypatch):
+        summary = pd.DataFrame({'Date': pd.to_datetime(['2023-06-01', '2023-06-01', '2023-07-01', '2023-07-01']),
+                                'Subcategory': ['Groceries', 'Snacks', 'Groceries', 'Snacks'],
+                                'Total': [-100.0, -20.0, -110.0, -25.0]})
+        monkeypatch.setattr(dashboard, 'historic_tables', lambda: (summary, None))
+
+        fig = dashboard._update_subcategory_trend(['Groceries'])
+
+        assert [trace.name for trace in fig.data] == ['Groceries']
+        assert list(fig.data[0].y) == [100.0, 110.0]  # spending is shown as positive
+
+
+class TestMonthlyCharts:
+
+    def test_bar_chart_of_demo_month(self, demo):
+        demo.append_range(202305, 202307, demo=True, cache=False)
+        bundle = month_bundle(202306)
+
+        fig = dashboard._update_bar_chart('Subcategory', [], bundle)
+
+        shown = bundle.summary[~bundle.summary.Subcategory.isin(['Income', 'Bills'])]
+        assert list(fig.data[0].x) == shown.Subcategory.tolist()
+        assert list(fig.data[0].marker.color) == [dashboard.subcategory_palette[s] for s in shown.Subcategory]
+
+    def test_monthly_dashboard_of_demo_month(self, demo):
+        demo.append_range(202305, 202307, demo=True, cache=False)
+
+        outputs = _update_monthly_dashboard(202306, 'Subcategory', [], 'Total', 'month_selection')
+
+        assert no_update not in outputs
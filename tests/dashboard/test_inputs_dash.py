@@ -1,11 +1,28 @@
 import pytest
 import os
-from sql.db_manager import SQL
+import sqlite3
+import pandas as pd
+from sqlalchemy import event
+from sql.db_manager import SQL, SpendingTbl
+from dashboard.dash_inputs import versioned_cache, accounts_table, compute_summary, stored_summary, summary_table, \
+    query_spending_by_subcategory, query_monthly_totals, historic_tables, query_investments_history, investment_tables, \
+    batch_accounts_tables, batch_investment_tables, in_months
+from api import SchemaMonzo, SchemaInputs
 
 # python -m pytest --rootdir=src/  [expect this to work]
 # pytest config.py look for extra options
 # pytest cant find src modules
 
+@pytest.fixture
+def database():
+    # setup: every table, empty
+    os.environ["DEBUG"] = 'True'
+    db = SQL()
+    db.create_all_tables()
+    yield db
+    # teardown
+    db.delete_all_tables()
+
 class TestQueries:
 
     @pytest.fixture
@@ -46,3 +63,223 @@ class TestCreatingTables:
 
     def test_investment_tables(self):
         pass
+
+
+class TestVersionedCache:
+
+    def test_repeat_calls_are_cached(self, database):
+        calls = []
+
+        @versioned_cache(maxsize=2)
+        def table(month_id, total_row=False):
+            calls.append(month_id)
+            return pd.DataFrame({'month_id': [month_id]}), 1.0
+
+        table(209912, False)
+        df, _ = table(209912, total_row=False)
+        df['month_id'] = 'modified'
+
+        assert calls == [209912]
+        assert table(209912)[0]['month_id'][0] == 209912  # callers get copies of the cached DataFrames
+
+    def test_write_evicts_cache(self, database):
+        SCHEMA = SchemaInputs()
+
+        with database.unit_of_work() as uow:
+            uow.stage(pd.DataFrame({SchemaMonzo().ID: [209912], SchemaMonzo().DATETIME: [pd.Timestamp('2099-12-31')]}), 'months')
+            uow.stage(pd.DataFrame({SCHEMA.ID: ['209912 0000'], SCHEMA.ACCOUNT: ['Current'], SCHEMA.MONTH_ID: [209912],
+                                    SCHEMA.DATETIME: [pd.Timestamp('2099-12-31')], SCHEMA.BALANCE: [10000]}), 'accounts')
+        _, liquidity = accounts_table(209912)
+        assert liquidity == 100
+
+        database.append_to_db(pd.DataFrame({SCHEMA.ID: ['209912 0001'], SCHEMA.ACCOUNT: ['Savings'], SCHEMA.MONTH_ID: [209912],
+                                            SCHEMA.DATETIME: [pd.Timestamp('2099-12-31')], SCHEMA.BALANCE: [5000]}), 'accounts')
+        _, liquidity = accounts_table(209912)
+        assert liquidity == 150
+
+        database.delete_month(209912)
+        df, _ = accounts_table(209912)
+        assert df.empty
+
+    def test_write_by_another_process_evicts_cache(self, database):
+        SCHEMA = SchemaInputs()
+
+        with database.unit_of_work() as uow:
+            uow.stage(pd.DataFrame({SchemaMonzo().ID: [209912], SchemaMonzo().DATETIME: [pd.Timestamp('2099-12-31')]}), 'months')
+            uow.stage(pd.DataFrame({SCHEMA.ID: ['209912 0000'], SCHEMA.ACCOUNT: ['Current'], SCHEMA.MONTH_ID: [209912],
+                                    SCHEMA.DATETIME: [pd.Timestamp('2099-12-31')], SCHEMA.BALANCE: [10000]}), 'accounts')
+        _, liquidity = accounts_table(209912)
+        assert liquidity == 100
+
+        # a write that does not go through SQL, so the in-process data version is unchanged
+        data_version = database.catalogue.data_version
+        with sqlite3.connect(database.engine.url.database) as conn:
+            conn.execute("INSERT INTO accounts (id, Account, month_id, Date, Balance) "
+                         "VALUES ('209912 0001', 'Savings', 209912, '2099-12-31 00:00:00.000000', 5000)")
+        conn.close()
+        assert database.catalogue.data_version == data_version
+
+        _, liquidity = accounts_table(209912)
+        assert liquidity == 150
+
+    def test_stored_version_connection(self, database):
+        database.catalogue.stored_version()
+        assert database.engine.pool.checkedout() == 0  # not held from the engine's pool
+
+        database.engine.dispose()
+        assert database.catalogue._version_connection is None
+        assert database.catalogue.stored_version() is not None  # reconnects on next use
+
+
+def store_summary(db: SQL, month_id: str) -> None:
+    ''' writes the month's computed summary to monthly_summary, as the pipeline does at ingest '''
+    df = compute_summary(month_id)
+    df.insert(0, 'id', [f'{month_id} {i:04d}' for i in df.index])
+    df.insert(1, 'month_id', month_id)
+    db.replace_month(df, 'monthly_summary', month_id)
+
+
+class TestMonthlySummary:
+
+    @pytest.fixture
+    def database(self, database):
+        # setup: a month with spending in two subcategories, one of them without a budget
+        db = database
+        SCHEMA = SchemaMonzo()
+        SCHEMAInputs = SchemaInputs()
+        date = pd.Timestamp('2099-12-01')
+        with db.unit_of_work() as uow:
+            uow.stage(pd.DataFrame({SCHEMA.ID: [209912], SCHEMA.DATETIME: [date]}), 'months')
+            uow.stage(pd.DataFrame({SCHEMA.ID: ['209912 0000', '209912 0001', '209912 0002'],
+                                    SCHEMA.MONTH_ID: 209912,
+                                    SCHEMA.DATETIME: date,
+                                    SCHEMA.SUBCATEGORY: ['Groceries', 'Groceries', 'Transfers'],
+                                    SCHEMA.OUT: [-1050, -250, -10000],
+                                    SCHEMA.IN: [0, 100, 0]}), 'spending')
+            uow.stage(pd.DataFrame({SCHEMAInputs.ID: ['209912 0000', '209912 0001'],
+                                    SCHEMAInputs.MONTH_ID: 209912,
+                                    SCHEMAInputs.DATETIME: date,
+                                    SCHEMAInputs.CATEGORY: ['Food', 'Going out'],
+                                    SCHEMAInputs.SUBCATEGORY: ['Groceries', 'Eating out'],
+                                    SCHEMAInputs.BUDGET: [5000, 3000]}), 'budget')
+        yield db
+
+    def test_compute_summary(self, database):
+        df = compute_summary(209912).set_index('Subcategory').loc[['Groceries', 'Eating out']]
+
+        assert df.In.tolist() == [100, 0]
+        assert df.Out.tolist() == [-1300, 0]  # Transfers are left out
+        assert df.Total.tolist() == [-1200, 0]
+        assert df['Diff.'].tolist() == [3800, 3000]
+
+    def test_query_spending_by_subcategory(self, database):
+        df = query_spending_by_subcategory([209912])
+
+        assert df.to_dict('records') == [{'month_id': 209912, 'Subcategory': 'Groceries', 'In': 100, 'Out': -1300}]
+        assert query_spending_by_subcategory([209911]).empty
+
+    def test_in_months(self):
+        month_id = SpendingTbl.__table__.c.month_id
+
+        assert 'BETWEEN' in str(in_months(month_id, [209912, 209911]))  # a month and the month before it
+        assert 'IN' in str(in_months(month_id, [209910, 209912]))
+
+    def test_query_monthly_totals(self, database):
+        df = query_monthly_totals()
+
+        assert df.to_dict('records') == [{'month_id': 209912, 'Budget': 8000, 'Total': -1200}]
+
+    def test_summary_table_reads_stored_summary(self, database):
+        computed, computed_budget, computed_spending = summary_table(209912, total_row=True)
+
+        store_summary(database, 209912)
+        df, monthly_budget, monthly_spending = summary_table(209912, total_row=True)
+
+        pd.testing.assert_frame_equal(df, computed)
+        assert (monthly_budget, monthly_spending) == (computed_budget, computed_spending) == (80, -12)
+
+    def test_stored_summary_goes_stale(self, database):
+        store_summary(database, 209912)
+        assert stored_summary(209912).equals(compute_summary(209912))
+
+        database.append_to_db(pd.DataFrame({'id': ['209912 0003'], 'month_id': [209912], 'Subcategory': ['Eating out'],
+                                            'Out': [-2000], 'In': [0]}), 'spending')
+        assert not stored_summary(209912).equals(compute_summary(209912))
+
+    def test_historic_tables(self, database):
+        database.append_to_db(pd.DataFrame({'id': ['209912 0000', '209912 0001'], 'month_id': 209912,
+                                            'Type': ['Paycheck', 'Tax'], 'Amount': [20000, -5000]}), 'income')
+        database.append_to_db(pd.DataFrame({'id': ['209912 0002'], 'month_id': [209912], 'Category': ['Bills'],
+                                            'Subcategory': ['Bills'], 'Budget': [10000]}), 'budget')
+        store_summary(database, 209912)
+
+        summary, monthly = historic_tables()
+
+        assert set(summary.Subcategory) == {'Groceries', 'Eating out'}
+        assert monthly.to_dict('records') == [{'month_id': 209912, 'Date': pd.Timestamp('2099-12-01'), 'Budget': 80.0,
+                                               'Spending': -12.0, 'Income': 150.0, 'Bills': 100.0, 'Savings': 38.0,
+                                               'Savings rate': 25.3}]
+
+
+class TestInvestmentsHistory:
+
+    @pytest.fixture
+    def database(self, database):
+        # setup: fund A held in OCT, NOV and DEC 99, fund B in OCT and DEC 99 only
+        db = database
+        dates = pd.to_datetime(['2099-10-01', '2099-11-01', '2099-12-01'])
+        with db.unit_of_work() as uow:
+            uow.stage(pd.DataFrame({'id': [209910, 209911, 209912], 'Date': dates}), 'months')
+            uow.stage(pd.DataFrame({'id': ['209910 0000', '209910 0001', '209911 0000', '209912 0000', '209912 0001'],
+                                    'Name': ['A', 'B', 'A', 'A', 'B'],
+                                    'Date': dates[[0, 0, 1, 2, 2]],
+                                    'month_id': [209910, 209910, 209911, 209912, 209912],
+                                    'Unit Price': [1.0, 10.0, 1.5, 3.0, 12.0],
+                                    'Units Owned': 100.0,
+                                    'Value': [100.0, 1000.0, 150.0, 300.0, 1200.0]}), 'investments_variable')
+        yield db
+
+    def test_previous_month_from_lag(self, database):
+        df = query_investments_history([209912]).set_index('Name')
+
+        assert df.loc['A', 'Unit Price_prev'] == 1.5
+        assert df.loc['A', 'Value_prev'] == 150.0
+        assert pd.isna(df.loc['B', 'Unit Price_prev'])  # not held in NOV 99
+
+    def test_first_month_has_no_changes(self, database):
+        inv_var, _, _ = investment_tables(209910, 0.0)
+
+        assert inv_var['d. Value'].isna().all()
+        assert inv_var.Value.sum() == 1100.0
+
+    def test_full_history(self, database):
+        df = query_investments_history()
+
+        assert df.month_id.tolist() == [209910, 209910, 209911, 209912, 209912]
+        assert df['Value_prev'].tolist()[2:4] == [100.0, 150.0]
+
+    def test_batch_investment_tables(self, database):
+        batch = batch_investment_tables([209911, 209912], [10.0, 20.0])
+
+        for month_id, liquidity in [(209911, 10.0), (209912, 20.0)]:
+            inv_var, inv_fix, net_worth = investment_tables(month_id, liquidity)
+            pd.testing.assert_frame_equal(batch[month_id][0], inv_var)
+            pd.testing.assert_frame_equal(batch[month_id][1], inv_fix)
+            assert batch[month_id][2] == net_worth
+        assert batch[209912][2] == 1520.0
+
+    def test_batch_is_one_query_per_table(self, database):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        database.catalogue.has_table('accounts')  # reflect the schema before counting
+        event.listen(database.engine, 'before_cursor_execute', count)
+        try:
+            batch_accounts_tables([209911, 209912])
+            batch_investment_tables([209911, 209912], [0.0, 0.0])
+        finally:
+            event.remove(database.engine, 'before_cursor_execute', count)
+
+        assert len(statements) == 3  # accounts, investments_variable and investments_fixed
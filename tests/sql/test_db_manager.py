@@ -1,12 +1,14 @@
 import pytest
 import os
-from sqlalchemy import inspect, Table, select
+import logging
+from sqlalchemy import inspect, Table, select, text, event
 from datetime import datetime
 import pandas as pd
 from pandas.testing import assert_frame_equal
 
-from api import SchemaMonzo
-from sql.db_manager import SQL, get_class_from_table_name, SpendingTbl, MonthsTbl
+from api import SchemaMonzo, SchemaIngestedFile
+from sql.db_manager import SQL, get_class_from_table_name, decoded_select, SpendingTbl, MonthsTbl, IngestedFilesTbl, MerchantsTbl, \
+    CategoriesTbl
 
 # GLOBAL FIXTURES
 
@@ -43,6 +45,26 @@ class TestCreateAndDelete:
         # teardown
         database.delete_table('spending')
 
+    def test_create_table_has_indexes(self, database: pytest.fixture, create_all: pytest.fixture):
+        indexes = {index['name'] for index in inspect(database.engine).get_indexes('spending')}
+        assert {'ix_spending_month_id_category_id', 'ix_spending_date'} == indexes
+
+    def test_create_indexes_on_existing_table(self, database: pytest.fixture, create_all: pytest.fixture):
+        for index in SpendingTbl.__table__.indexes:
+            index.drop(bind=database.engine)
+        assert inspect(database.engine).get_indexes('spending') == []
+        database.create_indexes()
+        assert len(inspect(database.engine).get_indexes('spending')) == 2
+
+    def test_create_indexes_logs_only_those_created(self, database: pytest.fixture, create_all: pytest.fixture, caplog: pytest.fixture):
+        index = next(iter(SpendingTbl.__table__.indexes))
+        index.drop(bind=database.engine)
+        with caplog.at_level(logging.INFO):
+            database.create_indexes()
+
+        assert [record.getMessage() for record in caplog.records if 'index created' in record.getMessage()] == \
+            [f'index created: {index.name}']
+
     def test_create_table_invalid_input(self, database: pytest.fixture):
         with pytest.raises(KeyError):
             database.create_table('not_a_table_name')
@@ -59,11 +81,13 @@ class TestCreateAndDelete:
         assert exception_info.match('not_a_table_name is not a valid table name.')
 
     def test_create_all_tables(self, database: pytest.fixture, create_all: pytest.fixture):
-        tbls = ['months', 'spending', 'budget', 'accounts', 'income', 'investments_variable', 'investments_fixed']
+        tbls = ['months', 'types', 'merchants', 'categories', 'addresses', 'spending', 'budget', 'accounts', 'income',
+                'investments_variable', 'investments_fixed', 'monthly_summary', 'ingested_files']
         assert set(tbls) == set(inspect(database.engine).get_table_names())
 
     def test_create_all_tables_if_already_exists(self, database: pytest.fixture):
-        tbls = ['months', 'spending', 'budget', 'accounts', 'income', 'investments_variable', 'investments_fixed']
+        tbls = ['months', 'types', 'merchants', 'categories', 'addresses', 'spending', 'budget', 'accounts', 'income',
+                'investments_variable', 'investments_fixed', 'monthly_summary', 'ingested_files']
         database.create_all_tables()
         database.create_all_tables()
         assert set(tbls) == set(inspect(database.engine).get_table_names())
@@ -77,12 +101,43 @@ class TestCreateAndDelete:
         assert inspect(database.engine).get_table_names() == []
 
 
+class TestEngine:
+
+    def test_engine_is_shared(self, database: pytest.fixture):
+        assert SQL().engine is database.engine
+
+    def test_sqlite_pragmas(self, database: pytest.fixture):
+        with database.engine.connect() as conn:
+            assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert conn.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+            assert conn.execute(text('PRAGMA foreign_keys')).scalar() == 1
+
+
+class TestSchemaCatalogue:
+
+    def test_catalogue_tracks_create_and_delete(self, database: pytest.fixture):
+        assert not database.catalogue.has_table('spending')
+        database.create_table('spending')
+        assert 'spending' in database.catalogue.table_names
+        database.delete_table('spending')
+        assert 'spending' not in database.catalogue.table_names
+
+    def test_catalogue_reflects_tables_created_elsewhere(self, database: pytest.fixture):
+        database.catalogue.table_names  # load the catalogue before the table exists
+        SpendingTbl.__table__.create(bind=database.engine)
+        assert database.catalogue.has_table('spending')
+        database.delete_table('spending')
+
+    def test_catalogue_columns(self, database: pytest.fixture):
+        assert database.catalogue.columns('months') == ['id', 'Date']
+
+
 class TestAppendToDB:
 
     @pytest.fixture
     def months_data(self):
         SCHEMA = SchemaMonzo()
-        yield pd.DataFrame([{SCHEMA.ID: 'JUN 99',
+        yield pd.DataFrame([{SCHEMA.ID: 199906,
                              SCHEMA.DATETIME: datetime.strptime('11/06/99', '%d/%m/%y')}])
 
     def test_append_to_db(self, database: pytest.fixture, create_all: pytest.fixture, months_data: pytest.fixture):
@@ -94,6 +149,148 @@ class TestAppendToDB:
 
         assert_frame_equal(from_db, months_data)
 
+    def test_bulk_insert_skips_duplicates(self, database: pytest.fixture, create_all: pytest.fixture, months_data: pytest.fixture):
+        assert database.bulk_insert(months_data, 'months') == (1, 0)
+        assert database.bulk_insert(months_data, 'months') == (0, 1)
+
+    def test_bulk_insert_chunks(self, database: pytest.fixture, create_all: pytest.fixture):
+        SCHEMA = SchemaMonzo()
+        months = pd.DataFrame({SCHEMA.ID: list(range(200001, 200026)),
+                               SCHEMA.DATETIME: pd.date_range('2000-01-01', periods=25, freq='MS')})
+        database.bulk_insert(months.iloc[:10], 'months')
+        assert database.bulk_insert(months, 'months', chunksize=7) == (15, 10)
+
+    def test_unit_of_work_commits_all_tables(self, database: pytest.fixture, create_all: pytest.fixture, months_data: pytest.fixture):
+        with database.unit_of_work() as uow:
+            uow.stage(months_data, 'months')
+            uow.stage(months_data.assign(id=199907), 'months')
+
+        table = Table(MonthsTbl.__tablename__, MonthsTbl.metadata)
+        with database.engine.connect() as conn:
+            from_db = pd.read_sql(sql=select(table), con=conn)
+
+        assert set(from_db[SchemaMonzo.ID]) == {199906, 199907}
+
+    def test_unit_of_work_rolls_back_on_error(self, database: pytest.fixture, create_all: pytest.fixture, months_data: pytest.fixture):
+        uow = database.unit_of_work()
+        uow.stage(months_data, 'months')
+        uow.stage(months_data.assign(not_a_column=1), 'months')
+        with pytest.raises(KeyError):
+            uow.commit()
+
+        table = Table(MonthsTbl.__tablename__, MonthsTbl.metadata)
+        with database.engine.connect() as conn:
+            from_db = pd.read_sql(sql=select(table), con=conn)
+
+        assert from_db.empty
+
+    def test_unit_of_work_stages_summary(self, database: pytest.fixture, create_all: pytest.fixture, months_data: pytest.fixture):
+        SCHEMA = SchemaMonzo()
+        budget = pd.DataFrame([{SCHEMA.ID: '199906 0000', SCHEMA.MONTH_ID: 199906, SCHEMA.CATEGORY: 'Food & Drink',
+                                SCHEMA.SUBCATEGORY: 'Groceries', 'Budget': -5000}])
+        spending = pd.DataFrame([{SCHEMA.ID: '199906 0000', SCHEMA.MONTH_ID: 199906, SCHEMA.SUBCATEGORY: 'Groceries',
+                                  SCHEMA.OUT: -1000, SCHEMA.IN: 0}])
+        with database.unit_of_work() as uow:
+            uow.stage(months_data, 'months')
+            uow.stage(budget, 'budget')
+            uow.stage(spending, 'spending')
+            uow.stage_summary(199906)  # recomputed after, and in the same transaction as, the rows above
+
+        assert database.stored_summary(199906)[['Out', 'Diff.']].values.tolist() == [[-1000, -6000]]
+
+        uow = database.unit_of_work()
+        uow.stage(spending.assign(id='199906 0001'), 'spending')
+        uow.stage(spending.assign(not_a_column=1), 'spending')
+        uow.stage_summary(199906)
+        with pytest.raises(KeyError):
+            uow.commit()
+
+        assert database.stored_summary(199906).equals(database.compute_summary(199906))
+
+    def test_delete_month_cascades(self, database: pytest.fixture, create_all: pytest.fixture, months_data: pytest.fixture):
+        SCHEMA = SchemaMonzo()
+        database.append_to_db(months_data, 'months')
+        database.append_to_db(pd.DataFrame([{SCHEMA.ID: '199906 0000', SCHEMA.MONTH_ID: 199906}]), 'spending')
+        database.delete_month(199906)
+
+        with database.engine.connect() as conn:
+            from_db = pd.read_sql(sql=select(SpendingTbl.__table__), con=conn)
+
+        assert from_db.empty
+
+    def test_delete_month_forgets_ingested_files(self, database: pytest.fixture, create_all: pytest.fixture, months_data: pytest.fixture):
+        SCHEMA = SchemaIngestedFile()
+        database.append_to_db(months_data, 'months')
+        database.append_to_db(pd.DataFrame([{SCHEMA.ID: '199906 abc', SCHEMA.MONTH_ID: 199906},
+                                            {SCHEMA.ID: 'def', SCHEMA.MONTH_ID: None}]), 'ingested_files')
+        database.delete_month(199906)
+
+        with database.engine.connect() as conn:
+            from_db = pd.read_sql(sql=select(IngestedFilesTbl.__table__), con=conn)
+
+        assert from_db[SCHEMA.ID].tolist() == ['def']  # files used by every month are kept
+
+    def test_spending_strings_stored_once(self, database: pytest.fixture, create_all: pytest.fixture, months_data: pytest.fixture):
+        SCHEMA = SchemaMonzo()
+        spending = pd.DataFrame({SCHEMA.ID: ['199906 0000', '199906 0001', '199906 0002'],
+                                 SCHEMA.MONTH_ID: 199906,
+                                 SCHEMA.DATETIME: datetime(1999, 6, 11),
+                                 SCHEMA.TYPE: 'Card payment',
+                                 SCHEMA.NAME: ['Tesco', 'Tesco', None],
+                                 SCHEMA.CATEGORY: 'Food & Drink',
+                                 SCHEMA.SUBCATEGORY: ['Groceries', 'Groceries', 'Lunch'],
+                                 SCHEMA.ADDRESS: ['159-161 Cowley Road', None, None],
+                                 SCHEMA.DESCRIPTION: ['TESCO', 'TESCO', 'PRET'],
+                                 SCHEMA.OUT: [-100, -200, -300],
+                                 SCHEMA.IN: 0})
+        database.append_to_db(months_data, 'months')
+        database.append_to_db(spending, 'spending')
+        database.append_to_db(spending.assign(id=['199906 0003', '199906 0004', '199906 0005']), 'spending')
+
+        with database.engine.connect() as conn:
+            merchants = pd.read_sql(sql=select(MerchantsTbl.__table__), con=conn)
+            from_db = pd.read_sql(sql=decoded_select('spending').order_by(SpendingTbl.__table__.c.id), con=conn)
+
+        assert merchants[SCHEMA.NAME].tolist() == ['Tesco']
+        assert_frame_equal(from_db.iloc[:3], spending)
+
+    def test_missing_category_stored_once(self, database: pytest.fixture, create_all: pytest.fixture, months_data: pytest.fixture):
+        SCHEMA = SchemaMonzo()
+        spending = pd.DataFrame({SCHEMA.ID: ['199906 0000', '199906 0001'],
+                                 SCHEMA.MONTH_ID: 199906,
+                                 SCHEMA.CATEGORY: None,
+                                 SCHEMA.SUBCATEGORY: 'Groceries'})
+        database.append_to_db(months_data, 'months')
+        database.append_to_db(spending.iloc[:1], 'spending')
+        database.append_to_db(spending.iloc[1:], 'spending')
+
+        with database.engine.connect() as conn:
+            categories = pd.read_sql(sql=select(CategoriesTbl.__table__), con=conn)
+            from_db = pd.read_sql(sql=decoded_select('spending').order_by(SpendingTbl.__table__.c.id), con=conn)
+
+        assert len(categories) == 1
+        assert from_db[SCHEMA.CATEGORY].isna().all() and (from_db[SCHEMA.SUBCATEGORY] == 'Groceries').all()
+
+    def test_lookups_read_only_the_values_appended(self, database: pytest.fixture, create_all: pytest.fixture, months_data: pytest.fixture):
+        SCHEMA = SchemaMonzo()
+        database.append_to_db(months_data, 'months')
+        database.append_to_db(pd.DataFrame({SCHEMA.ID: [f'199906 {i:04d}' for i in range(100)], SCHEMA.MONTH_ID: 199906,
+                                            SCHEMA.NAME: [f'Shop {i}' for i in range(100)]}), 'spending')
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(database.engine, 'before_cursor_execute', record)
+        try:
+            database.append_to_db(pd.DataFrame({SCHEMA.ID: ['199906 0100'], SCHEMA.MONTH_ID: 199906,
+                                                SCHEMA.NAME: ['Shop 0']}), 'spending')
+        finally:
+            event.remove(database.engine, 'before_cursor_execute', record)
+        merchants = [statement for statement in statements if 'FROM merchants' in statement]
+
+        assert merchants and all('WHERE' in statement for statement in merchants)
+
     def test_append_to_db_invalid_input(self, database: pytest.fixture):
         with pytest.raises(KeyError) as exception_info:
             database.append_to_db(pd.DataFrame(), 'not_a_table_name')
@@ -5,13 +5,14 @@ from pandas.testing import assert_frame_equal, assert_series_equal
 from datetime import datetime
 import os
 
-from api import SchemaMonzo, Monzo, SchemaInputs, Budget, Accounts, Income, SchemaInvestmentVariable, InvestmentVariable, SchemaInvestmentFixed, InvestmentFixed
+from utils.categories import subcategory_mapping
+from api import DataFileIndex, SchemaMonzo, Monzo, SchemaInputs, Inputs, Budget, Accounts, Income, SchemaInvestmentVariable, InvestmentVariable, SchemaInvestmentFixed, InvestmentFixed
 
 
 class TestFinancesPreprocessing:
 
     SCHEMA = SchemaMonzo()
-    month_id = 'FEB 23'
+    month_id = 202302
     mz = Monzo(month_id)
     bud = Budget(month_id)
 
@@ -45,12 +46,21 @@ class TestFinancesPreprocessing:
 
         assert_series_equal(input_data[self.SCHEMA.DATETIME], expected)
 
+    def test_month_start_and_end(self):
+        ''' tests the month_start and month_end properties of Finances '''
+        assert self.bud.month_start == datetime(2023, 2, 1)
+        assert self.bud.month_end == datetime(2023, 2, 28)
+
+    def test_month_range(self):
+        ''' tests the month_range() method of Finances across a year boundary '''
+        assert Monzo.month_range(202211, 202302) == [202211, 202212, 202301, 202302]
+
     def test_add_month_id_column(self, input_data: pytest.fixture):
         ''' tests the add_month_id_column() method of Finances. This method required the Date column to be populated
         with datetime objects '''
         input_data[self.SCHEMA.DATETIME] = self.mz.add_datetime_column(input_data)
         input_data[self.SCHEMA.MONTH_ID] = self.mz.add_month_id_column(input_data)
-        expected = pd.Series({0: 'FEB 23', 1: 'FEB 23'}, name=self.SCHEMA.MONTH_ID)
+        expected = pd.Series({0: 202302, 1: 202302}, name=self.SCHEMA.MONTH_ID)
 
         assert_series_equal(input_data[self.SCHEMA.MONTH_ID], expected)
 
@@ -59,7 +69,14 @@ class TestFinancesPreprocessing:
         input_data[self.SCHEMA.CATEGORY] = self.mz.add_category_column(input_data)
         expected = pd.Series({0: 'Food & Drink', 1: 'Entertainment'}, name=self.SCHEMA.CATEGORY)
 
-        assert_series_equal(input_data[self.SCHEMA.CATEGORY], expected)
+        assert_series_equal(input_data[self.SCHEMA.CATEGORY], expected.astype(subcategory_mapping().categories))
+
+    def test_add_category_column_unknown_subcategory(self, input_data: pytest.fixture):
+        ''' tests the add_category_column() method of Finances raises for subcategories missing from sub_category.json '''
+        input_data[self.SCHEMA.SUBCATEGORY] = ['Groceries', 'Not a subcategory']
+
+        with pytest.raises(ValueError, match='Not a subcategory'):
+            self.mz.add_category_column(input_data)
 
     def test_convert_to_pennies(self, input_data: pytest.fixture):
         ''' tests the convert_to_pennies() method of Finances '''
@@ -72,16 +89,69 @@ class TestFinancesPreprocessing:
         ''' tests the add_id_column() method of Finances. This method required the month_id column to be populated '''
         input_data[self.SCHEMA.DATETIME] = self.mz.add_datetime_column(input_data)
         input_data[self.SCHEMA.MONTH_ID] = self.mz.add_month_id_column(input_data)
-        input_data[self.SCHEMA.ID] = self.mz.add_id_column(input_data)
-        expected = pd.Series({0: 'FEB 23 0000', 1: 'FEB 23 0001'}, name=self.SCHEMA.ID)
+        input_data[self.SCHEMA.ID] = self.bud.add_id_column(input_data)
+        expected = pd.Series({0: '202302 0000', 1: '202302 0001'}, name=self.SCHEMA.ID)
 
         assert_series_equal(input_data[self.SCHEMA.ID], expected)
 
 
+class TestDataFileIndex:
+
+    @pytest.fixture
+    def data_folder(self, tmp_path):
+        for folder, files in {'statements': ['MonzoDataExport_July_2023-08-02.csv', 'DEMO MonzoDataExport_July_2023-08-02.csv',
+                                             'MonzoDataExport_Julember_2023.csv', 'notes.txt'],
+                              'inputs': ['inputs_07_23.csv', 'inputs_08_23.csv', 'inputs_08_23 (1).csv',
+                                         'investments_variable_07_23.csv', 'investments_fixed.csv']}.items():
+            os.makedirs(tmp_path / folder)
+            for file in files:
+                (tmp_path / folder / file).touch()
+        yield tmp_path
+
+    def test_find(self, data_folder: pytest.fixture):
+        index = DataFileIndex(data_folder)
+
+        assert index.find('monzo', 202307) == os.path.join(data_folder, 'statements', 'MonzoDataExport_July_2023-08-02.csv')
+        assert index.find('monzo', 202307, demo=True) == os.path.join(data_folder, 'statements', 'DEMO MonzoDataExport_July_2023-08-02.csv')
+        assert index.find('inputs', 202307) == os.path.join(data_folder, 'inputs', 'inputs_07_23.csv')
+        assert index.find('investments_fixed', 202308) == os.path.join(data_folder, 'inputs', 'investments_fixed.csv')
+        with pytest.raises(ValueError, match='No files found'):
+            index.find('investments_variable', 202308)
+
+    def test_folder_listed_once(self, data_folder: pytest.fixture, monkeypatch):
+        index = DataFileIndex(data_folder)
+        listed = []
+        listdir = os.listdir
+        monkeypatch.setattr(os, 'listdir', lambda folder: listed.append(folder) or listdir(folder))
+        for _ in range(3):
+            index.find('inputs', 202307)
+            index.find('investments_variable', 202307)
+
+        assert listed == [os.path.join(data_folder, 'inputs')]
+
+        (data_folder / 'inputs' / 'investments_variable_08_23.csv').touch()  # rescanned once the folder changes
+        mtime = os.stat(data_folder / 'inputs').st_mtime_ns + 1  # in case the file system's mtimes are coarse
+        os.utime(data_folder / 'inputs', ns=(mtime, mtime))
+        assert index.find('investments_variable', 202308).endswith('investments_variable_08_23.csv')
+
+    def test_check_reports_every_month(self, data_folder: pytest.fixture):
+        index = DataFileIndex(data_folder)
+        tasks = [('inputs', 202306), ('inputs', 202307), ('inputs', 202308), ('monzo', 202308)]
+
+        with pytest.raises(ValueError) as exception_info:
+            index.check(tasks)
+        message = str(exception_info.value)
+
+        assert message.startswith('3 input file(s) cannot be used')
+        assert 'inputs_{mm}_{yy}*.csv for JUN 23' in message
+        assert "for AUG 23 - ['inputs_08_23 (1).csv', 'inputs_08_23.csv']" in message
+        assert 'MonzoDataExport_{Month}_{YYYY}*.csv for AUG 23' in message
+
+
 class TestMonzoPreprocessing:
 
     SCHEMA = SchemaMonzo()
-    month_id = 'FEB 23'
+    month_id = 202302
     mz = Monzo(month_id)
 
     @pytest.fixture
@@ -113,10 +183,11 @@ class TestMonzoPreprocessing:
         expected = pd.Series({0:datetime(2023, 2, 18, 14, 32, 44), 1:datetime(2023, 2, 11, 15, 32, 56)}, name=self.SCHEMA.DATETIME)
 
         assert_series_equal(input_data[self.SCHEMA.DATETIME], expected)
+        assert 'tmp' not in input_data.columns
 
     def test_split_subcategory_payments(self, input_data: pytest.fixture):
         ''' tests the split_subcategory_payments() method of Monzo '''
-        df = self.mz.split_subcategory_payments(input_data)
+        df, split_index = self.mz.split_subcategory_payments(input_data)
         expected = pd.DataFrame.from_dict({self.SCHEMA.ID: ['tx_0000ASZejZR9sIU90l4gss', 'tx_0000ASo4xSWfgUfqodsowj', 'tx_0000ASo4xSWfgUfqodsowj'],
                                       self.SCHEMA.DATE: ['11/02/2023', '18/02/2023', '18/02/2023'],
                                       self.SCHEMA.TIME: ['15:32:56', '14:32:44', '14:32:44'],
@@ -138,12 +209,21 @@ class TestMonzoPreprocessing:
                                       })
 
         assert_frame_equal(df, expected, check_dtype=False)
+        assert split_index.tolist() == [0, 1, 2]
+
+    def test_split_subcategory_payments_no_splits(self, input_data: pytest.fixture):
+        ''' tests the split_subcategory_payments() method of Monzo when there are no split payments '''
+        input_data[self.SCHEMA.SUBCATEGORY_SPLIT] = np.nan
+        df, split_index = self.mz.split_subcategory_payments(input_data)
+
+        assert_frame_equal(df, input_data)
+        assert split_index.tolist() == [0, 0]
 
     def test_preprocess_monzo(self, input_data: pytest.fixture):
         ''' tests the first output (df) of the preprocess() method of Monzo '''
         df, _ = self.mz.preprocess(DEBUG=input_data)
-        expected = pd.DataFrame.from_dict({self.SCHEMA.ID: ['FEB 23 0000', 'FEB 23 0001', 'FEB 23 0002'],
-                                           self.SCHEMA.MONTH_ID: ['FEB 23', 'FEB 23', 'FEB 23'],
+        expected = pd.DataFrame.from_dict({self.SCHEMA.ID: ['tx_0000ASZejZR9sIU90l4gss 0', 'tx_0000ASo4xSWfgUfqodsowj 1', 'tx_0000ASo4xSWfgUfqodsowj 2'],
+                                           self.SCHEMA.MONTH_ID: [202302, 202302, 202302],
                                            self.SCHEMA.DATETIME: [datetime(2023, 2, 11, 15, 32, 56), datetime(2023, 2, 18, 14, 32, 44), datetime(2023, 2, 18, 14, 32, 44)],
                                            self.SCHEMA.TYPE: ['Faster payment', 'Card payment', 'Card payment'],
                                            self.SCHEMA.NAME: ['Ikran Jama', 'Tesco', 'Tesco'],
@@ -154,23 +234,70 @@ class TestMonzoPreprocessing:
                                            self.SCHEMA.OUT: [0, -700, -1251],
                                            self.SCHEMA.IN: [500, 0, 0]
                                            })
+        expected[self.SCHEMA.CATEGORY] = expected[self.SCHEMA.CATEGORY].astype(subcategory_mapping().categories)
+        expected[self.SCHEMA.SUBCATEGORY] = expected[self.SCHEMA.SUBCATEGORY].astype(subcategory_mapping().subcategories)
 
         assert_frame_equal(df, expected, check_dtype=False)
 
+    def test_preprocess_ids_stable(self, input_data: pytest.fixture):
+        ''' tests the ids given by the preprocess() method of Monzo do not depend on the order of the statement rows '''
+        df, _ = self.mz.preprocess(DEBUG=input_data.copy())
+        reordered, _ = self.mz.preprocess(DEBUG=input_data.iloc[::-1].reset_index(drop=True))
+
+        assert_frame_equal(reordered.sort_values(self.SCHEMA.ID).reset_index(drop=True),
+                           df.sort_values(self.SCHEMA.ID).reset_index(drop=True))
+
     def test_preprocess_months(self, input_data: pytest.fixture):
         ''' tests the second output (months) of the preprocess() method of Monzo '''
         _, months = self.mz.preprocess(DEBUG=input_data)
-        expected = pd.DataFrame.from_dict({self.SCHEMA.ID: ['FEB 23'],
+        expected = pd.DataFrame.from_dict({self.SCHEMA.ID: [202302],
                                            self.SCHEMA.DATETIME: [datetime(2023, 2, 1)]
                                            })
 
         assert_frame_equal(months, expected, check_dtype=False)
 
+    def test_preprocess_chunks(self, input_data: pytest.fixture, tmp_path):
+        ''' tests the preprocess_chunks() method of Monzo gives the same rows and ids as preprocess(), for any chunksize '''
+        statement = pd.concat([input_data] * 3, ignore_index=True)
+        statement[self.SCHEMA.ID] = [f'tx_{i}' for i in range(len(statement))]
+        statement[self.SCHEMA.DESCRIPTION] = ['0123', '4567', 'TESCO', '0890', 'TESCO', 'bop']  # numeric looking text
+        log_file = tmp_path / 'MonzoDataExport_February_2023.csv'
+        statement.to_csv(log_file, index=False)
+
+        expected, _ = self.mz.preprocess(DEBUG=statement.copy())
+        for chunksize in [1, 2, 4, 100]:
+            chunks = list(self.mz.preprocess_chunks(chunksize, log_file=log_file))
+            df = pd.concat([chunk for chunk, _ in chunks]).sort_values(self.SCHEMA.ID).reset_index(drop=True)
+
+            assert_frame_equal(df, expected.sort_values(self.SCHEMA.ID).reset_index(drop=True))
+            assert {month for _, months in chunks for month in months[self.SCHEMA.ID]} == {202302}
+
+
+    def test_preprocess_history(self, input_data: pytest.fixture, tmp_path):
+        ''' tests the preprocess_history() method of Monzo gives each month the same rows and ids as preprocess() '''
+        january = input_data.copy()
+        january[self.SCHEMA.DATE] = ['18/01/2023', '11/01/2023']
+        statement = pd.concat([january, input_data, january], ignore_index=True)
+        statement[self.SCHEMA.ID] = [f'tx_{i}' for i in range(len(statement))]
+        log_file = tmp_path / 'MonzoDataExport_all.csv'
+        statement.to_csv(log_file, index=False)
+
+        df, months = Monzo.preprocess_history(log_file)
+
+        for month_id, rows in [(202301, [0, 1, 4, 5]), (202302, [2, 3])]:
+            expected, _ = Monzo(month_id).preprocess(DEBUG=statement.loc[rows].reset_index(drop=True))
+            actual = df[df[self.SCHEMA.MONTH_ID] == month_id].sort_values(self.SCHEMA.ID).reset_index(drop=True)
+
+            assert_frame_equal(actual, expected.sort_values(self.SCHEMA.ID).reset_index(drop=True))
+        expected = pd.DataFrame({self.SCHEMA.ID: [202301, 202302],
+                                 self.SCHEMA.DATETIME: [datetime(2023, 1, 1), datetime(2023, 2, 1)]})
+        assert_frame_equal(months, expected, check_dtype=False)
+
 
 class TestInputsPreprocessing:
 
     SCHEMA = SchemaInputs()
-    month_id = 'FEB 23'
+    month_id = 202302
 
     @pytest.fixture
     def input_data(self):
@@ -193,12 +320,14 @@ class TestInputsPreprocessing:
         ''' tests the preprocess() method of Budget '''
         bud = Budget(self.month_id)
         df = bud.preprocess(input_data)
-        expected = pd.DataFrame([{self.SCHEMA.ID: 'FEB 23 0000',
-                                  self.SCHEMA.MONTH_ID: 'FEB 23',
+        expected = pd.DataFrame([{self.SCHEMA.ID: '202302 0000',
+                                  self.SCHEMA.MONTH_ID: 202302,
                                   self.SCHEMA.DATETIME: datetime(2023, 2, 28),
                                   self.SCHEMA.CATEGORY: 'Food & Drink',
                                   self.SCHEMA.SUBCATEGORY: 'Lunch',
                                   self.SCHEMA.BUDGET: 8000}])
+        expected[self.SCHEMA.CATEGORY] = expected[self.SCHEMA.CATEGORY].astype(subcategory_mapping().categories)
+        expected[self.SCHEMA.SUBCATEGORY] = expected[self.SCHEMA.SUBCATEGORY].astype(subcategory_mapping().subcategories)
 
         assert_frame_equal(df, expected, check_dtype=False)
 
@@ -206,10 +335,10 @@ class TestInputsPreprocessing:
         ''' tests the preprocess() method of Accounts '''
         acc = Accounts(self.month_id)
         df = acc.preprocess(input_data)
-        expected = pd.DataFrame([{self.SCHEMA.ID: 'FEB 23 0000',
+        expected = pd.DataFrame([{self.SCHEMA.ID: '202302 0000',
                                   self.SCHEMA.ACCOUNT: 'Monzo: Current',
                                   self.SCHEMA.DATETIME: datetime(2023, 2, 28),
-                                  self.SCHEMA.MONTH_ID: 'FEB 23',
+                                  self.SCHEMA.MONTH_ID: 202302,
                                   self.SCHEMA.BALANCE: 3456}])
 
         assert_frame_equal(df, expected, check_dtype=False)
@@ -218,19 +347,50 @@ class TestInputsPreprocessing:
         ''' tests the preprocess() method of Income '''
         inc = Income(self.month_id)
         df = inc.preprocess(input_data)
-        expected = pd.DataFrame([{self.SCHEMA.ID: 'FEB 23 0000',
+        expected = pd.DataFrame([{self.SCHEMA.ID: '202302 0000',
                                   self.SCHEMA.TYPE: 'Paycheck',
                                   self.SCHEMA.DATETIME: datetime(2023, 2, 28),
-                                  self.SCHEMA.MONTH_ID: 'FEB 23',
+                                  self.SCHEMA.MONTH_ID: 202302,
                                   self.SCHEMA.AMOUNT: 200000}])
 
         assert_frame_equal(df, expected, check_dtype=False)
 
+    def test_preprocess_inputs_bundle(self, input_data: pytest.fixture):
+        ''' tests the preprocess() method of Inputs matches the individual preprocessors '''
+        bundle = Inputs(self.month_id).preprocess(input_data)
+
+        assert_frame_equal(bundle.budget, Budget(self.month_id).preprocess(input_data))
+        assert_frame_equal(bundle.accounts, Accounts(self.month_id).preprocess(input_data))
+        assert_frame_equal(bundle.income, Income(self.month_id).preprocess(input_data))
+
+    def test_preprocess_inputs_unknown_category(self, input_data: pytest.fixture, caplog: pytest.fixture):
+        ''' tests the preprocess() method of Inputs leaves out rows of unknown or blank categories with a warning '''
+        input_data.loc[0, self.SCHEMA.CATEGORY] = 'SAVINGS'
+        input_data.loc[1, self.SCHEMA.CATEGORY] = np.nan
+        bundle = Inputs(self.month_id).preprocess(input_data)
+
+        assert_frame_equal(bundle.budget, Budget(self.month_id).preprocess(input_data))
+        assert_frame_equal(bundle.accounts, Accounts(self.month_id).preprocess(input_data))
+        assert_frame_equal(bundle.income, Income(self.month_id).preprocess(input_data))
+        assert 'unknown categories' in caplog.text and '2 row(s) left out' in caplog.text
+
+    def test_preprocess_inputs_blank_amount(self, input_data: pytest.fixture):
+        ''' tests the preprocess() method of Inputs accepts a blank amount but raises on a non-numeric one '''
+        input_data.loc[0, self.SCHEMA.AMOUNT] = np.nan
+        bundle = Inputs(self.month_id).preprocess(input_data)
+        assert_frame_equal(bundle.budget, Budget(self.month_id).preprocess(input_data))
+
+        input_data[self.SCHEMA.AMOUNT] = input_data[self.SCHEMA.AMOUNT].astype(object)
+        input_data.loc[0, self.SCHEMA.AMOUNT] = 'eighty'
+        with pytest.raises(ValueError) as exception_info:
+            Inputs(self.month_id).preprocess(input_data)
+        assert exception_info.match('non-numeric amounts')
+
 
 class TestInvestmentVariablePreprocessing:
 
     SCHEMA = SchemaInvestmentVariable()
-    month_id = 'FEB 23'
+    month_id = 202302
     inv = InvestmentVariable(month_id)
 
     @pytest.fixture
@@ -252,10 +412,10 @@ class TestInvestmentVariablePreprocessing:
     def test_preprocessing_investment_variable(self, input_data: pytest.fixture):
         ''' tests the preprocess() method of InvestmentVariable '''
         df = self.inv.preprocess(input_data)
-        expected = pd.DataFrame([{self.SCHEMA.ID: 'FEB 23 0000',
+        expected = pd.DataFrame([{self.SCHEMA.ID: '202302 0000',
                                   self.SCHEMA.NAME: 'Vanguard LifeStrategy 60% Equity A Inc',
                                   self.SCHEMA.DATETIME: datetime(2023, 2, 28),
-                                  self.SCHEMA.MONTH_ID: 'FEB 23',
+                                  self.SCHEMA.MONTH_ID: 202302,
                                   self.SCHEMA.COMPANY: 'AJBell',
                                   self.SCHEMA.UNIT_PRICE: 182.2701,
                                   self.SCHEMA.UNITS_OWNED: 5,
@@ -268,7 +428,7 @@ class TestInvestmentVariablePreprocessing:
 class TestInvestmentFixedPreprocessing:
 
     SCHEMA = SchemaInvestmentFixed()
-    month_id = 'FEB 23'
+    month_id = 202302
     inf = InvestmentFixed(month_id)
 
     @pytest.fixture
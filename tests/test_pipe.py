@@ -0,0 +1,166 @@
+import pytest
+import os
+import pandas as pd
+import pipe as pipe_module
+from pandas.testing import assert_frame_equal
+
+from pipe import pipeline, ingest_tasks, TABLES
+from sql.db_manager import decoded_select, get_class_from_table_name
+
+
+def read_table(pipe: pipeline, table_name: str) -> pd.DataFrame:
+    table = get_class_from_table_name(table_name).__table__
+    with pipe.db.engine.connect() as conn:
+        return pd.read_sql(sql=decoded_select(table_name).order_by(table.c.id), con=conn)
+
+
+def read_tables(pipe: pipeline) -> dict:
+    ''' every table written by the pipeline, without the time each file was ingested '''
+    tables = {table_name: read_table(pipe, table_name) for table_name in TABLES}
+    tables['ingested_files'] = tables['ingested_files'].drop(columns='Date')
+
+    return tables
+
+
+def history_statement(path: str) -> str:
+    ''' writes the demo statements of every month to path as one statement, and removes the monthly statements '''
+    folder = os.path.join('data', 'statements')
+    statements = [pd.read_csv(os.path.join(folder, file), dtype=str) for file in sorted(os.listdir(folder))]
+    pd.concat(statements).to_csv(path, index=False)
+    for file in os.listdir(folder):
+        os.remove(os.path.join(folder, file))
+
+    return path
+
+
+class TestAppendRange:
+
+    def test_append_range_writes_every_month(self, demo: pytest.fixture):
+        report = demo.append_range(202305, 202307, demo=True, cache=False)
+
+        assert report.index.tolist() == [202305, 202306, 202307]
+        assert read_table(demo, 'months')['id'].tolist() == [202305, 202306, 202307]
+        for table_name in ['spending', 'budget', 'accounts', 'income', 'investments_variable', 'monthly_summary']:
+            df = read_table(demo, table_name)
+            assert (report[table_name] > 0).all(), table_name
+            assert df['month_id'].value_counts().sort_index().tolist() == report[table_name].tolist(), table_name
+        # the fixed investments are read once, with the first month
+        assert report['investments_fixed'].tolist() == [len(read_table(demo, 'investments_fixed')), 0, 0]
+
+
+    def test_database_of_an_earlier_version(self, demo: pytest.fixture):
+        demo.delete_all_db_tables()
+        with demo.db.engine.begin() as conn:  # string month ids, no lookup tables
+            conn.exec_driver_sql('CREATE TABLE months (id VARCHAR PRIMARY KEY, Date DATETIME)')
+            conn.exec_driver_sql('CREATE TABLE spending (id VARCHAR PRIMARY KEY, month_id VARCHAR, Name VARCHAR)')
+        demo.db.catalogue.invalidate()
+
+        with pytest.raises(ValueError) as exception_info:
+            demo.append_range(202305, 202307, demo=True, cache=False)
+        assert exception_info.match('schema of an earlier version')
+
+
+class TestHistory:
+
+    def test_append_range_after_history(self, demo: pytest.fixture, tmp_path):
+        demo.append_history(history_statement(tmp_path / 'history.csv'))
+        spending = read_table(demo, 'spending')
+
+        report = demo.append_range(202305, 202307, demo=True, cache=False)
+
+        assert (report['budget'] > 0).all() and (report['monthly_summary'] > 0).all()
+        assert_frame_equal(read_table(demo, 'spending'), spending)
+        assert demo.check_monthly_summary() == []
+
+    def test_append_history_chunks(self, demo: pytest.fixture, tmp_path):
+        log_file = history_statement(tmp_path / 'history.csv')
+        demo.append_history(log_file)
+        expected = read_table(demo, 'spending')
+
+        demo.delete_all_db_tables()
+        demo.create_tables_in_db()
+        appended = demo.append_history(log_file, chunksize=50)
+
+        assert appended['spending'] == len(expected)
+        assert_frame_equal(read_table(demo, 'spending'), expected)
+        assert read_table(demo, 'months')['id'].tolist() == [202305, 202306, 202307]
+
+
+class TestWorkers:
+
+    def test_workers_give_identical_tables(self, demo: pytest.fixture):
+        demo.append_range(202305, 202307, demo=True, workers=1, cache=False)
+        expected = read_tables(demo)
+
+        demo.delete_all_db_tables()
+        demo.create_tables_in_db()
+        demo.append_range(202305, 202307, demo=True, workers=2, cache=False)
+
+        for table_name, df in read_tables(demo).items():
+            assert not df.empty, table_name
+            assert_frame_equal(df, expected[table_name], obj=table_name)
+
+
+class TestSkipIngested:
+
+    MONTH_IDS = [202305, 202306, 202307]
+    INVESTMENTS_VARIABLE = os.path.join('data', 'inputs', 'DEMO investments_variable_06_23.csv')
+
+    @pytest.fixture
+    def hashed(self, demo: pytest.fixture, monkeypatch):
+        # the demo months appended, then every file hashed from then on recorded
+        demo.append_range(202305, 202307, demo=True, cache=False)
+        paths = []
+
+        def file_sha256(path):
+            paths.append(os.path.normpath(path))
+            return sha256(path)
+
+        sha256 = pipe_module.file_sha256
+        monkeypatch.setattr(pipe_module, 'file_sha256', file_sha256)
+        yield paths
+
+    def test_unchanged_files_are_not_hashed(self, demo: pytest.fixture, hashed: pytest.fixture):
+        tasks, manifest = demo.skip_ingested(ingest_tasks(self.MONTH_IDS), demo=True)
+
+        assert tasks == [] and manifest == {}
+        assert hashed == []
+
+    def test_touched_file_is_hashed(self, demo: pytest.fixture, hashed: pytest.fixture):
+        stat = os.stat(self.INVESTMENTS_VARIABLE)
+        os.utime(self.INVESTMENTS_VARIABLE, (stat.st_atime, stat.st_mtime + 60))
+
+        tasks, _ = demo.skip_ingested(ingest_tasks(self.MONTH_IDS), demo=True)
+
+        assert tasks == []  # the contents are unchanged
+        assert hashed == [os.path.normpath(self.INVESTMENTS_VARIABLE)]
+
+    def test_changed_file_is_ingested(self, demo: pytest.fixture, hashed: pytest.fixture):
+        with open(self.INVESTMENTS_VARIABLE, 'a') as file:
+            file.write('\n')
+
+        tasks, manifest = demo.skip_ingested(ingest_tasks(self.MONTH_IDS), demo=True)
+
+        assert tasks == [('investments_variable', 202306)]
+        assert list(manifest) == [202306]
+        assert manifest[202306]['path'].tolist() == [os.path.normpath(self.INVESTMENTS_VARIABLE)]
+
+    def test_manifest_ids(self, demo: pytest.fixture, hashed: pytest.fixture):
+        ingested = read_table(demo, 'ingested_files')
+        fixed = ingested[ingested['source'] == 'investments_fixed']
+        monthly = ingested[ingested['source'] != 'investments_fixed']
+
+        # the file of every month is recorded for the month, the fixed investments once for every month
+        assert len(fixed) == 1 and fixed['month_id'].isna().all()
+        assert (fixed['id'] == fixed['sha256']).all()
+        assert len(monthly) == len(self.MONTH_IDS) * 3
+        assert (monthly['id'] == monthly['month_id'].astype(int).astype(str) + ' ' + monthly['sha256']).all()
+
+    def test_force(self, demo: pytest.fixture, hashed: pytest.fixture):
+        tasks = ingest_tasks(self.MONTH_IDS)
+
+        remaining, manifest = demo.skip_ingested(tasks, demo=True, force=True)
+
+        assert remaining == tasks
+        assert sorted(manifest) == self.MONTH_IDS
+        assert len(hashed) == len(tasks)
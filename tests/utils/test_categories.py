@@ -0,0 +1,33 @@
+import json
+import os
+
+import pytest
+
+from utils.categories import subcategory_mapping
+
+
+@pytest.fixture
+def json_file(tmp_path):
+    path = tmp_path / 'sub_category.json'
+    path.write_text(json.dumps({'Income': 'Income', 'Lunch': 'Food & Drink', 'Groceries': 'Food & Drink'}))
+    yield path
+
+
+class TestSubcategoryMapping:
+
+    def test_categorical_order(self, json_file: pytest.fixture):
+        mapping = subcategory_mapping(json_file)
+
+        assert list(mapping.subcategories.categories) == ['Income', 'Lunch', 'Groceries']
+        assert list(mapping.categories.categories) == ['Income', 'Food & Drink']
+        assert mapping.subcategories.ordered
+
+    def test_read_once_until_changed(self, json_file: pytest.fixture):
+        mapping = subcategory_mapping(json_file)
+        assert subcategory_mapping(json_file) is mapping
+
+        json_file.write_text(json.dumps({'Income': 'Income', 'Bills': 'Bills'}))
+        mtime = os.stat(json_file).st_mtime_ns + 1  # in case the file system's mtimes are coarse
+        os.utime(json_file, ns=(mtime, mtime))
+
+        assert subcategory_mapping(json_file).mapping == {'Income': 'Income', 'Bills': 'Bills'}
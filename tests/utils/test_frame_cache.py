@@ -0,0 +1,71 @@
+import os
+import time
+
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+
+from utils.frame_cache import FrameCache
+
+
+@pytest.fixture
+def input_file(tmp_path):
+    path = tmp_path / 'inputs_07_23.csv'
+    path.write_text('Category,Subcategory,Amount,Comment\nBUDGET,Groceries,100,\n')
+    yield path
+
+
+@pytest.fixture
+def frame_cache(tmp_path, input_file):
+    version_file = tmp_path / 'sub_category.json'
+    version_file.write_text('{}')
+    yield FrameCache(folder=tmp_path / 'cache', versioned_files=[version_file])
+
+
+class TestFrameCache:
+
+    frames = {'budget': pd.DataFrame({'id': ['202307 0000'], 'Date': [pd.Timestamp(2023, 7, 31)], 'Budget': [10000]}),
+              'income': pd.DataFrame({'id': ['202307 0000'], 'Amount': [250000]})}
+
+    def test_put_and_get(self, frame_cache: pytest.fixture, input_file: pytest.fixture):
+        key = frame_cache.key('inputs', 202307, input_file)
+        assert frame_cache.get(key) is None
+
+        frame_cache.put(key, self.frames)
+        cached = frame_cache.get(key)
+
+        assert cached.keys() == self.frames.keys()
+        for table_name, df in self.frames.items():
+            assert_frame_equal(cached[table_name], df)
+
+    def test_key_changes_with_file_and_version(self, tmp_path, frame_cache: pytest.fixture, input_file: pytest.fixture):
+        key = frame_cache.key('inputs', 202307, input_file)
+        assert frame_cache.key('inputs', 202308, input_file) != key
+
+        input_file.write_text('Category,Subcategory,Amount,Comment\nBUDGET,Groceries,200,\n')
+        assert frame_cache.key('inputs', 202307, input_file) != key
+
+        (tmp_path / 'sub_category.json').write_text('{"Groceries": "Food & Drink"}')
+        assert FrameCache(folder=frame_cache.folder, versioned_files=frame_cache.versioned_files).version != frame_cache.version
+
+    def test_evict_least_recently_used(self, frame_cache: pytest.fixture):
+        for key in ['a', 'b', 'c']:
+            frame_cache.put(key, self.frames)
+        for i, key in enumerate(['b', 'a', 'c']):  # last used order
+            os.utime(os.path.join(frame_cache.folder, key), (time.time() + i, time.time() + i))
+        entry_size = sum(os.path.getsize(os.path.join(frame_cache.folder, 'a', file))
+                         for file in os.listdir(os.path.join(frame_cache.folder, 'a')))
+
+        frame_cache.max_bytes = 2 * entry_size
+        assert frame_cache.evict() == 1
+        assert sorted(os.listdir(frame_cache.folder)) == ['a', 'c']
+
+    def test_evict_skips_files_and_entries_being_written(self, frame_cache: pytest.fixture):
+        frame_cache.put('a', self.frames)
+        os.makedirs(os.path.join(frame_cache.folder, '.tmp_b'))  # put() part way through
+        with open(os.path.join(frame_cache.folder, 'notes.txt'), 'w') as f:
+            f.write('not an entry')
+
+        frame_cache.max_bytes = 0
+        assert frame_cache.evict() == 1
+        assert sorted(os.listdir(frame_cache.folder)) == ['.tmp_b', 'notes.txt']
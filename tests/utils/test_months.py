@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+from utils.months import add_months, month_key, month_keys, month_label, month_period, month_range
+
+
+class TestMonthKeys:
+
+    def test_label_round_trip(self):
+        assert month_key('JUL 23') == 202307
+        assert month_key('jul 23') == 202307
+        assert month_label(202307) == 'JUL 23'
+
+    def test_period(self):
+        assert month_period(202302).end_time.normalize() == pd.Timestamp(2023, 2, 28)
+        with pytest.raises(ValueError):
+            month_period(202313)
+
+    def test_add_months_across_years(self):
+        assert add_months(202301, -1) == 202212
+        assert add_months(202212, 1) == 202301
+        assert add_months(202307, 18) == 202501
+        assert add_months(pd.Series([202301, 202307]), -1).tolist() == [202212, 202306]
+
+    def test_month_range(self):
+        assert month_range(202211, 202302) == [202211, 202212, 202301, 202302]
+        with pytest.raises(ValueError, match='FEB 23 is after NOV 22'):
+            month_range(202302, 202211)
+
+    def test_month_keys(self):
+        dates = pd.Series(pd.to_datetime(['2022-12-31 23:59:59', '2023-01-01 00:00:00']))
+
+        assert month_keys(dates).tolist() == [202212, 202301]